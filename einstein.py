@@ -1,17 +1,30 @@
-
+from array import array
+import copy
+import time
 
 class Attr:
+    __slots__ = ('name', 'order', 'ordered_values', 'values', 'tables')
+
     def __init__(self, name, order, values):
         self.name = name
         self.order = order
         self.ordered_values = [AttrValue(self, idx, v) for (idx, v) in zip(range(len(values)), values)]
         self.values = {v.value: v for v in self.ordered_values }
+        # neighbour tables by offset
+        self.tables = {}
 
     def value_at(self, index):
         if index >= 0 and index < len(self.ordered_values):
             return self.ordered_values[index]
         return None
 
+    # neighbours(offset)[index] is the value offset from the value at index, None if it is out of the attribute
+    def neighbours(self, offset):
+        table = self.tables.get(offset)
+        if table == None:
+            table = self.tables[offset] = tuple(self.value_at(index + offset) for index in range(len(self.ordered_values)))
+        return table
+
     def __getattr__(self, name):
         if name in self.values:
             return self.values[name]
@@ -30,19 +43,33 @@ class Attr:
         return str(self)
 
 
+# attribute of the consecutive integers from first to last, the values Offset, Distance and the ordinal
+# comparisons count positions by, e.g. house:ordinal:1 5
+class Ordinal(Attr):
+    __slots__ = ()
+
+    def __init__(self, name, order, first, last):
+        super().__init__(name, order, list(range(first, last + 1)))
+
+
 class AttrValue:
+    __slots__ = ('attr', 'index', 'value', 'hash')
+
     def __init__(self, attr, index, value):
         self.attr = attr
         self.index = index
         self.value = value
+        self.hash = hash((attr, value))
 
     def offset_value(self, offset):
         return self.attr.value_at(self.index + offset)
 
     def __hash__(self):
-        return hash((self.attr, self.value))
+        return self.hash
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if type(self) != type(other):
             return False
         return self.attr == other.attr and self.value == other.value
@@ -55,6 +82,8 @@ class AttrValue:
 
 
 class Relation:
+    __slots__ = ('atval1', 'atval2', 'hash', 'id')
+
     def __init__(self, atval1, atval2):
         assert(atval1.attr != atval2.attr)
         if atval1.attr.order < atval2.attr.order:
@@ -63,6 +92,9 @@ class Relation:
         else:
             self.atval1 = atval2
             self.atval2 = atval1
+        self.hash = hash((self.atval1, self.atval2))
+        # index in Solver.relation_list for the relations interned by a solver
+        self.id = None
 
     def with_attr(self, attr):
         return self.atval1.attr == attr or self.atval2.attr == attr
@@ -78,9 +110,11 @@ class Relation:
         return None
 
     def __hash__(self) -> int:
-        return hash((self.atval1, self.atval2))
+        return self.hash
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if type(self) != type(other):
             return False
         return self.atval1 == other.atval1 and self.atval2 == other.atval2
@@ -92,86 +126,1017 @@ class Relation:
         return str(self)
 
 
-class Solver:
-    def __init__(self, attrs):
-        self.map = {}
-        self.list = []
+# the relation can not be decided the way the rule requires
+class Contradiction(Exception):
+    def __init__(self, relation, rule):
+        super().__init__(str(relation) + " contradicts " + str(rule))
+        self.relation = relation
+        self.rule = rule
+
+
+# Solver.deadline passed before the search found a solution
+class Timeout(Exception):
+    def __init__(self, passes):
+        super().__init__("deadline passed after " + str(passes) + " passes")
+        self.passes = passes
+
+
+# decided relations between values of two attributes,
+# for every value a bitmask of the values of the other attribute indexed by AttrValue.index
+class RelationMatrix:
+    def __init__(self, attr1, attr2):
+        self.attr1 = attr1
+        self.attr2 = attr2
+        self.same = [0] * len(attr1.ordered_values)
+        self.same_t = [0] * len(attr2.ordered_values)
+        self.different = [0] * len(attr1.ordered_values)
+        self.different_t = [0] * len(attr2.ordered_values)
+
+    def copy(self):
+        other = RelationMatrix.__new__(RelationMatrix)
+        other.attr1 = self.attr1
+        other.attr2 = self.attr2
+        other.same = list(self.same)
+        other.same_t = list(self.same_t)
+        other.different = list(self.different)
+        other.different_t = list(self.different_t)
+        return other
+
+    def set_same(self, index1, index2):
+        self.same[index1] |= 1 << index2
+        self.same_t[index2] |= 1 << index1
+
+    def set_different(self, index1, index2):
+        self.different[index1] |= 1 << index2
+        self.different_t[index2] |= 1 << index1
+
+    def clear_same(self, index1, index2):
+        self.same[index1] &= ~(1 << index2)
+        self.same_t[index2] &= ~(1 << index1)
+
+    def clear_different(self, index1, index2):
+        self.different[index1] &= ~(1 << index2)
+        self.different_t[index2] &= ~(1 << index1)
+
+    def is_same(self, index1, index2):
+        return (self.same[index1] >> index2) & 1 == 1
+
+    def is_different(self, index1, index2):
+        return (self.different[index1] >> index2) & 1 == 1
+
+    def decided(self):
+        return sum(bin(same | different).count('1') for (same, different) in zip(self.same, self.different))
+
+    # no relation is both same and different, every value is the same as at most one value
+    # and is not different from all values of the other attribute
+    def consistent(self):
+        for (same, different, values) in ((self.same, self.different, self.attr2.ordered_values),
+                                          (self.same_t, self.different_t, self.attr1.ordered_values)):
+            all_values = (1 << len(values)) - 1
+            for index in range(len(same)):
+                if (same[index] & different[index]
+                    or same[index] & (same[index] - 1)
+                    or different[index] == all_values):
+                    return False
+        return True
+
+
+# union-find of the attribute values known to be the same entity, with the classes known to be different entities.
+# there is no path compression, so the log can undo merges in reverse order
+class Entities:
+    def __init__(self):
+        self.parent = {}
+        # root -> values of the class
+        self.members = {}
+        # root -> roots of the classes of different entities
+        self.excluded = {}
+        self.log = []
+
+    def find(self, atval):
+        parent = self.parent.get(atval)
+        while parent != None:
+            atval = parent
+            parent = self.parent.get(atval)
+        return atval
+
+    def class_of(self, atval):
+        root = self.find(atval)
+        return self.members.get(root, [root])
+
+    # joins the classes of the values, returns (atval1, atval2, same) facts it implies
+    def merge(self, atval1, atval2):
+        root1 = self.find(atval1)
+        root2 = self.find(atval2)
+        if root1 is root2:
+            return []
+        members1 = self.members.get(root1, [root1])
+        members2 = self.members.get(root2, [root2])
+        if len(members1) < len(members2):
+            (root1, root2, members1, members2) = (root2, root1, members2, members1)
+        excluded1 = self.excluded.get(root1, set())
+        excluded2 = self.excluded.get(root2, set())
+
+        facts = [(a1, a2, True) for a1 in members1 for a2 in members2 if a1.attr != a2.attr]
+        for (members, excluded, other_excluded) in ((members1, excluded2, excluded1), (members2, excluded1, excluded2)):
+            for root in excluded - other_excluded:
+                for a2 in self.members.get(root, [root]):
+                    facts.extend((a1, a2, False) for a1 in members if a1.attr != a2.attr)
+
+        # classes different from root2 are now different from root1
+        retargeted = []
+        for root in excluded2:
+            roots = self.excluded[root]
+            retargeted.append((root, root1 in roots))
+            roots.discard(root2)
+            roots.add(root1)
+
+        self.log.append((root1, root2, self.members.get(root1), self.excluded.get(root1), retargeted))
+        self.parent[root2] = root1
+        self.members[root1] = members1 + members2
+        self.excluded[root1] = excluded1 | excluded2
+        return facts
+
+    # marks the classes of the values as different entities, returns (atval1, atval2, same) facts it implies
+    def separate(self, atval1, atval2):
+        root1 = self.find(atval1)
+        root2 = self.find(atval2)
+        excluded1 = self.excluded.setdefault(root1, set())
+        if root1 is root2 or root2 in excluded1:
+            return []
+        excluded1.add(root2)
+        self.excluded.setdefault(root2, set()).add(root1)
+        self.log.append((root1, root2))
+        return [(a1, a2, False)
+                for a1 in self.members.get(root1, [root1])
+                for a2 in self.members.get(root2, [root2]) if a1.attr != a2.attr]
+
+    # the members lists are replaced, never changed, the sets of the excluded roots are copied
+    def copy(self):
+        other = Entities()
+        other.parent = dict(self.parent)
+        other.members = dict(self.members)
+        other.excluded = {root: set(roots) for (root, roots) in self.excluded.items()}
+        other.log = [entry if len(entry) == 2 or entry[3] == None else entry[:3] + (set(entry[3]), entry[4])
+                     for entry in self.log]
+        return other
+
+    def rollback(self, length):
+        while len(self.log) > length:
+            entry = self.log.pop()
+            if len(entry) == 2:
+                (root1, root2) = entry
+                self.excluded[root1].discard(root2)
+                self.excluded[root2].discard(root1)
+                continue
+            (root1, root2, members, excluded, retargeted) = entry
+            del self.parent[root2]
+            for (name, value) in (('members', members), ('excluded', excluded)):
+                if value == None:
+                    del getattr(self, name)[root1]
+                else:
+                    getattr(self, name)[root1] = value
+            for (root, had_root1) in retargeted:
+                roots = self.excluded[root]
+                roots.add(root2)
+                if not had_root1:
+                    roots.discard(root1)
+
+    def __str__(self):
+        return "Entities"
+
+
+# evaluate calls, non-None results and time per rule, and facts derived per pass
+class SolverStats:
+    def __init__(self):
+        # rule -> [evaluations, hits, seconds]
+        self.rules = {}
+        self.facts_per_pass = []
+
+    def evaluate(self, rule, solver, relation):
+        start = time.perf_counter()
+        result = rule.evaluate(solver, relation)
+        elapsed = time.perf_counter() - start
+        counters = self.rules.get(rule)
+        if counters == None:
+            counters = self.rules[rule] = [0, 0, 0.0]
+        counters[0] += 1
+        if result != None:
+            counters[1] += 1
+        counters[2] += elapsed
+        return result
+
+    def as_dict(self):
+        classes = {}
+        rules = []
+        for (rule, (evaluations, hits, seconds)) in self.rules.items():
+            name = type(rule).__name__
+            totals = classes.setdefault(name, {'evaluations': 0, 'hits': 0, 'seconds': 0.0})
+            totals['evaluations'] += evaluations
+            totals['hits'] += hits
+            totals['seconds'] += seconds
+            rules.append({'rule': str(rule), 'class': name, 'evaluations': evaluations, 'hits': hits, 'seconds': seconds})
+        rules.sort(key=lambda counters: counters['seconds'], reverse=True)
+        return {
+            'passes': len(self.facts_per_pass),
+            'facts_per_pass': list(self.facts_per_pass),
+            'evaluations': sum(totals['evaluations'] for totals in classes.values()),
+            'hits': sum(totals['hits'] for totals in classes.values()),
+            'seconds': sum(totals['seconds'] for totals in classes.values()),
+            'classes': classes,
+            'rules': rules,
+        }
+
+
+# limits of Solver.solve, reason is set to 'passes', 'evaluations' or 'deadline' when one is reached
+class SolveBudget:
+    def __init__(self, solver, max_passes=None, max_evaluations=None, deadline=None):
+        self.solver = solver
+        self.last_pass = None if max_passes == None else solver.passes + max_passes
+        self.max_evaluations = max_evaluations
+        self.deadline = deadline
+        self.evaluations = 0
+        self.reason = None
+
+    # between passes
+    def exceeded(self):
+        if self.last_pass != None and self.solver.passes >= self.last_pass:
+            self.reason = 'passes'
+        return self.reason != None or self.exhausted()
+
+    # between the relations of a pass
+    def exhausted(self):
+        if self.max_evaluations != None and self.evaluations >= self.max_evaluations:
+            self.reason = 'evaluations'
+        elif self.deadline != None and time.time() >= self.deadline:
+            self.reason = 'deadline'
+        return self.reason != None
+
+
+# what Solver.solve derived, and why it stopped: 'fixpoint', or the limit of SolveBudget it reached
+class SolveResult:
+    def __init__(self, solver, reason, trail_length):
+        self.reason = reason
+        # (relation, is same, source) decided by the solve, in order
+        self.decisions = [entry for entry in solver.trail[trail_length:] if isinstance(entry, tuple)]
+        self.decided = solver.decided_count()
+        self.relations = solver.relation_count()
+
+    @property
+    def complete(self):
+        return self.reason == 'fixpoint'
+
+    # Same and Different facts derived by the solve
+    @property
+    def facts(self):
+        return [Same(relation) if same else Different(relation) for (relation, same, _) in self.decisions]
+
+    def percent_decided(self):
+        return 100.0 * self.decided / self.relations if self.relations else 100.0
+
+    def __str__(self):
+        return (self.reason + ": " + str(len(self.decisions)) + " facts, " +
+                "%.1f%% of relations decided" % self.percent_decided())
+
+
+# Attributes with their interned relations and the compiled rules, immutable once built and shared by the solvers
+# solving it. A Solver is the mutable state of a solve, the decided relations, trail and pending relations.
+#
+# puzzle = Puzzle(attrs, [Exclusive(), ...])
+# solver = puzzle.solver()          - any number of them, copies of the state with the clues decided
+#
+# Rules get the state they read as an argument, so the solvers of a puzzle can be used from different threads.
+class Puzzle:
+    def __init__(self, attrs, rules=()):
         self.attrs = attrs
+        # interned relations by Relation.id,
+        # and relation_grid[order1][order2][index1][index2] for both orders of every pair of attributes
+        self.relation_list = []
+        self.relation_grid = {attr.order: {} for attr in attrs}
+        for i in range(len(attrs)):
+            attr1 = attrs[i]
+            for j in range(i+1, len(attrs)):
+                attr2 = attrs[j]
+                rows = []
+                for atval1 in attr1.ordered_values:
+                    row = []
+                    for atval2 in attr2.ordered_values:
+                        relation = Relation(atval1, atval2)
+                        relation.id = len(self.relation_list)
+                        self.relation_list.append(relation)
+                        row.append(relation)
+                    rows.append(row)
+                self.relation_grid[attr1.order][attr2.order] = rows
+                self.relation_grid[attr2.order][attr1.order] = [list(column) for column in zip(*rows)]
+
+        # rules by the attribute values they watch, rules watching None are evaluated on every relation
+        self.rules = list(rules)
+        self.watchers = {}
+        self.global_rules = []
+        # relations every solver evaluates first, and (relation, is same, rule) of the clues
+        self.candidates = {}
+        self.facts = []
+        for rule in self.rules:
+            watches = rule.watches()
+            if watches == None:
+                self.global_rules.append(rule)
+            else:
+                for atval in watches:
+                    self.watchers.setdefault(atval, []).append(rule)
+            # the relations are the ones of every solver of the puzzle
+            self.candidates.update(dict.fromkeys(rule.candidates(self)))
+            if hasattr(rule, 'relation') and rule.relation != None:
+                relation = self.relation(rule.relation.atval1, rule.relation.atval2)
+                self.facts.append((relation, isinstance(rule, Same), rule))
+        # the state with the facts decided, made by the first solver()
+        self.root = None
+
+    def relations(self):
+        return self.relation_list
+
+    # the interned relation of the values
+    def relation(self, atval1, atval2):
+        return self.relation_grid[atval1.attr.order][atval2.attr.order][atval1.index][atval2.index]
+
+    def solver(self, backend=None):
+        if self.root == None:
+            self.root = Solver(self.attrs, None, self)
+        return self.root.copy(backend)
+
+
+class Solver:
+    # backend - class propagating the rules instead of iter, constructed with the solver, e.g. NumpyBackend
+    # puzzle - Puzzle of the attrs to share the relations and rules of, a puzzle of its own by default
+    def __init__(self, attrs, backend=None, puzzle=None):
+        if puzzle == None:
+            puzzle = Puzzle(attrs)
+        self.puzzle = puzzle
+        self.attrs = puzzle.attrs
+        # matrices by the pair of Attr.order, first order is always the lower one, as in Relation
+        self.matrices = {}
+        for attr1 in self.attrs:
+            for attr2 in self.attrs:
+                if attr1.order < attr2.order:
+                    self.matrices[(attr1.order, attr2.order)] = RelationMatrix(attr1, attr2)
+        self.relation_list = puzzle.relation_list
+        self.relation_grid = puzzle.relation_grid
+        # provenance of the decided relations by Relation.id: the position of the decision in trail, -1 while
+        # undecided, and the id of the decided relation Solver.entities derived it from, see justification
+        self.positions = array('i', [-1]) * len(self.relation_list)
+        self.implied_by = array('i', [-1]) * len(self.relation_list)
         self.debug = False
+        # the rules and their indexes of the puzzle, copied by the first add
+        self.list = puzzle.rules
+        self.watchers = puzzle.watchers
+        self.global_rules = puzzle.global_rules
+        self.shared_rules = True
+        # relations to evaluate on the next pass, dict is used as an ordered set
+        self.pending = dict(puzzle.candidates)
+        self.passes = 0
+        # SolverStats to profile the rules with, off by default
+        self.stats = None
+        self.backend = None if backend == None else backend(self)
+        # added rules and (relation, is same, source) for newly decided relations, in order, to roll them back
+        self.trail = []
+        # Same and Different facts are propagated through the classes of the same entities
+        self.entities = Entities()
+        # checkpoints of push()
+        self.checkpoints = []
+        # (Subsets.size, order1, order2) -> (different rows of attr1 over attr2, claims), see Subsets.claims,
+        # (Subsets.size,) -> matrix key -> its different rows at the last Subsets.stalled
+        self.claims = {}
+        # default deadline of solve, a time.time(), search raises Timeout when it passes
+        self.deadline = None
+
+        for (relation, same, rule) in puzzle.facts:
+            self.decide(relation, same, rule)
 
-    def add(self, rule):
-        rule.solver = self
+    # a solver in the same state sharing the puzzle, e.g. for a branch of a search or a variant with more clues
+    def copy(self, backend=None):
+        other = copy.copy(self)
+        if not self.shared_rules:
+            other.list = list(self.list)
+            other.global_rules = list(self.global_rules)
+            other.watchers = {atval: list(rules) for (atval, rules) in self.watchers.items()}
+        other.matrices = {key: matrix.copy() for (key, matrix) in self.matrices.items()}
+        other.positions = array('i', self.positions)
+        other.implied_by = array('i', self.implied_by)
+        other.pending = dict(self.pending)
+        other.stats = None
+        other.backend = None if backend == None else backend(other)
+        other.entities = self.entities.copy()
+        other.trail = [(entry[0], entry[1], other.entities) if isinstance(entry, tuple) and entry[2] is self.entities
+                       else entry for entry in self.trail]
+        other.checkpoints = list(self.checkpoints)
+        other.claims = dict(self.claims)
+        return other
+
+    # source is the rule which derived the added Same or Different, if any
+    def add(self, rule, source=None):
+        if self.shared_rules:
+            self.list = list(self.list)
+            self.global_rules = list(self.global_rules)
+            self.watchers = {atval: list(rules) for (atval, rules) in self.watchers.items()}
+            self.shared_rules = False
 
         self.list.append(rule)
+        self.trail.append(rule)
+        watches = rule.watches()
+        if watches == None:
+            self.global_rules.append(rule)
+        else:
+            for atval in watches:
+                self.watchers.setdefault(atval, []).append(rule)
+
+        self.enqueue(rule.candidates(self))
         if hasattr(rule, 'relation') and rule.relation != None:
-            self.map[rule.relation] = rule
+            self.decide(rule.relation, isinstance(rule, Same), source or rule)
         return self
+
+    # raises Contradiction if the relation is already decided otherwise,
+    # the value would get two same values, or would be different from all values of the other attribute
+    def decide(self, relation, same, source, premise=None):
+        relation = self.relation(relation.atval1, relation.atval2)
+        matrix = self.matrix(relation)
+        index1 = relation.atval1.index
+        index2 = relation.atval2.index
+        if same:
+            if matrix.is_same(index1, index2):
+                return
+            if matrix.is_different(index1, index2) or matrix.same[index1] or matrix.same_t[index2]:
+                raise Contradiction(relation, source)
+            matrix.set_same(index1, index2)
+        else:
+            if matrix.is_different(index1, index2):
+                return
+            if (matrix.is_same(index1, index2)
+                or matrix.different[index1] | (1 << index2) == (1 << len(matrix.different_t)) - 1
+                or matrix.different_t[index2] | (1 << index1) == (1 << len(matrix.different)) - 1):
+                raise Contradiction(relation, source)
+            matrix.set_different(index1, index2)
+
+        self.positions[relation.id] = len(self.trail)
+        self.implied_by[relation.id] = -1 if premise == None else premise.id
+        self.trail.append((relation, same, source))
+        # rules which did not decide the relation are checked against it on the next pass
+        self.pending[relation] = None
+        for other in self.rules_for(relation):
+            self.enqueue(other.affected(self, relation))
+
+        atval1 = relation.atval1
+        atval2 = relation.atval2
+        if same:
+            # a value is the same as only one value of the other attribute
+            for other in atval2.attr.ordered_values:
+                if other is not atval2:
+                    self.decide_implied(atval1, other, False, relation)
+            for other in atval1.attr.ordered_values:
+                if other is not atval1:
+                    self.decide_implied(other, atval2, False, relation)
+            facts = self.entities.merge(atval1, atval2)
+        else:
+            facts = self.entities.separate(atval1, atval2)
+        for (fact_atval1, fact_atval2, fact_same) in facts:
+            self.decide_implied(fact_atval1, fact_atval2, fact_same, relation)
+
+    def decide_implied(self, atval1, atval2, same, premise):
+        relation = self.relation(atval1, atval2)
+        if self.debug and relation not in self:
+            print(("Same " if same else "Different ") + str(relation), "     <-  ", self.entities, "on", premise)
+        self.decide(relation, same, self.entities, premise)
+
+    # raises Contradiction if a rule decides the relation otherwise
+    def check(self, relation):
+        same = self.is_same(relation)
+        stats = self.stats
+        for rule in self.rules_for(relation):
+            if stats == None:
+                result = rule.evaluate(self, relation)
+            else:
+                result = stats.evaluate(rule, self, relation)
+            if result != None and isinstance(result, Same) != same:
+                raise Contradiction(relation, rule)
+
+    # rules which can fire on the relation or be affected by its decision
+    def rules_for(self, relation):
+        return (self.global_rules
+            + self.watchers.get(relation.atval1, [])
+            + self.watchers.get(relation.atval2, []))
+
+    # decided relations are enqueued as well, to be checked for contradictions
+    def enqueue(self, relations):
+        for relation in relations:
+            self.pending[relation] = None
+
+    def relations(self):
+        return self.relation_list
+
+    # the interned relation of the values
+    def relation(self, atval1, atval2):
+        return self.relation_grid[atval1.attr.order][atval2.attr.order][atval1.index][atval2.index]
     
+    def matrix(self, relation):
+        return self.matrices[(relation.atval1.attr.order, relation.atval2.attr.order)]
+
     def get(self, relation):
-        if relation not in self.map:
-            return None
-        return self.map[relation]
+        if self.is_same(relation):
+            return Same(relation)
+        if self.is_different(relation):
+            return Different(relation)
+        return None
 
     def is_same(self, relation):
-        return relation in self.map and isinstance(self.map[relation], Same)
+        return self.matrix(relation).is_same(relation.atval1.index, relation.atval2.index)
 
     def is_different(self, relation):
-        return relation in self.map and isinstance(self.map[relation], Different)
+        return self.matrix(relation).is_different(relation.atval1.index, relation.atval2.index)
+
+    # is_same and is_different for the values, without their relation
+    def are_same(self, atval1, atval2):
+        return (self.same_mask(atval1, atval2.attr) >> atval2.index) & 1 == 1
+
+    def are_different(self, atval1, atval2):
+        return (self.different_mask(atval1, atval2.attr) >> atval2.index) & 1 == 1
+
+    # bitmask of the values of attr which are known to be the same as atval
+    def same_mask(self, atval, attr):
+        if atval.attr.order < attr.order:
+            return self.matrices[(atval.attr.order, attr.order)].same[atval.index]
+        return self.matrices[(attr.order, atval.attr.order)].same_t[atval.index]
+
+    # bitmask of the values of attr which are known to be different from atval
+    def different_mask(self, atval, attr):
+        if atval.attr.order < attr.order:
+            return self.matrices[(atval.attr.order, attr.order)].different[atval.index]
+        return self.matrices[(attr.order, atval.attr.order)].different_t[atval.index]
     
-    def solve(self):
-        while self.iter():
-            pass
+    # propagates the rules to a fixpoint, or until a limit is reached, returns SolveResult.
+    # The relations a limit leaves unevaluated stay pending for the next solve.
+    # A backend checks max_passes and the deadline between its passes, it does not count evaluations.
+    def solve(self, max_passes=None, max_evaluations=None, deadline=None):
+        trail_length = len(self.trail)
+        if deadline == None:
+            deadline = self.deadline
+        budget = None
+        if max_passes != None or max_evaluations != None or deadline != None:
+            budget = SolveBudget(self, max_passes, max_evaluations, deadline)
+        if self.backend != None:
+            if max_evaluations != None:
+                raise ValueError("max_evaluations is not supported by " + str(self.backend))
+            self.backend.solve(budget)
+        else:
+            while budget == None or not budget.exceeded():
+                if self.iter(budget):
+                    continue
+                if (budget != None and budget.reason != None) or not self.stalled():
+                    break
+        return SolveResult(self, 'fixpoint' if budget == None or budget.reason == None else budget.reason, trail_length)
 
-    def iter(self):
+    # rules with stalled(), such as Subsets, derive facts from the fixpoint the other rules reach,
+    # returns whether they derived any
+    def stalled(self):
         success = False
-        for i in range(len(self.attrs)):
-            attr1 = self.attrs[i]
-            for j in range(i+1, len(self.attrs)):
-                attr2 = self.attrs[j]
-                for atval1 in attr1.ordered_values:
-                    for atval2 in attr2.ordered_values:
-                        relation = Relation(atval1, atval2)
-                        if relation in self.map:
-                            continue
-                        for rule in self.list:
-                            result = rule.evaluate(relation)
-                            if result == None:
-                                continue
-                            success = True
-                            self.add(result)
-                            if self.debug:
-                                print(result, "     <-  ", rule, "on", relation)
-                            break
+        for rule in self.list:
+            if not hasattr(rule, 'stalled'):
+                continue
+            for result in rule.stalled(self):
+                if result.relation not in self:
+                    if self.debug:
+                        print(result, "     <-  ", rule)
+                    self.decide(result.relation, isinstance(result, Same), rule)
+                    success = True
+        return success
+
+    def checkpoint(self):
+        return (len(self.trail), dict(self.pending), len(self.entities.log))
+
+    # undo everything added since the checkpoint
+    def rollback(self, checkpoint):
+        (length, pending, entities_length) = checkpoint
+        self.entities.rollback(entities_length)
+        while len(self.trail) > length:
+            entry = self.trail.pop()
+            if isinstance(entry, tuple):
+                (relation, same, _) = entry
+                self.positions[relation.id] = -1
+                if same:
+                    self.matrix(relation).clear_same(relation.atval1.index, relation.atval2.index)
+                else:
+                    self.matrix(relation).clear_different(relation.atval1.index, relation.atval2.index)
+                continue
+            self.list.pop()
+            watches = entry.watches()
+            if watches == None:
+                self.global_rules.pop()
+            else:
+                for atval in watches:
+                    self.watchers[atval].pop()
+        self.pending = dict(pending)
+
+    # (relation, same, source, premises) of a decided relation, None for an undecided one.
+    # premises are the relations decided before it the source derived it from,
+    # sources without premises(), such as clues, search guesses and backends, have none
+    def justification(self, relation):
+        relation = self.relation(relation.atval1, relation.atval2)
+        position = self.positions[relation.id]
+        if position < 0:
+            return None
+        (_, same, source) = self.trail[position]
+        if source is self.entities:
+            premises = self.entity_premises(relation, same, position)
+        elif hasattr(source, 'premises'):
+            premises = source.premises(self, relation, same, position)
+        else:
+            premises = []
+        return (relation, same, source, premises)
+
+    # justifications of the relation and of every premise it depends on, in the order they were decided
+    def explain(self, relation):
+        justification = self.justification(relation)
+        if justification == None:
+            return []
+        chain = [justification]
+        seen = {justification[0].id}
+        for (_, _, _, premises) in chain:
+            for premise in premises:
+                if premise.id not in seen:
+                    seen.add(premise.id)
+                    chain.append(self.justification(premise))
+        chain.sort(key=lambda justification: self.positions[justification[0].id])
+        return chain
+
+    def decided_before(self, relation, same, position):
+        decided_at = self.positions[relation.id]
+        return decided_at >= 0 and decided_at < position and self.is_same(relation) == same
+
+    # Solver.entities derives a relation from an earlier fact about values of the same entities:
+    # atval1 ~ p, p ~ q (or p !~ q), q ~ atval2, or atval1 ~ p where p is another value of the attribute of atval2
+    def entity_premises(self, relation, same, position):
+        links1 = self.links(relation.atval1, position)
+        links2 = self.links(relation.atval2, position)
+        if not same:
+            for (links, other) in ((links1, relation.atval2), (links2, relation.atval1)):
+                for (p, bridge) in links:
+                    if p.attr == other.attr and p is not other:
+                        return bridge
+
+        found = None
+        for (p, bridge1) in links1:
+            for (q, bridge2) in links2:
+                if p.attr == q.attr:
+                    continue
+                fact = self.relation(p, q)
+                if fact is not relation and self.decided_before(fact, same, position):
+                    premises = [fact] + bridge1 + bridge2
+                    if found == None or len(premises) < len(found):
+                        found = premises
+        if found != None:
+            return found
+        premise_id = self.implied_by[relation.id]
+        return [] if premise_id < 0 else [self.relation_list[premise_id]]
+
+    # (value, [its Same relation with atval]) for atval and the values decided the same as atval before position
+    def links(self, atval, position):
+        links = [(atval, [])]
+        for other in self.entities.class_of(atval):
+            if other.attr != atval.attr:
+                relation = self.relation(atval, other)
+                if self.decided_before(relation, True, position):
+                    links.append((other, [relation]))
+        return links
+
+    # rules which decided a relation, propagation decides the same relations without the other rules
+    def used_rules(self):
+        return set(entry[2] for entry in self.trail if isinstance(entry, tuple))
+
+    # rules and facts added after push(), and everything derived from them, are retracted by the matching pop().
+    # rules can be added after solve(), the next solve() propagates only their consequences
+    def push(self):
+        self.checkpoints.append(self.checkpoint())
+        return self
+
+    def pop(self):
+        self.rollback(self.checkpoints.pop())
+        return self
+
+    def consistent(self):
+        return all(matrix.consistent() for matrix in self.matrices.values())
+
+    def decided_count(self):
+        return sum(matrix.decided() for matrix in self.matrices.values())
+
+    def relation_count(self):
+        return sum(len(matrix.same) * len(matrix.same_t) for matrix in self.matrices.values())
+
+    # no rule contradicts the decided relations
+    def verify(self):
+        try:
+            for relation in self.relations():
+                if relation in self:
+                    self.check(relation)
+        except Contradiction:
+            return False
+        return True
+
+    # undecided relation of the value with the fewest possible values left
+    def choose(self):
+        best = None
+        best_count = None
+        for matrix in self.matrices.values():
+            for (atvals, others, same, different) in (
+                    (matrix.attr1.ordered_values, matrix.attr2.ordered_values, matrix.same, matrix.different),
+                    (matrix.attr2.ordered_values, matrix.attr1.ordered_values, matrix.same_t, matrix.different_t)):
+                all_others = (1 << len(others)) - 1
+                for atval in atvals:
+                    if same[atval.index]:
+                        continue
+                    possible = all_others & ~different[atval.index]
+                    count = bin(possible).count('1')
+                    if best == None or count < best_count:
+                        best = self.relation(atval, others[(possible & -possible).bit_length() - 1])
+                        best_count = count
+                        if count <= 2:
+                            return best
+        return best
+
+    # propagation with depth first search when it stalls: an undecided relation is tried as Same,
+    # then as Different, rolling the state back to a checkpoint when a Contradiction is found.
+    # returns False and restores the state if the rules have no solution
+    def search(self):
+        for _ in self.solutions():
+            return True
+        return False
 
+    # the first solutions up to limit, as assignments(), the solver is rolled back to its state before
+    def count_solutions(self, limit=2):
+        root = self.checkpoint()
+        found = []
+        for _ in self.solutions():
+            found.append(self.assignment())
+            if len(found) >= limit:
+                break
+        self.rollback(root)
+        return found
+
+    # depth first search, yields in the state of every solution,
+    # rolls back to the state before when there are no more
+    def solutions(self):
+        root = self.checkpoint()
+        # relations tried as Same with the checkpoints to try them as Different
+        stack = []
+        fact = None
+        while True:
+            try:
+                if fact != None:
+                    self.decide(fact.relation, isinstance(fact, Same), fact)
+                if self.solve().reason == 'deadline':
+                    raise Timeout(self.passes)
+                solved = True
+            except Contradiction:
+                solved = False
+
+            if solved:
+                relation = self.choose()
+                if relation != None:
+                    stack.append((self.checkpoint(), relation))
+                    fact = Same(relation)
+                    continue
+                yield
+
+            if not stack:
+                self.rollback(root)
+                return
+            (checkpoint, relation) = stack.pop()
+            self.rollback(checkpoint)
+            fact = Different(relation)
+
+    # entities of a solved state, ordered by the values of the first attribute,
+    # each a tuple of its values of every attribute
+    def assignment(self):
+        return [tuple(atval if attr is atval.attr else attr.value_at(self.same_mask(atval, attr).bit_length() - 1)
+                      for attr in self.attrs)
+                for atval in self.attrs[0].ordered_values]
+
+    # one pass over the relations enqueued since the previous pass,
+    # new facts enqueue only the relations their rules can affect.
+    # budget - SolveBudget, the pass stops when it is exhausted
+    def iter(self, budget=None):
+        success = False
+        pending, self.pending = self.pending, {}
+        self.passes += 1
+        stats = self.stats
+        trail_length = len(self.trail)
+        for (done, relation) in enumerate(pending):
+            if budget != None and budget.exhausted():
+                # the rest of the pass comes first in the next one
+                rest = dict.fromkeys(list(pending)[done:])
+                rest.update(self.pending)
+                self.pending = rest
+                break
+            if relation in self:
+                if budget != None:
+                    budget.evaluations += len(self.rules_for(relation))
+                self.check(relation)
+                continue
+            for rule in self.rules_for(relation):
+                if budget != None:
+                    budget.evaluations += 1
+                if stats == None:
+                    result = rule.evaluate(self, relation)
+                else:
+                    result = stats.evaluate(rule, self, relation)
+                if result == None:
+                    continue
+                success = True
+                if self.debug:
+                    print(result, "     <-  ", rule, "on", relation)
+                self.decide(result.relation, isinstance(result, Same), rule)
+                break
+
+        if stats != None:
+            stats.facts_per_pass.append(len(self.trail) - trail_length)
         return success
 
     def __contains__(self, relation):
-        return relation in self.map
+        matrix = self.matrix(relation)
+        index1 = relation.atval1.index
+        index2 = relation.atval2.index
+        return matrix.is_same(index1, index2) or matrix.is_different(index1, index2)
 
 
 class Exclusive:
-    def __init__(self):
-        self.solver = None
-
-    def evaluate(self, relation):
+    def evaluate(self, solver, relation):
         a1 = relation.atval1
         a2 = relation.atval2
-        #if self.solver.debug:
-        #    print("Exclusive", relation, self.check_all_filled(a1, a2), self.check_all_filled(a2, a1))
-        if self.check_all_filled(a1, a2) or self.check_all_filled(a2, a1):
+        #if solver.debug:
+        #    print("Exclusive", relation, self.check_all_filled(solver, a1, a2), self.check_all_filled(solver, a2, a1))
+        if self.check_all_filled(solver, a1, a2) or self.check_all_filled(solver, a2, a1):
             return Same(relation)
 
-    def check_all_filled(self, fixed: AttrValue, sliding: AttrValue):
-        for slider in sliding.attr.values.values():
-            if slider == sliding:
-                continue
-            if not self.solver.is_different(Relation(fixed, slider)):
-                return False
-        return True
+    def check_all_filled(self, solver, fixed: AttrValue, sliding: AttrValue):
+        all_values = (1 << len(sliding.attr.ordered_values)) - 1
+        different = solver.different_mask(fixed, sliding.attr)
+        return different | (1 << sliding.index) == all_values
+
+    # Same because every other value of a row or a column was different
+    def premises(self, solver, relation, same, position):
+        for (fixed, sliding) in ((relation.atval1, relation.atval2), (relation.atval2, relation.atval1)):
+            others = [solver.relation(fixed, other) for other in sliding.attr.ordered_values if other is not sliding]
+            if all(solver.decided_before(other, False, position) for other in others):
+                return others
+        return []
     
+    def watches(self):
+        return None
+
+    def candidates(self, solver):
+        return solver.relations()
+
+    # the rows of both values of the decided relation
+    def affected(self, solver, relation):
+        a1 = relation.atval1
+        a2 = relation.atval2
+        grid = solver.relation_grid
+        yield from grid[a1.attr.order][a2.attr.order][a1.index]
+        yield from grid[a2.attr.order][a1.attr.order][a2.index]
+
     def __str__(self):
         return "Exclusive"
 
+# Reasoning on the possible values beyond Exclusive, on the fixpoint the other rules reach:
+# - naked subsets: size or fewer values of an attribute which can only be the same as as many values of another
+#   attribute take those values, the other values are different from them. A hidden subset of one attribute
+#   is the naked subset of the other one, so both orders of every pair are checked.
+# - consistency: two values which can not be the same as any common value of a third attribute are different
+class Subsets:
+    def __init__(self, size=3):
+        self.size = size
+
+    def evaluate(self, solver, relation):
+        a1 = relation.atval1
+        a2 = relation.atval2
+        if ((self.claims(solver, a1.attr, a2.attr)[a1.index] >> a2.index) & 1
+            or (self.claims(solver, a2.attr, a1.attr)[a2.index] >> a1.index) & 1
+            or self.disjoint(solver, a1, a2)):
+            return Different(relation)
+        return None
+
+    # Different for the undecided relations evaluate decides, called by Solver.solve when the other rules stall.
+    # The matrices without a value whose different rows changed since the last call are skipped, their claims
+    # are the same, and disjoint is checked again only for the relations of such values
+    def stalled(self, solver):
+        key = (self.size,)
+        checked = solver.claims.get(key, {})
+        rows = {}
+        changed = set()
+        # atval -> masks(), taken again after a Different is decided
+        masks = {}
+        for (matrix_key, matrix) in solver.matrices.items():
+            rows[matrix_key] = (list(matrix.different), list(matrix.different_t))
+            old = checked.get(matrix_key)
+            for (position, atvals) in enumerate((matrix.attr1.ordered_values, matrix.attr2.ordered_values)):
+                for atval in atvals:
+                    if old == None or old[position][atval.index] != rows[matrix_key][position][atval.index]:
+                        changed.add(atval)
+
+        for matrix in solver.matrices.values():
+            attr1 = matrix.attr1
+            attr2 = matrix.attr2
+            changed1 = [atval in changed for atval in attr1.ordered_values]
+            changed2 = [atval in changed for atval in attr2.ordered_values]
+            if not any(changed1) and not any(changed2):
+                continue
+            all_values = (1 << len(attr2.ordered_values)) - 1
+            claims1 = self.claims(solver, attr1, attr2)
+            claims2 = self.claims(solver, attr2, attr1)
+            grid = solver.relation_grid[attr1.order][attr2.order]
+            for index1 in range(len(grid)):
+                if matrix.same[index1]:
+                    continue
+                undecided = all_values & ~matrix.different[index1]
+                while undecided:
+                    bit = undecided & -undecided
+                    undecided ^= bit
+                    index2 = bit.bit_length() - 1
+                    relation = grid[index1][index2]
+                    if claims1[index1] & bit or (claims2[index2] >> index1) & 1:
+                        yield Different(relation)
+                        masks.clear()
+                    elif changed1[index1] or changed2[index2]:
+                        for atval in (relation.atval1, relation.atval2):
+                            if atval not in masks:
+                                masks[atval] = self.masks(solver, atval)
+                        if any(mask1 & mask2 == 0 for (mask1, mask2) in zip(masks[relation.atval1],
+                                                                            masks[relation.atval2])):
+                            yield Different(relation)
+                            masks.clear()
+        # the relations found Different are decided after the rows were taken, so they are checked again next time
+        solver.claims[key] = rows
+
+    # bitmask of the values of attr atval is not known to be different from
+    def possible(self, solver, atval, attr):
+        return ((1 << len(attr.ordered_values)) - 1) & ~solver.different_mask(atval, attr)
+
+    # claims[index] is the bitmask of the values of attr2 taken by the naked subsets without the value of attr1 at index,
+    # computed again only when the different values of the attributes change
+    def claims(self, solver, attr1, attr2):
+        if attr1.order < attr2.order:
+            different = solver.matrices[(attr1.order, attr2.order)].different
+        else:
+            different = solver.matrices[(attr2.order, attr1.order)].different_t
+        key = (self.size, attr1.order, attr2.order)
+        cached = solver.claims.get(key)
+        if cached != None and cached[0] == different:
+            return cached[1]
+
+        all_values = (1 << len(attr2.ordered_values)) - 1
+        rows = [all_values & ~row for row in different]
+        small = [index for index in range(len(rows)) if bin(rows[index]).count('1') <= self.size]
+        claims = [0] * len(rows)
+        self.find(rows, small, 0, [], 0, claims)
+        solver.claims[key] = (list(different), claims)
+        return claims
+
+    # extends the subset of members with small[start:], until it has as many values as members
+    def find(self, rows, small, start, members, union, claims):
+        for position in range(start, len(small)):
+            index = small[position]
+            extended = union | rows[index]
+            if bin(extended).count('1') > self.size:
+                continue
+            members.append(index)
+            if bin(extended).count('1') == len(members):
+                for other in range(len(rows)):
+                    if other not in members:
+                        claims[other] |= extended
+            elif len(members) < self.size:
+                self.find(rows, small, position + 1, members, extended, claims)
+            members.pop()
+
+    # possible() of atval for every attribute, all bits set for its own attribute, so the masks of the values of an
+    # undecided relation have no bit in common only for an attribute disjoint() checks
+    def masks(self, solver, atval):
+        return [-1 if attr is atval.attr else self.possible(solver, atval, attr) for attr in solver.attrs]
+
+    def disjoint(self, solver, atval1, atval2):
+        for attr in solver.attrs:
+            if attr is not atval1.attr and attr is not atval2.attr:
+                if self.possible(solver, atval1, attr) & self.possible(solver, atval2, attr) == 0:
+                    return True
+        return False
+
+    # evaluated by stalled() only
+    def watches(self):
+        return ()
+
+    def candidates(self, solver):
+        return ()
+
+    def affected(self, solver, relation):
+        return ()
+
+    def __str__(self):
+        return "Subsets(" + str(self.size) + ")"
+
 class Offset:
     # дом не такой = дом не существует, или не такой
 
@@ -189,36 +1154,78 @@ class Offset:
     def __init__(self, atval1, atval2, offset_attr, offset):
         assert(offset != 0)
 
-        self.solver = None
         self.atval1 = atval1
         self.atval2 = atval2
         self.offset_attr = offset_attr
         self.offset = offset
+        # values of offset_attr offset before and after the value at index
+        self.before = offset_attr.neighbours(-offset)
+        self.after = offset_attr.neighbours(+offset)
 
-    def evaluate(self, relation):
+    def evaluate(self, solver, relation):
         if not relation.with_attr(self.offset_attr):
             return None
 
         cur_offset_val = relation.atval(self.offset_attr)
         
         if relation.with_atval(self.atval1):
-            offset_val = cur_offset_val.offset_value(-self.offset)
+            offset_val = self.before[cur_offset_val.index]
             if (offset_val == None
-                or self.solver.is_different(Relation(offset_val, self.atval2))):
+                or solver.are_different(offset_val, self.atval2)):
                 return Different(relation)
             if (offset_val != None
-                and self.solver.is_same(Relation(offset_val, self.atval2))):
+                and solver.are_same(offset_val, self.atval2)):
                 return Same(relation)
 
         if relation.with_atval(self.atval2):
-            offset_val = cur_offset_val.offset_value(+self.offset)
+            offset_val = self.after[cur_offset_val.index]
             if (offset_val == None
-                or self.solver.is_different(Relation(offset_val, self.atval1))):
+                or solver.are_different(offset_val, self.atval1)):
                 return Different(relation)
             if (offset_val != None
-                and self.solver.is_same(Relation(offset_val, self.atval1))):
+                and solver.are_same(offset_val, self.atval1)):
                 return Same(relation)
+
+    # the relation of the value offset from the relation, none if it is out of the attribute
+    def premises(self, solver, relation, same, position):
+        cur_offset_val = relation.atval(self.offset_attr)
+        for (atval, other, table) in ((self.atval1, self.atval2, self.before), (self.atval2, self.atval1, self.after)):
+            if not relation.with_atval(atval):
+                continue
+            offset_val = table[cur_offset_val.index]
+            if offset_val == None:
+                if not same:
+                    return []
+                continue
+            premise = solver.relation(offset_val, other)
+            if solver.decided_before(premise, same, position):
+                return [premise]
+        return []
             
+    def watches(self):
+        return (self.atval1, self.atval2)
+
+    def candidates(self, solver):
+        for atval in self.offset_attr.ordered_values:
+            yield solver.relation(atval, self.atval1)
+            yield solver.relation(atval, self.atval2)
+
+    # (X, atval1) depends on (X-offset, atval2), (X, atval2) depends on (X+offset, atval1)
+    def affected(self, solver, relation):
+        cur_offset_val = relation.atval(self.offset_attr)
+        if cur_offset_val == None:
+            return
+
+        if relation.with_atval(self.atval2):
+            offset_val = self.after[cur_offset_val.index]
+            if offset_val != None:
+                yield solver.relation(offset_val, self.atval1)
+
+        if relation.with_atval(self.atval1):
+            offset_val = self.before[cur_offset_val.index]
+            if offset_val != None:
+                yield solver.relation(offset_val, self.atval2)
+
     def __str__(self):
         return "Offset " + str(self.atval1) + ":" + str(self.offset_attr) + "(" + str(self.offset) + "):" + str(self.atval2)
 
@@ -241,73 +1248,237 @@ class Distance:
     def __init__(self, atval1, atval2, distance_attr, distance):
         assert(distance > 0)
 
-        self.solver = None
         self.atval1 = atval1
         self.atval2 = atval2
         self.distance_attr = distance_attr
         self.distance = distance
+        # values of distance_attr at the distance and at twice the distance from the value at index
+        self.left = distance_attr.neighbours(-distance)
+        self.far_left = distance_attr.neighbours(-2*distance)
+        self.right = distance_attr.neighbours(+distance)
+        self.far_right = distance_attr.neighbours(+2*distance)
 
-    def evaluate(self, relation):
+    def evaluate(self, solver, relation):
         if not relation.with_attr(self.distance_attr):
             return None
 
-        cur_distance_val = relation.atval(self.distance_attr)
-        left_distance_val = cur_distance_val.offset_value(-self.distance)
-        far_left_distance_val = cur_distance_val.offset_value(-2*self.distance)
-        right_distance_val = cur_distance_val.offset_value(+self.distance)
-        far_right_distance_val = cur_distance_val.offset_value(+2*self.distance)
+        index = relation.atval(self.distance_attr).index
+        left_distance_val = self.left[index]
+        far_left_distance_val = self.far_left[index]
+        right_distance_val = self.right[index]
+        far_right_distance_val = self.far_right[index]
         
         if relation.with_atval(self.atval1):
             if ((left_distance_val == None
-                    or self.solver.is_different(Relation(left_distance_val, self.atval2)))
+                    or solver.are_different(left_distance_val, self.atval2))
                 and (right_distance_val == None
-                    or self.solver.is_different(Relation(right_distance_val, self.atval2)))):
+                    or solver.are_different(right_distance_val, self.atval2))):
                 return Different(relation)
             
             if (left_distance_val != None
-                and self.solver.is_same(Relation(left_distance_val, self.atval2))
+                and solver.are_same(left_distance_val, self.atval2)
                 and (far_left_distance_val == None
-                    or self.solver.is_different(Relation(far_left_distance_val, self.atval1)))):
+                    or solver.are_different(far_left_distance_val, self.atval1))):
                 return Same(relation)
 
             if (right_distance_val != None
-                and self.solver.is_same(Relation(right_distance_val, self.atval2))
+                and solver.are_same(right_distance_val, self.atval2)
                 and (far_right_distance_val == None
-                    or self.solver.is_different(Relation(far_right_distance_val, self.atval1)))):
+                    or solver.are_different(far_right_distance_val, self.atval1))):
                 return Same(relation)
             
         if relation.with_atval(self.atval2):
             if ((left_distance_val == None
-                    or self.solver.is_different(Relation(left_distance_val, self.atval1)))
+                    or solver.are_different(left_distance_val, self.atval1))
                 and (right_distance_val == None
-                    or self.solver.is_different(Relation(right_distance_val, self.atval1)))):
+                    or solver.are_different(right_distance_val, self.atval1))):
                 return Different(relation)
             
             if (left_distance_val != None
-                and self.solver.is_same(Relation(left_distance_val, self.atval1))
+                and solver.are_same(left_distance_val, self.atval1)
                 and (far_left_distance_val == None
-                    or self.solver.is_different(Relation(far_left_distance_val, self.atval2)))):
+                    or solver.are_different(far_left_distance_val, self.atval2))):
                 return Same(relation)
 
             if (right_distance_val != None
-                and self.solver.is_same(Relation(right_distance_val, self.atval1))
+                and solver.are_same(right_distance_val, self.atval1)
                 and (far_right_distance_val == None
-                    or self.solver.is_different(Relation(far_right_distance_val, self.atval2)))):
+                    or solver.are_different(far_right_distance_val, self.atval2))):
                 return Same(relation)
+
+    # Different: the relations of both neighbours at the distance, Same: the relation of a neighbour,
+    # and of the value at twice the distance on the same side
+    def premises(self, solver, relation, same, position):
+        index = relation.atval(self.distance_attr).index
+        for (atval, other) in ((self.atval1, self.atval2), (self.atval2, self.atval1)):
+            if not relation.with_atval(atval):
+                continue
+            if not same:
+                premises = [solver.relation(distance_val, other)
+                            for distance_val in (self.left[index], self.right[index]) if distance_val != None]
+                if all(solver.decided_before(premise, False, position) for premise in premises):
+                    return premises
+                continue
+            for (near, far) in ((self.left, self.far_left), (self.right, self.far_right)):
+                near_val = near[index]
+                far_val = far[index]
+                if near_val == None:
+                    continue
+                premises = [solver.relation(near_val, other)]
+                if not solver.decided_before(premises[0], True, position):
+                    continue
+                if far_val != None:
+                    premises.append(solver.relation(far_val, atval))
+                    if not solver.decided_before(premises[1], False, position):
+                        continue
+                return premises
+        return []
             
+    def watches(self):
+        return (self.atval1, self.atval2)
+
+    def candidates(self, solver):
+        for atval in self.distance_attr.ordered_values:
+            yield solver.relation(atval, self.atval1)
+            yield solver.relation(atval, self.atval2)
+
+    # (X, atval1) depends on (X+-distance, atval2) and (X+-2*distance, atval1), and vice versa
+    def affected(self, solver, relation):
+        cur_distance_val = relation.atval(self.distance_attr)
+        if cur_distance_val == None:
+            return
+
+        index = cur_distance_val.index
+        for (atval, other) in ((self.atval1, self.atval2), (self.atval2, self.atval1)):
+            if not relation.with_atval(atval):
+                continue
+            for (tables, target) in (((self.left, self.right), other), ((self.far_left, self.far_right), atval)):
+                for table in tables:
+                    distance_val = table[index]
+                    if distance_val != None:
+                        yield solver.relation(distance_val, target)
+
     def __str__(self):
         return "Distance " + str(self.atval1) + ":" + str(self.distance_attr) + "(" + str(self.distance) + "):" + str(self.atval2)
 
+# Comparison of the positions of two values on an ordinal attribute, such as Before and Apart.
+# allowed1[index] is the bitmask of the values of ordinal_attr atval2 can be the same as while atval1 is
+# the same as the value at index, allowed2 vice versa. A value is different from the positions no possible
+# position of the other value is allowed with, which is a single mask test per evaluation.
+class Comparison:
+    def __init__(self, atval1, atval2, ordinal_attr, allowed1, allowed2):
+        assert(atval1.attr != ordinal_attr and atval2.attr != ordinal_attr)
+
+        self.atval1 = atval1
+        self.atval2 = atval2
+        self.ordinal_attr = ordinal_attr
+        self.allowed1 = allowed1
+        self.allowed2 = allowed2
+
+    def evaluate(self, solver, relation):
+        if not relation.with_attr(self.ordinal_attr):
+            return None
+
+        index = relation.atval(self.ordinal_attr).index
+        if (relation.with_atval(self.atval1)
+            and self.allowed1[index] & ~solver.different_mask(self.atval2, self.ordinal_attr) == 0):
+            return Different(relation)
+        if (relation.with_atval(self.atval2)
+            and self.allowed2[index] & ~solver.different_mask(self.atval1, self.ordinal_attr) == 0):
+            return Different(relation)
+        return None
+
+    # the other value is different from every allowed position
+    def premises(self, solver, relation, same, position):
+        index = relation.atval(self.ordinal_attr).index
+        for (atval, other, allowed) in ((self.atval1, self.atval2, self.allowed1), (self.atval2, self.atval1, self.allowed2)):
+            if not relation.with_atval(atval):
+                continue
+            premises = [solver.relation(value, other)
+                        for value in self.ordinal_attr.ordered_values if (allowed[index] >> value.index) & 1]
+            if all(solver.decided_before(premise, False, position) for premise in premises):
+                return premises
+        return []
+
+    def watches(self):
+        return (self.atval1, self.atval2)
+
+    def candidates(self, solver):
+        for atval in self.ordinal_attr.ordered_values:
+            yield solver.relation(atval, self.atval1)
+            yield solver.relation(atval, self.atval2)
+
+    # the possible positions of a value limit every position of the other one
+    def affected(self, solver, relation):
+        if not relation.with_attr(self.ordinal_attr):
+            return
+        grid = solver.relation_grid
+        order = self.ordinal_attr.order
+        if relation.with_atval(self.atval2):
+            yield from grid[self.atval1.attr.order][order][self.atval1.index]
+        if relation.with_atval(self.atval1):
+            yield from grid[self.atval2.attr.order][order][self.atval2.index]
+
+# atval1 is at least distance values of ordinal_attr before atval2, "somewhere left of" for distance 1
+class Before(Comparison):
+    def __init__(self, atval1, atval2, ordinal_attr, distance=1):
+        assert(distance > 0)
+
+        count = len(ordinal_attr.ordered_values)
+        all_values = (1 << count) - 1
+        super().__init__(atval1, atval2, ordinal_attr,
+                         [all_values & ~((1 << (index + distance)) - 1) for index in range(count)],
+                         [(1 << max(0, index - distance + 1)) - 1 for index in range(count)])
+        self.distance = distance
+
+    def __str__(self):
+        return "Before " + str(self.atval1) + ":" + str(self.ordinal_attr) + "(" + str(self.distance) + "):" + str(self.atval2)
+
+# atval1 is somewhere before atval2, with the bounds of Before: atval1 is before the last possible position of atval2,
+# atval2 after the first possible position of atval1
+class LeftOf(Before):
+    def __init__(self, atval1, atval2, ordinal_attr):
+        super().__init__(atval1, atval2, ordinal_attr, 1)
+
+    def __str__(self):
+        return "LeftOf " + str(self.atval1) + ":" + str(self.ordinal_attr) + ":" + str(self.atval2)
+
+# atval1 is somewhere after atval2, Before with the values swapped
+class RightOf(Before):
+    def __init__(self, atval1, atval2, ordinal_attr):
+        super().__init__(atval2, atval1, ordinal_attr, 1)
+
+    def __str__(self):
+        return "RightOf " + str(self.atval2) + ":" + str(self.ordinal_attr) + ":" + str(self.atval1)
+
+# atval1 and atval2 are at least distance values of ordinal_attr apart, on either side
+class Apart(Comparison):
+    def __init__(self, atval1, atval2, ordinal_attr, distance):
+        assert(distance > 0)
+
+        count = len(ordinal_attr.ordered_values)
+        all_values = (1 << count) - 1
+        # positions closer than distance to the value at index
+        windows = [((1 << min(count, index + distance)) - 1) & ~((1 << max(0, index - distance + 1)) - 1)
+                   for index in range(count)]
+        allowed = [all_values & ~window for window in windows]
+        super().__init__(atval1, atval2, ordinal_attr, allowed, allowed)
+        self.distance = distance
+
+    def __str__(self):
+        return "Apart " + str(self.atval1) + ":" + str(self.ordinal_attr) + "(" + str(self.distance) + "):" + str(self.atval2)
+
 class Same:
     def __init__(self, relation):
         self.relation = relation
-        self.solver = None
 
-    def evaluate(self, relation):
+    def evaluate(self, solver, relation):
         a1 = self.relation.atval1
         a2 = self.relation.atval2
         # same attributes
         if relation.with_attr(a1.attr) and relation.with_attr(a2.attr):
+            if relation == self.relation:
+                return None
             # one attribute value is the same (another is not the same) - considered relation is negative
             if relation.with_atval(a1):
                 return Different(relation)
@@ -316,22 +1487,30 @@ class Same:
             
         if relation.with_atval(a1):
             rel_a2 = relation.atval2 if relation.atval1 == a1 else relation.atval1
-            proxy_rel = Relation(a2, rel_a2)
-            if self.solver.is_same(proxy_rel):
+            if solver.are_same(a2, rel_a2):
                 return Same(relation)
-            if self.solver.is_different(proxy_rel):
+            if solver.are_different(a2, rel_a2):
                 return Different(relation)
         
         if relation.with_atval(a2):
             rel_a2 = relation.atval2 if relation.atval1 == a2 else relation.atval1
-            proxy_rel = Relation(a1, rel_a2)
-            if self.solver.is_same(proxy_rel):
+            if solver.are_same(a1, rel_a2):
                 return Same(relation)
-            if self.solver.is_different(proxy_rel):
+            if solver.are_different(a1, rel_a2):
                 return Different(relation)
 
         return None
 
+    # Solver propagates Same facts through Solver.entities, evaluate is not needed on them
+    def watches(self):
+        return ()
+
+    def candidates(self, solver):
+        return ()
+
+    def affected(self, solver, relation):
+        return ()
+
     def __str__(self):
         return "Same " + str(self.relation)
     
@@ -341,12 +1520,20 @@ class Same:
 
 class Different:
     def __init__(self, relation):
-        self.solver = None
         self.relation = relation
 
-    def evaluate(self, relation):
+    def evaluate(self, solver, relation):
         return None
 
+    def watches(self):
+        return ()
+
+    def candidates(self, solver):
+        return ()
+
+    def affected(self, solver, relation):
+        return ()
+
     def __str__(self):
         return "Different " + str(self.relation)
 
@@ -355,4 +1542,76 @@ class Different:
         return cls(Relation(atval1, atval2))
     
 
+# "is not" clue, decided when added and propagated through Solver.entities like Different
+class NotSame(Different):
+    def __str__(self):
+        return "NotSame " + str(self.relation)
+
+# at least one of the relations is Same, exactly one if exclusive.
+# Either.of(atval, *others) - atval is the same as one of the others, "the englishman lives in the red or the blue house",
+# if the others are values of one attribute, atval is different from the rest of its values
+class Either:
+    def __init__(self, relations, exclusive=False):
+        assert(len(relations) > 0)
+
+        self.relations = list(relations)
+        self.members = set(self.relations)
+        self.exclusive = exclusive
+        # set by of
+        self.atval = None
+        self.domain_attr = None
+
+    def evaluate(self, solver, relation):
+        if relation not in self.members:
+            if self.domain_attr != None and relation.with_atval(self.atval) and relation.with_attr(self.domain_attr):
+                return Different(relation)
+            return None
+
+        others = [other for other in self.relations if other != relation]
+        if all(solver.is_different(other) for other in others):
+            return Same(relation)
+        if self.exclusive and any(solver.is_same(other) for other in others):
+            return Different(relation)
+        return None
+
+    def premises(self, solver, relation, same, position):
+        if relation not in self.members:
+            return []
+        others = [solver.relation(other.atval1, other.atval2) for other in self.relations if other != relation]
+        if same:
+            return others
+        return [other for other in others if solver.decided_before(other, True, position)][:1]
+
+    def watches(self):
+        watches = {}
+        for relation in self.relations:
+            watches[relation.atval1] = None
+            watches[relation.atval2] = None
+        return tuple(watches)
+
+    def candidates(self, solver):
+        for relation in self.relations:
+            yield solver.relation(relation.atval1, relation.atval2)
+        if self.domain_attr != None:
+            for value in self.domain_attr.ordered_values:
+                yield solver.relation(self.atval, value)
+
+    # every relation decides the other ones
+    def affected(self, solver, relation):
+        if relation in self.members:
+            for other in self.relations:
+                yield solver.relation(other.atval1, other.atval2)
+
+    def __str__(self):
+        return "Either " + " | ".join(str(relation) for relation in self.relations)
+
+    @classmethod
+    def of(cls, atval, *others, exclusive=False):
+        rule = cls([Relation(atval, other) for other in others], exclusive)
+        rule.atval = atval
+        if all(other.attr == others[0].attr for other in others):
+            rule.domain_attr = others[0].attr
+        return rule
+
+
 # TESTS
@@ -0,0 +1,144 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+
+from einstein import Contradiction, Timeout
+import einstein_cache
+import einstein_parser
+
+# Solves many puzzles in the einstein.txt format in parallel.
+#
+# python einstein_batch.py puzzles/             - every *.txt file of the directory, the file name is the id
+# python einstein_batch.py puzzles.jsonl        - {"id": ..., "puzzle": "<puzzle text>"} per line
+# python einstein_batch.py - < puzzles.jsonl    - the same from stdin
+#
+# Results are written as JSONL: {"id": ..., "solved": true, "answers": {"drink:water nation": "nation:norwegian"}}
+#
+# python einstein_batch.py --cache solutions.db puzzles/   - solutions are looked up in and added to the cache
+# python einstein_batch.py --subsets 3 puzzles/             - naked subsets of up to 3 values when propagation stalls
+
+
+def read_directory(path):
+    for name in sorted(os.listdir(path)):
+        if name.endswith('.txt'):
+            with open(os.path.join(path, name), encoding='utf-8') as f:
+                yield (name, f.read())
+
+
+# a line which is not a JSON object with a puzzle text gives (id, None), solve_text reports it
+def read_jsonl(lines):
+    for (number, line) in enumerate(lines):
+        line = line.strip()
+        if line == '':
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            yield (number, None)
+            continue
+        if not isinstance(item, dict):
+            yield (number, None)
+            continue
+        yield (item.get('id', number), item.get('puzzle'))
+
+
+def read_puzzles(path):
+    if path == '-':
+        yield from read_jsonl(sys.stdin)
+    elif os.path.isdir(path):
+        yield from read_directory(path)
+    else:
+        with open(path, encoding='utf-8') as lines:
+            yield from read_jsonl(lines)
+
+
+# SolutionCache of the process and the size of its Subsets rule, see init_worker
+worker_cache = None
+worker_subsets = None
+
+
+def init_worker(cache_path, subsets=None):
+    global worker_cache, worker_subsets
+    if worker_cache != None:
+        worker_cache.close()
+    worker_cache = None if cache_path == None else einstein_cache.SolutionCache(cache_path)
+    worker_subsets = subsets
+
+
+# result of the puzzle text without id, deadline - time.time() the search stops after
+# any error of the puzzle is in the result, an exception would stop solve_all and fail the other puzzles of the pool
+def solve_text(text, deadline=None):
+    if not isinstance(text, str):
+        return {'solved': False, 'error': "no puzzle text"}
+    try:
+        (solver, queries) = einstein_parser.parse(text.splitlines(), worker_subsets)
+        solver.deadline = deadline
+        if worker_cache == None:
+            solved = solver.search()
+        else:
+            solved = einstein_cache.search(solver, worker_cache)
+
+        answers = {}
+        for (query, atval) in einstein_parser.answer(solver, queries):
+            answers[str(query)] = None if atval == None else str(atval)
+    except (einstein_parser.ParseError, Contradiction) as error:
+        return {'solved': False, 'error': str(error)}
+    except Timeout as error:
+        return {'solved': False, 'error': str(error), 'timeout': True}
+    except Exception as error:
+        return {'solved': False, 'error': type(error).__name__ + ": " + str(error)}
+    return {'solved': solved, 'answers': answers}
+
+
+def solve_puzzle(item):
+    (puzzle_id, text) = item
+    result = {'id': puzzle_id}
+    result.update(solve_text(text))
+    return result
+
+
+# results in the order of the puzzles, or as soon as they are solved if not ordered
+# cache_path - SQLite file of an einstein_cache.SolutionCache shared by the workers,
+# subsets - size of the Subsets rule of every puzzle, None without it
+def solve_all(puzzles, workers=None, chunksize=16, ordered=True, cache_path=None, subsets=None):
+    if workers == 1:
+        init_worker(cache_path, subsets)
+        try:
+            yield from map(solve_puzzle, puzzles)
+        finally:
+            init_worker(None)
+        return
+
+    with multiprocessing.Pool(workers, init_worker, (cache_path, subsets)) as pool:
+        if ordered:
+            yield from pool.imap(solve_puzzle, puzzles, chunksize)
+        else:
+            yield from pool.imap_unordered(solve_puzzle, puzzles, chunksize)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Solve puzzles in the einstein.txt format in parallel.")
+    parser.add_argument('input', help="directory of .txt puzzles, JSONL file of puzzles, or - for JSONL on stdin")
+    parser.add_argument('-o', '--output', help="JSONL file for the results, stdout by default")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="worker processes, the number of CPUs by default")
+    parser.add_argument('-c', '--chunksize', type=int, default=16, help="puzzles sent to a worker at once")
+    parser.add_argument('-u', '--unordered', action='store_true', help="write results as soon as they are solved")
+    parser.add_argument('--cache', help="SQLite file of cached solutions")
+    parser.add_argument('--subsets', type=int, default=None,
+                        help="find naked subsets of up to this many values when propagation stalls, off by default")
+    args = parser.parse_args(argv)
+
+    output = sys.stdout if args.output == None else open(args.output, 'w', encoding='utf-8')
+    try:
+        for result in solve_all(read_puzzles(args.input), args.workers, args.chunksize, not args.unordered,
+                                args.cache, args.subsets):
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import argparse
+import json
+import time
+import tracemalloc
+
+from einstein import SolverStats
+import einstein_generator
+import einstein_numpy
+import einstein_sat
+
+# Times Solver.solve on generated puzzles with fixed seeds.
+#
+# python einstein_bench.py --sizes 5x5 8x8 10x10 --puzzles 3 --seed 1
+# python einstein_bench.py --backend sat        - the same puzzles with a Solver backend
+
+BACKENDS = {'native': None, 'numpy': einstein_numpy.NumpyBackend, 'sat': einstein_sat.SatBackend}
+
+
+def parse_size(text):
+    (attrs_count, _, values_count) = text.partition('x')
+    return (int(attrs_count), int(values_count))
+
+
+def bench_puzzle(attrs, rules, backend=None):
+    solver = einstein_generator.build(attrs, rules, backend)
+    start = time.perf_counter()
+    solver.solve()
+    elapsed = time.perf_counter() - start
+
+    # the same solve again with stats and under tracemalloc, which slow it down
+    solver = einstein_generator.build(attrs, rules, backend)
+    solver.stats = SolverStats()
+    tracemalloc.start()
+    try:
+        solver.solve()
+        (_, peak) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    stats = solver.stats.as_dict()
+    return {
+        'clues': len(rules),
+        'passes': stats['passes'],
+        'evaluations': stats['evaluations'],
+        'hits': stats['hits'],
+        'classes': stats['classes'],
+        'decided': solver.decided_count(),
+        'relations': solver.relation_count(),
+        'seconds': elapsed,
+        'peak_bytes': peak,
+    }
+
+
+def bench(sizes, puzzles=3, seed=0, weights=(3, 1, 1), backend=None):
+    results = []
+    for (attrs_count, values_count) in sizes:
+        for index in range(puzzles):
+            puzzle_seed = seed + index
+            (attrs, rules) = einstein_generator.generate(attrs_count, values_count, puzzle_seed, weights)
+            result = {'size': str(attrs_count) + 'x' + str(values_count), 'seed': puzzle_seed}
+            result.update(bench_puzzle(attrs, rules, backend))
+            results.append(result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Solver.solve on generated puzzles.")
+    parser.add_argument('--sizes', nargs='+', default=['5x5', '6x6', '8x8'], help="attributes x values")
+    parser.add_argument('--puzzles', type=int, default=3, help="puzzles per size")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the first puzzle, the next ones count up")
+    parser.add_argument('--weights', type=int, nargs=3, default=[3, 1, 1], metavar=('SAME', 'OFFSET', 'DISTANCE'),
+                        help="relative frequency of the clue types")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='native', help="Solver backend")
+    parser.add_argument('--json', action='store_true', help="print results as JSONL")
+    args = parser.parse_args(argv)
+
+    results = bench([parse_size(size) for size in args.sizes], args.puzzles, args.seed, args.weights,
+                    BACKENDS[args.backend])
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+        return
+
+    print("%-7s %5s %6s %7s %12s %10s %10s %10s" %
+          ('size', 'seed', 'clues', 'passes', 'evaluations', 'decided', 'ms', 'peak KiB'))
+    for result in results:
+        print("%-7s %5d %6d %7d %12d %10s %10.1f %10.1f" % (
+            result['size'], result['seed'], result['clues'], result['passes'], result['evaluations'],
+            str(result['decided']) + '/' + str(result['relations']),
+            result['seconds'] * 1000, result['peak_bytes'] / 1024))
+
+
+if __name__ == '__main__':
+    main()
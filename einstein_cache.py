@@ -0,0 +1,267 @@
+import hashlib
+import json
+import sqlite3
+
+from einstein import *
+
+# Solutions of puzzles by a canonical hash of their attributes and rules, so puzzles with the clues
+# in another order, or with the attributes and values renamed, are solved once.
+#
+# cache = SolutionCache('solutions.db')
+# solved = einstein_cache.search(solver, cache)   - Solver.search, or the cached solution if there is one
+#
+# Values are labelled by refining their colors by the clues they are in. Ties are broken by trying each of the tied
+# values and keeping the smallest text, so isomorphic puzzles get the same hash whatever order the values are in.
+# Values in no clue are not tried, and the search gives up after MAX_NODES.
+
+# clue kinds of rules whose values are compared by position on their attribute
+POSITIONAL = ('offset', 'distance', 'before', 'apart')
+
+
+# (kind, number, attribute, values, sorted_from) of a rule, values[sorted_from:] may be in any order,
+# None if the rule can not be compared
+def clue(rule):
+    if isinstance(rule, Exclusive):
+        return ('exclusive', 0, None, (), 0)
+    if isinstance(rule, Subsets):
+        return ('subsets', rule.size, None, (), 0)
+    if isinstance(rule, Same):
+        return ('same', 0, None, (rule.relation.atval1, rule.relation.atval2), 0)
+    if isinstance(rule, Different):
+        return ('different', 0, None, (rule.relation.atval1, rule.relation.atval2), 0)
+    if isinstance(rule, Offset):
+        return ('offset', rule.offset, rule.offset_attr, (rule.atval1, rule.atval2), 2)
+    if isinstance(rule, Distance):
+        return ('distance', rule.distance, rule.distance_attr, (rule.atval1, rule.atval2), 0)
+    if isinstance(rule, Before):
+        return ('before', rule.distance, rule.ordinal_attr, (rule.atval1, rule.atval2), 2)
+    if isinstance(rule, Apart):
+        return ('apart', rule.distance, rule.ordinal_attr, (rule.atval1, rule.atval2), 0)
+    if isinstance(rule, Either) and rule.atval != None:
+        others = [relation.atval2 if relation.atval1 == rule.atval else relation.atval1 for relation in rule.relations]
+        return ('either', int(rule.exclusive), None, tuple([rule.atval] + others), 1)
+    return None
+
+
+# nodes of the search for the canonical form before the puzzle is searched uncached
+MAX_NODES = 1000
+
+
+# ranks of the keys, equal keys get equal ranks
+def ranks(keys):
+    order = {key: rank for (rank, key) in enumerate(sorted(set(keys.values())))}
+    return {item: order[key] for (item, key) in keys.items()}
+
+
+class Canonical:
+    # max_nodes - ValueError if the search for the smallest text needs more nodes
+    def __init__(self, attrs, rules, max_nodes=MAX_NODES):
+        self.clues = []
+        for rule in rules:
+            item = clue(rule)
+            if item == None:
+                raise ValueError("no canonical form for " + str(rule))
+            self.clues.append(item)
+
+        # the values of ordered attributes keep their positions
+        self.ordered = set(attr for attr in attrs if isinstance(attr, Ordinal))
+        self.ordered.update(attr for (kind, _, attr, _, _) in self.clues if kind in POSITIONAL)
+
+        # the attributes and values in clues, the labels of the others are not in the text, so they stay tied
+        self.used = set()
+        for (kind, number, attr, atvals, sorted_from) in self.clues:
+            self.used.update(atvals)
+            self.used.update(atval.attr for atval in atvals)
+            self.used.add(attr)
+
+        attr_colors = ranks({attr: (attr in self.ordered, len(attr.ordered_values)) for attr in attrs})
+        colors = ranks({atval: (attr_colors[attr], atval.index if attr in self.ordered else -1)
+                        for attr in attrs for atval in attr.ordered_values})
+        # the smallest (text, attributes, values of the attributes, labels, path) found, and the automorphisms of the
+        # puzzle found as orders with the same text, attribute or value -> its image
+        self.best = None
+        self.automorphisms = []
+        # the length of the path to return to after an automorphism, None when searching
+        self.jump = None
+        self.max_nodes = max_nodes
+        self.nodes = 0
+        self.search(colors, attr_colors, ())
+        (self.text, self.attrs, self.values, labels, _) = self.best
+        self.hash = hashlib.sha256(self.text.encode('utf-8')).hexdigest()
+
+        self.labels = {atval: label for (atval, label) in labels.items() if isinstance(atval, AttrValue)}
+        self.attr_labels = {attr: label for (attr, label) in labels.items() if not isinstance(attr, AttrValue)}
+
+    # colors of the values and attributes refined by the clues they are in, until no color splits
+    def refine(self, colors, attr_colors):
+        while True:
+            count = len(set(colors.values())) + len(set(attr_colors.values()))
+            signatures = {atval: [] for atval in colors}
+            for (kind, number, attr, atvals, sorted_from) in self.clues:
+                attr_color = -1 if attr == None else attr_colors[attr]
+                for (position, atval) in enumerate(atvals):
+                    others = tuple(sorted(colors[other] for other in atvals if other is not atval))
+                    signatures[atval].append((kind, number, attr_color, min(position, sorted_from), others))
+            colors = ranks({atval: (attr_colors[atval.attr], colors[atval], tuple(sorted(signatures[atval])))
+                            for atval in colors})
+            attr_colors = ranks({attr: (attr_colors[attr], tuple(sorted(colors[atval] for atval in attr.ordered_values)))
+                                 for attr in attr_colors})
+            if len(set(colors.values())) + len(set(attr_colors.values())) == count:
+                return (colors, attr_colors)
+
+    # the smallest text of the orders the colors allow: an attribute or a value of the first color shared by several
+    # gets a color of its own, for each of them in turn, path - the ones which got a color of their own so far
+    def search(self, colors, attr_colors, path):
+        self.nodes += 1
+        if self.nodes > self.max_nodes:
+            raise ValueError("no canonical form in " + str(self.max_nodes) + " nodes")
+        (colors, attr_colors) = self.refine(colors, attr_colors)
+        cells = {}
+        for (attr, color) in attr_colors.items():
+            if attr in self.used:
+                cells.setdefault((0, color), []).append(attr)
+        for (atval, color) in colors.items():
+            if atval in self.used and atval.attr not in self.ordered:
+                cells.setdefault((1, color), []).append(atval)
+        cells = [cells[key] for key in sorted(cells) if len(cells[key]) > 1]
+        if not cells:
+            self.leaf(colors, attr_colors, path)
+            return
+
+        tried = []
+        for item in cells[0]:
+            # an automorphism keeping the path which maps a tried item to this one maps its orders to the same texts
+            if item in self.orbit(tried, path):
+                continue
+            tried.append(item)
+            if isinstance(item, AttrValue):
+                self.search(ranks({atval: (color, atval is not item) for (atval, color) in colors.items()}),
+                            attr_colors, path + (item,))
+            else:
+                self.search(colors, ranks({attr: (color, attr is not item) for (attr, color) in attr_colors.items()}),
+                            path + (item,))
+            if self.jump != None:
+                if self.jump < len(path):
+                    return
+                self.jump = None
+
+    # the items the automorphisms keeping every item of the path map the items to
+    def orbit(self, items, path):
+        automorphisms = [image for image in self.automorphisms if all(image[item] is item for item in path)]
+        orbit = set(items)
+        pending = list(items)
+        while pending:
+            item = pending.pop()
+            for image in automorphisms:
+                if image[item] not in orbit:
+                    orbit.add(image[item])
+                    pending.append(image[item])
+        return orbit
+
+    # the order of the attributes and values by their colors, all different but of those in no clue. an automorphism maps the path of the
+    # best order to this path, so the subtree this path left the best path for is an image of the one explored
+    def leaf(self, colors, attr_colors, path):
+        attrs = sorted(attr_colors, key=lambda attr: attr_colors[attr])
+        values = {}
+        for attr in attrs:
+            if attr in self.ordered:
+                values[attr] = list(attr.ordered_values)
+            else:
+                values[attr] = sorted(attr.ordered_values, key=lambda atval: colors[atval])
+        labels = {}
+        for (attr_label, attr) in enumerate(attrs):
+            labels[attr] = attr_label
+            for (value_label, atval) in enumerate(values[attr]):
+                labels[atval] = (attr_label, value_label)
+
+        lines = [" ".join(("o" if attr in self.ordered else "v") + str(len(attr.ordered_values)) for attr in attrs)]
+        for (kind, number, attr, atvals, sorted_from) in self.clues:
+            atval_labels = [labels[atval] for atval in atvals]
+            atval_labels = atval_labels[:sorted_from] + sorted(atval_labels[sorted_from:])
+            lines.append(" ".join([kind, str(number), "-" if attr == None else str(labels[attr])] +
+                                  [str(attr_label) + ":" + str(value_label) for (attr_label, value_label) in atval_labels]))
+        text = "\n".join(lines[:1] + sorted(lines[1:]))
+
+        if self.best == None or text < self.best[0]:
+            self.best = (text, attrs, values, labels, path)
+        elif text == self.best[0]:
+            items = {label: item for (item, label) in self.best[3].items()}
+            self.automorphisms.append({item: items[label] for (item, label) in labels.items()})
+            best_path = self.best[4]
+            self.jump = 0
+            while best_path[self.jump] is path[self.jump]:
+                self.jump += 1
+
+    # the assignment of Solver.assignment with canonical value labels, in a canonical order
+    def encode(self, assignment):
+        rows = []
+        for entity in assignment:
+            row = [None] * len(self.attrs)
+            for atval in entity:
+                (attr_label, value_label) = self.labels[atval]
+                row[attr_label] = value_label
+            rows.append(row)
+        return sorted(rows)
+
+    # the entities of an encoded assignment as tuples of values in the order of the attributes
+    def decode(self, rows):
+        return [tuple(self.values[attr][row[label]] for (label, attr) in enumerate(self.attrs)) for row in rows]
+
+
+# hash -> encoded solution, an empty list for puzzles without solution,
+# the least recently used entries are removed above max_entries
+class SolutionCache:
+    def __init__(self, path=':memory:', max_entries=100000):
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS solutions "
+                                "(key TEXT PRIMARY KEY, solution TEXT NOT NULL, used INTEGER NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS solutions_used ON solutions (used)")
+        self.connection.commit()
+
+    # the cached solution, None if there is none
+    def get(self, key):
+        row = self.connection.execute("SELECT solution FROM solutions WHERE key = ?", (key,)).fetchone()
+        if row == None:
+            return None
+        with self.connection:
+            self.connection.execute("UPDATE solutions SET used = (SELECT MAX(used) FROM solutions) + 1 WHERE key = ?",
+                                    (key,))
+        return json.loads(row[0])
+
+    def put(self, key, solution):
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO solutions VALUES "
+                                    "(?, ?, (SELECT COALESCE(MAX(used), 0) + 1 FROM solutions))",
+                                    (key, json.dumps(solution)))
+            self.connection.execute("DELETE FROM solutions WHERE key IN "
+                                    "(SELECT key FROM solutions ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                                    (self.max_entries,))
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM solutions").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+
+# Solver.search with the cache consulted first. A cached solution is decided as the Same relations of
+# its entities, the rules are not evaluated on it. Puzzles with rules without canonical form, or whose canonical form
+# is not found in max_nodes, are searched.
+def search(solver, cache, max_nodes=MAX_NODES):
+    try:
+        canonical = Canonical(solver.attrs, solver.list, max_nodes)
+    except ValueError:
+        return solver.search()
+
+    rows = cache.get(canonical.hash)
+    if rows == None:
+        solved = solver.search()
+        cache.put(canonical.hash, canonical.encode(solver.assignment()) if solved else [])
+        return solved
+    if rows == []:
+        return False
+    for entity in canonical.decode(rows):
+        for atval in entity[1:]:
+            solver.decide(solver.relation(entity[0], atval), True, cache)
+    return True
@@ -0,0 +1,206 @@
+import argparse
+import multiprocessing
+import os
+import random
+
+from einstein import *
+import einstein_parser
+
+# Random puzzles: a random solution, and random true clues about it until
+# propagation alone decides every relation, so the puzzle has exactly one solution.
+#
+# Attribute 0 is the ordinal "position" the Offset and Distance clues are counted by,
+# entity e is at position e + 1, the other attributes are random permutations.
+#
+# minimize removes the clues the puzzle does not need, printed in the einstein.txt format by
+#
+# python einstein_generator.py --attrs 5 --values 5 --seed 1 --workers 4
+
+CLUES = ('same', 'offset', 'distance')
+
+
+def random_attrs(attrs_count, values_count):
+    attrs = [Ordinal('position', 0, 1, values_count)]
+    for order in range(1, attrs_count):
+        name = 'attr' + str(order)
+        attrs.append(Attr(name, order, ['v' + str(index + 1) for index in range(values_count)]))
+    return attrs
+
+
+# solution[attr.order][entity] is the value of the attribute of the entity
+def random_solution(attrs, rng):
+    solution = [list(attrs[0].ordered_values)]
+    for attr in attrs[1:]:
+        values = list(attr.ordered_values)
+        rng.shuffle(values)
+        solution.append(values)
+    return solution
+
+
+# weights - relative frequency of the same, offset and distance clues
+def random_clue(attrs, solution, rng, weights):
+    entities = len(solution[0])
+    clue = rng.choices(CLUES, weights)[0]
+    if clue == 'same':
+        (attr1, attr2) = rng.sample(attrs, 2)
+        entity = rng.randrange(entities)
+        return Same.of(solution[attr1.order][entity], solution[attr2.order][entity])
+
+    (entity1, entity2) = rng.sample(range(entities), 2)
+    atval1 = solution[rng.choice(attrs[1:]).order][entity1]
+    atval2 = solution[rng.choice(attrs[1:]).order][entity2]
+    offset = entity1 - entity2
+    if clue == 'offset':
+        return Offset(atval1, atval2, attrs[0], offset)
+    return Distance(atval1, atval2, attrs[0], abs(offset))
+
+
+# subsets - size of the Subsets rule added after Exclusive, None without it
+def build(attrs, rules, backend=None, subsets=None):
+    solver = Solver(attrs, backend)
+    solver.add(Exclusive())
+    if subsets != None:
+        solver.add(Subsets(subsets))
+    for rule in rules:
+        solver.add(rule)
+    return solver
+
+
+# returns (attrs, rules), rules do not include Exclusive
+def generate(attrs_count, values_count, seed=None, weights=(3, 1, 1)):
+    assert(attrs_count >= 2 and values_count >= 2)
+
+    rng = random.Random(seed)
+    attrs = random_attrs(attrs_count, values_count)
+    solution = random_solution(attrs, rng)
+    rules = []
+    solver = build(attrs, rules)
+    while solver.decided_count() < solver.relation_count():
+        rule = random_clue(attrs, solution, rng, weights)
+        if hasattr(rule, 'relation') and rule.relation in solver:
+            continue
+        rules.append(rule)
+        solver.add(rule)
+        solver.solve()
+    return (attrs, rules)
+
+
+# Tests whether propagation alone still decides every relation without a clue.
+# Clues found necessary stay necessary when other clues are removed, they are solved once
+# into a base state the tests of the other clues push onto.
+class Minimizer:
+    def __init__(self, attrs, rules):
+        self.attrs = attrs
+        self.rules = rules
+        self.solver = build(attrs, [])
+        self.solver.solve()
+        # indices of the rules of the base state
+        self.necessary = ()
+
+    # necessary - indices of the rules known to be necessary, each test adds to the previous ones
+    # others - indices of the other rules, removed - the index of the rule to test without
+    # returns (removed, solved, indices of the others which decided a relation)
+    def test(self, necessary, others, removed=None):
+        solver = self.solver
+        if necessary[:len(self.necessary)] != self.necessary:
+            solver = self.solver = build(self.attrs, [])
+            self.necessary = ()
+        for index in necessary[len(self.necessary):]:
+            solver.add(self.rules[index])
+        solver.solve()
+        self.necessary = tuple(necessary)
+
+        solver.push()
+        try:
+            for index in others:
+                if index != removed:
+                    solver.add(self.rules[index])
+            solver.solve()
+            solved = solver.decided_count() == solver.relation_count()
+            used = solver.used_rules()
+        finally:
+            solver.pop()
+        return (removed, solved, [index for index in others if index != removed and self.rules[index] in used])
+
+
+# Minimizer of the worker process, the rules are sent as the puzzle text once per worker
+worker_minimizer = None
+
+
+def init_worker(lines):
+    global worker_minimizer
+    parser = einstein_parser.PuzzleParser()
+    for line in lines:
+        parser.feed(line)
+    worker_minimizer = Minimizer(parser.attrs, parser.rules)
+
+
+def test_removal(task):
+    return worker_minimizer.test(*task)
+
+
+# the rules without the ones propagation does not need to decide every relation,
+# none of the returned rules can be removed
+# workers - processes testing batch removals in parallel, 1 tests them in this process
+# batch - removals tested at once, the number of workers by default
+def minimize(attrs, rules, workers=1, batch=None):
+    rules = [rule for rule in rules if not isinstance(rule, Exclusive)]
+    minimizer = Minimizer(attrs, rules)
+    # the rules which never decide a relation are removed without testing them
+    (_, solved, others) = minimizer.test((), range(len(rules)))
+    if not solved:
+        raise ValueError("propagation does not decide every relation of the puzzle")
+
+    if workers == None:
+        workers = os.cpu_count() or 1
+    if batch == None:
+        batch = workers
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, init_worker, (einstein_parser.format_puzzle(attrs, rules),))
+    necessary = []
+    try:
+        while others:
+            tasks = [(tuple(necessary), tuple(others), removed) for removed in others[:batch]]
+            if pool == None:
+                results = [minimizer.test(*task) for task in tasks]
+            else:
+                results = pool.map(test_removal, tasks)
+            removed_one = False
+            for (removed, solved, used) in results:
+                if not solved:
+                    # necessary with more rules, so with fewer rules as well
+                    necessary.append(removed)
+                    if removed in others:
+                        others.remove(removed)
+                elif not removed_one:
+                    # the later removals of the batch were tested with this rule, they are tested again,
+                    # the rules found necessary earlier in the batch stay necessary
+                    others = [index for index in used if index not in necessary]
+                    removed_one = True
+    finally:
+        if pool != None:
+            pool.close()
+            pool.join()
+    return [rules[index] for index in sorted(necessary)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a puzzle with no redundant clues in the einstein.txt format.")
+    parser.add_argument('--attrs', type=int, default=5, help="attributes, including the position")
+    parser.add_argument('--values', type=int, default=5, help="values of every attribute")
+    parser.add_argument('--seed', type=int, default=None, help="seed of the random solution and clues")
+    parser.add_argument('--weights', type=int, nargs=3, default=[3, 1, 1], metavar=('SAME', 'OFFSET', 'DISTANCE'),
+                        help="relative frequency of the clue types")
+    parser.add_argument('-w', '--workers', type=int, default=1, help="processes testing clue removals")
+    args = parser.parse_args(argv)
+
+    (attrs, rules) = generate(args.attrs, args.values, args.seed, args.weights)
+    rules = minimize(attrs, rules, args.workers)
+    queries = [einstein_parser.Query(atval, attrs[0]) for atval in attrs[-1].ordered_values]
+    for line in einstein_parser.format_puzzle(attrs, rules, queries):
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from einstein import *
+
+# Propagation over boolean arrays, same[(order1, order2)][index1, index2] per pair of attributes,
+# every pass applies the rules to all relations at once:
+# - Same excludes the rest of its row and column, and is transitive through every third attribute
+# - Exclusive decides the only possible value of a row or a column
+# - Offset and Distance shift the rows of their values along the ordinal attribute
+# The facts it derives are the facts the rules derive in Solver.iter.
+#
+# solver = Solver(attrs, backend=NumpyBackend)
+#
+# Rules of other types are evaluated one relation at a time after the arrays reach a fixpoint.
+
+SUPPORTED_RULES = (Exclusive, Same, Different, Offset, Distance)
+
+
+# result[h] = vector[h - offset], fill where h - offset is out of range
+def shift(vector, offset, fill):
+    result = numpy.full(len(vector), fill)
+    length = len(vector)
+    if abs(offset) >= length:
+        return result
+    if offset >= 0:
+        result[offset:] = vector[:length - offset]
+    else:
+        result[:length + offset] = vector[-offset:]
+    return result
+
+
+def bits_to_array(rows, width):
+    if width <= 64:
+        masks = numpy.array(rows, dtype=numpy.uint64)
+        return ((masks[:, None] >> numpy.arange(width, dtype=numpy.uint64)) & numpy.uint64(1)).astype(bool)
+    return numpy.array([[(row >> index) & 1 == 1 for index in range(width)] for row in rows], dtype=bool)
+
+
+class NumpyBackend:
+    def __init__(self, solver):
+        if numpy == None:
+            raise ImportError("NumpyBackend requires numpy")
+        self.solver = solver
+        self.same = {}
+        self.different = {}
+
+    # arrays of the solver state, for both orders of every pair, the reversed pair is a transposed view
+    def load(self):
+        self.same = {}
+        self.different = {}
+        for (key, matrix) in self.solver.matrices.items():
+            width = len(matrix.same_t)
+            same = bits_to_array(matrix.same, width)
+            different = bits_to_array(matrix.different, width)
+            self.same[key] = same
+            self.same[(key[1], key[0])] = same.T
+            self.different[key] = different
+            self.different[(key[1], key[0])] = different.T
+
+    # budget - SolveBudget checked between the passes, the relations stay pending if it stops the solve
+    def solve(self, budget=None):
+        solver = self.solver
+        other_rules = [rule for rule in solver.list if not isinstance(rule, SUPPORTED_RULES)]
+        self.load()
+        while budget == None or not budget.exceeded():
+            solver.passes += 1
+            if self.propagate():
+                # the solver derives more facts from the committed ones, see Solver.entities
+                self.load()
+                continue
+            if other_rules and self.evaluate(other_rules):
+                self.load()
+                continue
+            # every relation has been evaluated with every rule
+            solver.pending = {}
+            break
+
+    # one pass over all relations, returns whether new facts were derived
+    def propagate(self):
+        solver = self.solver
+        orders = [attr.order for attr in solver.attrs]
+        exclusive = any(isinstance(rule, Exclusive) for rule in solver.global_rules)
+
+        new_same = {}
+        new_different = {}
+        for key in solver.matrices:
+            (order1, order2) = key
+            same = self.same[key]
+            different = self.different[key]
+
+            # Same excludes the rest of the row and the column
+            excluded = (same.any(axis=1)[:, None] | same.any(axis=0)[None, :]) & ~same
+            derived_same = numpy.zeros_like(same)
+            if exclusive:
+                possible = ~different
+                derived_same |= possible & (possible.sum(axis=1) == 1)[:, None]
+                derived_same |= possible & (possible.sum(axis=0) == 1)[None, :]
+
+            for order in orders:
+                if order == order1 or order == order2:
+                    continue
+                same1 = self.same[(order1, order)]
+                same2 = self.same[(order, order2)]
+                derived_same |= same1 @ same2
+                excluded |= same1 @ self.different[(order, order2)]
+                excluded |= self.different[(order1, order)] @ same2
+
+            new_same[key] = derived_same
+            new_same[(order2, order1)] = derived_same.T
+            new_different[key] = excluded
+            new_different[(order2, order1)] = excluded.T
+
+        for rule in solver.list:
+            if isinstance(rule, Offset):
+                self.shift_offset(rule, new_same, new_different)
+            elif isinstance(rule, Distance):
+                self.shift_distance(rule, new_same, new_different)
+
+        return self.commit(new_same, new_different)
+
+    # views of the rows of atval over attr
+    def rows(self, arrays, atval, attr):
+        return arrays[(atval.attr.order, attr.order)][atval.index]
+
+    def shift_offset(self, rule, new_same, new_different):
+        attr = rule.offset_attr
+        same1 = self.rows(self.same, rule.atval1, attr)
+        same2 = self.rows(self.same, rule.atval2, attr)
+        different1 = self.rows(self.different, rule.atval1, attr)
+        different2 = self.rows(self.different, rule.atval2, attr)
+
+        # (X, atval1) follows (X-offset, atval2), (X, atval2) follows (X+offset, atval1)
+        self.rows(new_same, rule.atval1, attr)[:] |= shift(same2, rule.offset, False)
+        self.rows(new_different, rule.atval1, attr)[:] |= shift(different2, rule.offset, True)
+        self.rows(new_same, rule.atval2, attr)[:] |= shift(same1, -rule.offset, False)
+        self.rows(new_different, rule.atval2, attr)[:] |= shift(different1, -rule.offset, True)
+
+    def shift_distance(self, rule, new_same, new_different):
+        attr = rule.distance_attr
+        distance = rule.distance
+        for (atval, other) in ((rule.atval1, rule.atval2), (rule.atval2, rule.atval1)):
+            same_other = self.rows(self.same, other, attr)
+            different_other = self.rows(self.different, other, attr)
+            different_this = self.rows(self.different, atval, attr)
+
+            # neither neighbour is the other value
+            self.rows(new_different, atval, attr)[:] |= (
+                shift(different_other, distance, True) & shift(different_other, -distance, True))
+            # a neighbour is the other value, and the value is not on its other side
+            self.rows(new_same, atval, attr)[:] |= (
+                shift(same_other, distance, False) & shift(different_this, 2*distance, True)
+                | shift(same_other, -distance, False) & shift(different_this, -2*distance, True))
+
+    # writes the new facts into the solver, raises Contradiction if a rule decides a relation otherwise
+    def commit(self, new_same, new_different):
+        solver = self.solver
+        derived = False
+        for key in solver.matrices:
+            same = self.same[key]
+            different = self.different[key]
+            conflicts = (new_same[key] & different) | (new_different[key] & same) | (new_same[key] & new_different[key])
+            if conflicts.any():
+                (index1, index2) = numpy.argwhere(conflicts)[0]
+                raise Contradiction(solver.relation_grid[key[0]][key[1]][index1][index2], self)
+
+            grid = solver.relation_grid[key[0]][key[1]]
+            for (index1, index2) in numpy.argwhere(new_same[key] & ~same):
+                solver.decide(grid[index1][index2], True, self)
+                derived = True
+            for (index1, index2) in numpy.argwhere(new_different[key] & ~different):
+                solver.decide(grid[index1][index2], False, self)
+                derived = True
+            same |= new_same[key]
+            different |= new_different[key]
+        return derived
+
+    # the rules the arrays do not support, on every relation
+    def evaluate(self, rules):
+        solver = self.solver
+        derived = False
+        for relation in solver.relations():
+            decided = relation in solver
+            for rule in rules:
+                result = rule.evaluate(solver, relation)
+                if result == None:
+                    continue
+                if decided:
+                    if isinstance(result, Same) != solver.is_same(relation):
+                        raise Contradiction(relation, rule)
+                    continue
+                solver.decide(relation, isinstance(result, Same), rule)
+                derived = True
+                break
+        return derived
+
+    def __str__(self):
+        return "NumPy propagation"
@@ -0,0 +1,297 @@
+from einstein import *
+
+# Puzzle text format, see einstein.txt. Lines before the first section are the puzzle description.
+# format_puzzle writes the same format.
+#
+# attributes
+# house:ordinal:1 5                  - integer values from 1 to 5
+# color:attr:red green white         - listed values, "attr:" may be omitted
+#
+# knowledge
+# same color:red nation:english
+# different color:red nation:spanish
+# offset:house:1 color:white color:green   - green is 1 house after white
+# dist:house:1 smoke:chesterfield animal:fox - chesterfield and fox are 1 house apart
+# before:house:1 color:red color:blue       - red is at least 1 house before blue
+# apart:house:2 color:red color:blue        - red and blue are at least 2 houses apart
+# left:house color:red color:blue           - red is somewhere left of blue, right: somewhere right of
+# not color:red nation:spanish              - the spanish does not live in the red house
+# either nation:english color:red color:blue - the english lives in the red or the blue house
+#
+# queries
+# drink:water nation                 - which nation is the same as drink:water
+
+SECTIONS = ('attributes', 'knowledge', 'queries')
+
+
+class ParseError(Exception):
+    def __init__(self, line_number, message):
+        super().__init__("line " + str(line_number) + ": " + message)
+        self.line_number = line_number
+
+
+class Query:
+    def __init__(self, atval, attr):
+        self.atval = atval
+        self.attr = attr
+
+    # the value of attr which is the same as atval, None while it is not decided
+    def answer(self, solver):
+        same = solver.same_mask(self.atval, self.attr)
+        if same == 0:
+            return None
+        return self.attr.value_at(same.bit_length() - 1)
+
+    def __str__(self):
+        return str(self.atval) + " " + str(self.attr)
+
+
+class PuzzleParser:
+    def __init__(self):
+        self.attrs = []
+        self.attrs_by_name = {}
+        # attribute values by their text, "attr:value"
+        self.atvals = {}
+        self.rules = []
+        self.queries = []
+        self.section = None
+        self.line_number = 0
+
+    def feed(self, line):
+        self.line_number += 1
+        line = line.strip()
+        if line == '' or line.startswith('#'):
+            return
+        section = line.rstrip(':')
+        if section in SECTIONS:
+            self.section = section
+            return
+
+        if self.section == 'attributes':
+            self.parse_attribute(line)
+        elif self.section == 'knowledge':
+            self.parse_knowledge(line)
+        elif self.section == 'queries':
+            self.parse_query(line)
+
+    def parse_attribute(self, line):
+        (name, _, values) = line.partition(':')
+        (kind, _, rest) = values.partition(':')
+        if name in self.attrs_by_name:
+            raise self.error("duplicate attribute " + name)
+        if kind == 'ordinal':
+            bounds = rest.split()
+            if len(bounds) != 2:
+                raise self.error("ordinal attribute needs the first and the last value")
+            try:
+                (first, last) = (int(bounds[0]), int(bounds[1]))
+            except ValueError:
+                raise self.error("expected numbers, got " + rest.strip())
+            if last < first:
+                raise self.error("attribute " + name + " has no values")
+            attr = Ordinal(name, len(self.attrs), first, last)
+        else:
+            values = rest.split() if kind == 'attr' else values.split()
+            if len(values) == 0:
+                raise self.error("attribute " + name + " has no values")
+            for (index, value) in enumerate(values):
+                if value in values[:index]:
+                    raise self.error("duplicate value " + value + " of attribute " + name)
+            attr = Attr(name, len(self.attrs), values)
+        # every attribute value is of one entity, so all attributes have as many values as there are entities
+        if self.attrs and len(attr.ordered_values) != len(self.attrs[0].ordered_values):
+            raise self.error("attribute " + name + " has " + str(len(attr.ordered_values)) + " values, "
+                             + str(self.attrs[0]) + " has " + str(len(self.attrs[0].ordered_values)))
+
+        self.attrs.append(attr)
+        self.attrs_by_name[name] = attr
+        for atval in attr.ordered_values:
+            self.atvals[str(atval)] = atval
+
+    def parse_knowledge(self, line):
+        tokens = line.split()
+        (clue, _, clue_attr) = tokens[0].partition(':')
+        if clue == 'either':
+            if len(tokens) < 4:
+                raise self.error("expected an attribute value and at least two values it may be the same as")
+            atvals = [self.atval(token) for token in tokens[1:]]
+            if any(atval.attr == atvals[0].attr for atval in atvals[1:]):
+                raise self.error("either values must be of other attributes than " + str(atvals[0].attr))
+            self.rules.append(Either.of(*atvals))
+            return
+        if len(tokens) != 3:
+            raise self.error("expected a clue and two attribute values")
+        atval1 = self.atval(tokens[1])
+        atval2 = self.atval(tokens[2])
+        if clue in ('same', 'different', 'not') and atval1.attr == atval2.attr:
+            raise self.error("expected values of two attributes, got two values of " + str(atval1.attr))
+        if clue == 'same':
+            self.rules.append(Same.of(atval1, atval2))
+        elif clue == 'different':
+            self.rules.append(Different.of(atval1, atval2))
+        elif clue == 'not':
+            self.rules.append(NotSame.of(atval1, atval2))
+        elif clue == 'left':
+            self.rules.append(LeftOf(atval1, atval2, self.ordinal_attr(clue_attr, atval1, atval2)))
+        elif clue == 'right':
+            self.rules.append(RightOf(atval1, atval2, self.ordinal_attr(clue_attr, atval1, atval2)))
+        elif clue == 'offset':
+            (attr, offset) = self.clue_attr(tokens[0], atval1, atval2)
+            self.rules.append(Offset(atval2, atval1, attr, offset))
+        elif clue == 'dist':
+            (attr, distance) = self.clue_attr(tokens[0], atval1, atval2)
+            self.rules.append(Distance(atval1, atval2, attr, distance))
+        elif clue == 'before':
+            (attr, distance) = self.clue_attr(tokens[0], atval1, atval2)
+            self.rules.append(Before(atval1, atval2, attr, distance))
+        elif clue == 'apart':
+            (attr, distance) = self.clue_attr(tokens[0], atval1, atval2)
+            self.rules.append(Apart(atval1, atval2, attr, distance))
+        else:
+            raise self.error("unknown clue " + clue)
+
+    def parse_query(self, line):
+        tokens = line.split()
+        if len(tokens) != 2:
+            raise self.error("expected an attribute value and an attribute")
+        self.queries.append(Query(self.atval(tokens[0]), self.attr(tokens[1])))
+
+    # "offset:house:1" -> (house, 1), atvals - the values of the clue, which must be of other attributes
+    def clue_attr(self, token, *atvals):
+        parts = token.split(':')
+        if len(parts) != 3:
+            raise self.error("expected clue:attribute:number, got " + token)
+        try:
+            number = int(parts[2])
+        except ValueError:
+            raise self.error("expected a number, got " + parts[2])
+        if number == 0 or (parts[0] != 'offset' and number < 0):
+            raise self.error("invalid " + parts[0] + " " + parts[2])
+        attr = self.attr(parts[1])
+        self.check_values(attr, atvals)
+        return (attr, number)
+
+    # "left:house" -> house
+    def ordinal_attr(self, name, *atvals):
+        attr = self.attr(name)
+        self.check_values(attr, atvals)
+        return attr
+
+    def check_values(self, attr, atvals):
+        for atval in atvals:
+            if atval.attr == attr:
+                raise self.error("expected values of other attributes than " + attr.name + ", got " + str(atval))
+
+    def attr(self, name):
+        if name not in self.attrs_by_name:
+            raise self.error("unknown attribute " + name)
+        return self.attrs_by_name[name]
+
+    def atval(self, token):
+        if token not in self.atvals:
+            raise self.error("unknown attribute value " + token)
+        return self.atvals[token]
+
+    def error(self, message):
+        return ParseError(self.line_number, message)
+
+    # the text had an attributes section, without it every text would be an empty puzzle
+    def check(self):
+        if not self.attrs:
+            raise self.error("no attributes")
+
+    # subsets - size of the naked subsets Subsets finds when the other rules stall, None without Subsets
+    def solver(self, subsets=None):
+        self.check()
+        solver = Solver(self.attrs)
+        for rule in self.all_rules(subsets):
+            solver.add(rule)
+        return solver
+
+    # the rules compiled once for many solvers, see Puzzle
+    def puzzle(self, subsets=None):
+        self.check()
+        return Puzzle(self.attrs, self.all_rules(subsets))
+
+    def all_rules(self, subsets):
+        rules = [Exclusive()]
+        if subsets != None:
+            rules.append(Subsets(subsets))
+        return rules + self.rules
+
+
+# compiles the puzzle text, any iterable of lines, into a solver with its rules and the queries,
+# subsets - see PuzzleParser.solver
+def parse(lines, subsets=None):
+    parser = PuzzleParser()
+    for line in lines:
+        parser.feed(line)
+    return (parser.solver(subsets), parser.queries)
+
+
+def load(path, subsets=None):
+    with open(path, encoding='utf-8') as lines:
+        return parse(lines, subsets)
+
+
+def answer(solver, queries):
+    return [(query, query.answer(solver)) for query in queries]
+
+
+# the text of a rule as a line of the knowledge section, None for Exclusive and Subsets, which parse() adds itself
+def format_rule(rule):
+    if isinstance(rule, (Exclusive, Subsets)):
+        return None
+    if isinstance(rule, Same):
+        return "same " + str(rule.relation.atval1) + " " + str(rule.relation.atval2)
+    if isinstance(rule, NotSame):
+        return "not " + str(rule.relation.atval1) + " " + str(rule.relation.atval2)
+    if isinstance(rule, Different):
+        return "different " + str(rule.relation.atval1) + " " + str(rule.relation.atval2)
+    if isinstance(rule, Offset):
+        return ("offset:" + str(rule.offset_attr) + ":" + str(rule.offset) + " " +
+                str(rule.atval2) + " " + str(rule.atval1))
+    if isinstance(rule, Distance):
+        return ("dist:" + str(rule.distance_attr) + ":" + str(rule.distance) + " " +
+                str(rule.atval1) + " " + str(rule.atval2))
+    if isinstance(rule, LeftOf):
+        return "left:" + str(rule.ordinal_attr) + " " + str(rule.atval1) + " " + str(rule.atval2)
+    if isinstance(rule, RightOf):
+        return "right:" + str(rule.ordinal_attr) + " " + str(rule.atval2) + " " + str(rule.atval1)
+    if isinstance(rule, Either) and rule.atval != None and not rule.exclusive:
+        tokens = ["either", str(rule.atval)]
+        for relation in rule.relations:
+            tokens.append(str(relation.atval2 if relation.atval1 == rule.atval else relation.atval1))
+        return " ".join(tokens)
+    if isinstance(rule, Before) or isinstance(rule, Apart):
+        return (type(rule).__name__.lower() + ":" + str(rule.ordinal_attr) + ":" + str(rule.distance) + " " +
+                str(rule.atval1) + " " + str(rule.atval2))
+    raise ValueError("no text format for " + str(rule))
+
+
+def format_attr(attr):
+    values = [atval.value for atval in attr.ordered_values]
+    if isinstance(attr, Ordinal) or (all(isinstance(value, int) for value in values)
+                                     and values == list(range(values[0], values[0] + len(values)))):
+        return str(attr) + ":ordinal:" + str(values[0]) + " " + str(values[-1])
+    return str(attr) + ":attr:" + " ".join(str(value) for value in values)
+
+
+# the puzzle in the format parse() reads, as a list of lines
+def format_puzzle(attrs, rules, queries=(), description=()):
+    lines = list(description)
+    if lines:
+        lines.append('')
+    lines.append('attributes')
+    lines.extend(format_attr(attr) for attr in attrs)
+    lines.append('')
+    lines.append('knowledge')
+    for rule in rules:
+        line = format_rule(rule)
+        if line != None:
+            lines.append(line)
+    if queries:
+        lines.append('')
+        lines.append('queries')
+        lines.extend(str(query) for query in queries)
+    return lines
@@ -0,0 +1,405 @@
+import heapq
+import time
+
+try:
+    import pycosat
+except ImportError:
+    pycosat = None
+
+from einstein import *
+
+# The puzzle as CNF, solved by clause learning instead of propagation with search.
+#
+# Variable relation.id + 1 is true if the relation is Same. Every pair of attributes is a permutation,
+# at least one and at most one Same in every row and column, and the pairs without attribute 0 are the same
+# through attribute 0: (e, a) and (e, b) imply (a, b), the rest follows from the permutations.
+#
+# solver = Solver(attrs, backend=SatBackend)   - solve() decides what holds in every solution, Contradiction if there is none
+# CNF(solver).dimacs()                         - the clauses for an external solver
+#
+# pycosat solves the clauses if it is installed, CDCL otherwise.
+
+
+class CNF:
+    def __init__(self, solver):
+        self.solver = solver
+        self.variables = len(solver.relation_list)
+        self.clauses = []
+        self.permutations()
+        self.transitivity()
+        for relation in solver.relations():
+            if relation in solver:
+                self.add([self.literal(relation.atval1, relation.atval2, solver.is_same(relation))])
+        for rule in solver.list:
+            self.rule(rule)
+
+    # variable of the Same of the values, negative for Different,
+    # ValueError for two values of one attribute, which have no relation
+    def literal(self, atval1, atval2, same=True):
+        if atval1.attr is atval2.attr:
+            raise ValueError("no relation of " + str(atval1) + " and " + str(atval2))
+        variable = self.solver.relation(atval1, atval2).id + 1
+        return variable if same else -variable
+
+    # drops the False literals, of values which do not exist
+    def add(self, literals):
+        self.clauses.append([literal for literal in literals if literal is not False])
+
+    def permutations(self):
+        for (key, matrix) in self.solver.matrices.items():
+            grid = self.solver.relation_grid[key[0]][key[1]]
+            lines = [[relation.id + 1 for relation in row] for row in grid]
+            lines.extend([list(column) for column in zip(*lines)])
+            for line in lines:
+                self.clauses.append(line)
+                for i in range(len(line)):
+                    for j in range(i + 1, len(line)):
+                        self.clauses.append([-line[i], -line[j]])
+
+    def transitivity(self):
+        attrs = self.solver.attrs
+        grid = self.solver.relation_grid
+        order0 = attrs[0].order
+        for i in range(1, len(attrs)):
+            for j in range(i + 1, len(attrs)):
+                (order1, order2) = (attrs[i].order, attrs[j].order)
+                pairs = [[relation.id + 1 for relation in row] for row in grid[order1][order2]]
+                for entity in range(len(attrs[0].ordered_values)):
+                    row1 = [relation.id + 1 for relation in grid[order0][order1][entity]]
+                    row2 = [relation.id + 1 for relation in grid[order0][order2][entity]]
+                    for (index1, variable1) in enumerate(row1):
+                        pair_row = pairs[index1]
+                        for (index2, variable2) in enumerate(row2):
+                            self.clauses.append([-variable1, -variable2, pair_row[index2]])
+
+    # raises ValueError for rules without an encoding
+    def rule(self, rule):
+        literal = self.literal
+        if isinstance(rule, (Exclusive, Subsets)):
+            # follow from the permutations
+            return
+        if isinstance(rule, (Same, Different)):
+            relation = rule.relation
+            self.add([literal(relation.atval1, relation.atval2, isinstance(rule, Same))])
+        elif isinstance(rule, Offset):
+            for atval in rule.offset_attr.ordered_values:
+                before = rule.before[atval.index]
+                after = rule.after[atval.index]
+                self.add([-literal(atval, rule.atval1), False if before == None else literal(before, rule.atval2)])
+                self.add([-literal(atval, rule.atval2), False if after == None else literal(after, rule.atval1)])
+        elif isinstance(rule, Distance):
+            for (atval1, atval2) in ((rule.atval1, rule.atval2), (rule.atval2, rule.atval1)):
+                for atval in rule.distance_attr.ordered_values:
+                    self.add([-literal(atval, atval1)] + [literal(near[atval.index], atval2)
+                                                          for near in (rule.left, rule.right) if near[atval.index] != None])
+        elif isinstance(rule, Comparison):
+            for (atval1, atval2, allowed) in ((rule.atval1, rule.atval2, rule.allowed1),
+                                              (rule.atval2, rule.atval1, rule.allowed2)):
+                for atval in rule.ordinal_attr.ordered_values:
+                    self.add([-literal(atval, atval1)] + [literal(other, atval2)
+                                                          for other in rule.ordinal_attr.ordered_values
+                                                          if (allowed[atval.index] >> other.index) & 1])
+        elif isinstance(rule, Either):
+            literals = [literal(relation.atval1, relation.atval2) for relation in rule.relations]
+            self.add(literals)
+            if rule.exclusive:
+                for i in range(len(literals)):
+                    for j in range(i + 1, len(literals)):
+                        self.add([-literals[i], -literals[j]])
+        else:
+            raise ValueError("no CNF encoding for " + str(rule))
+
+    # the relations of the model which are Same
+    def same(self, model):
+        relations = self.solver.relation_list
+        return [relations[literal - 1] for literal in model if literal > 0]
+
+    def dimacs(self):
+        lines = ["p cnf " + str(self.variables) + " " + str(len(self.clauses))]
+        lines.extend(" ".join(str(literal) for literal in clause) + " 0" for clause in self.clauses)
+        return lines
+
+
+# Conflict driven clause learning: two watched literals, first UIP clauses, VSIDS activities
+# with saved phases, and Luby restarts. Learnt clauses are kept.
+class CDCL:
+    def __init__(self, variables, clauses):
+        self.variables = variables
+        # 1 true, -1 false, 0 unassigned, by variable
+        self.values = [0] * (variables + 1)
+        self.levels = [0] * (variables + 1)
+        # the clause which implied the variable, its first literal, None for decisions
+        self.reasons = [None] * (variables + 1)
+        self.activity = [0.0] * (variables + 1)
+        # a relation is more often Different, false first
+        self.phases = [-1] * (variables + 1)
+        self.heap = [(0.0, variable) for variable in range(1, variables + 1)]
+        self.increment = 1.0
+        # clauses by the literal they watch, negative literals index from the end
+        self.watches = [[] for _ in range(2 * variables + 1)]
+        self.trail = []
+        # trail lengths at the decisions
+        self.limits = []
+        self.head = 0
+        self.conflicts = 0
+        self.decisions = 0
+        self.unsat = False
+        for clause in clauses:
+            self.add(clause)
+
+    def value(self, literal):
+        value = self.values[abs(literal)]
+        return value if literal > 0 else -value
+
+    def add(self, literals):
+        clause = []
+        for literal in literals:
+            value = self.value(literal)
+            if value == 1 or -literal in clause:
+                return
+            if value == 0 and literal not in clause:
+                clause.append(literal)
+        if len(clause) == 0:
+            self.unsat = True
+        elif len(clause) == 1:
+            self.assign(clause[0], None)
+        else:
+            self.watches[clause[0]].append(clause)
+            self.watches[clause[1]].append(clause)
+
+    def assign(self, literal, reason):
+        variable = abs(literal)
+        self.values[variable] = 1 if literal > 0 else -1
+        self.levels[variable] = len(self.limits)
+        self.reasons[variable] = reason
+        self.trail.append(literal)
+
+    # returns the conflicting clause, None if every implied literal is assigned
+    def propagate(self):
+        values = self.values
+        watches = self.watches
+        trail = self.trail
+        while self.head < len(trail):
+            false_literal = -trail[self.head]
+            self.head += 1
+            watching = watches[false_literal]
+            watches[false_literal] = kept = []
+            for (position, clause) in enumerate(watching):
+                if clause[0] == false_literal:
+                    clause[0] = clause[1]
+                    clause[1] = false_literal
+                first = clause[0]
+                first_value = values[abs(first)] if first > 0 else -values[abs(first)]
+                if first_value == 1:
+                    kept.append(clause)
+                    continue
+                for index in range(2, len(clause)):
+                    literal = clause[index]
+                    if (values[literal] if literal > 0 else -values[-literal]) != -1:
+                        clause[1] = literal
+                        clause[index] = false_literal
+                        watches[literal].append(clause)
+                        break
+                else:
+                    kept.append(clause)
+                    if first_value == -1:
+                        kept.extend(watching[position + 1:])
+                        return clause
+                    self.assign(first, clause)
+        return None
+
+    # the first UIP clause of the conflict, with its asserting literal first, and the level to return to
+    def analyze(self, conflict):
+        levels = self.levels
+        level = len(self.limits)
+        learnt = [None]
+        seen = set()
+        count = 0
+        index = len(self.trail) - 1
+        literal = None
+        clause = conflict
+        while True:
+            for other in (clause if literal == None else clause[1:]):
+                variable = abs(other)
+                if variable not in seen and levels[variable] > 0:
+                    seen.add(variable)
+                    self.bump(variable)
+                    if levels[variable] == level:
+                        count += 1
+                    else:
+                        learnt.append(other)
+            while abs(self.trail[index]) not in seen:
+                index -= 1
+            literal = self.trail[index]
+            index -= 1
+            count -= 1
+            if count == 0:
+                break
+            clause = self.reasons[abs(literal)]
+        learnt[0] = -literal
+
+        if len(learnt) == 1:
+            return (learnt, 0)
+        # the literal of the highest level is watched second
+        highest = max(range(1, len(learnt)), key=lambda position: levels[abs(learnt[position])])
+        (learnt[1], learnt[highest]) = (learnt[highest], learnt[1])
+        return (learnt, levels[abs(learnt[1])])
+
+    def bump(self, variable):
+        activity = self.activity
+        activity[variable] += self.increment
+        if activity[variable] > 1e100:
+            for other in range(1, self.variables + 1):
+                activity[other] *= 1e-100
+            self.increment *= 1e-100
+            self.heap = [(-activity[other], other) for other in range(1, self.variables + 1) if self.values[other] == 0]
+            heapq.heapify(self.heap)
+        else:
+            heapq.heappush(self.heap, (-activity[variable], variable))
+
+    def backtrack(self, level):
+        if len(self.limits) <= level:
+            return
+        length = self.limits[level]
+        for literal in self.trail[length:]:
+            variable = abs(literal)
+            self.phases[variable] = self.values[variable]
+            self.values[variable] = 0
+            self.reasons[variable] = None
+            heapq.heappush(self.heap, (-self.activity[variable], variable))
+        del self.trail[length:]
+        del self.limits[level:]
+        self.head = length
+        if len(self.heap) > 8 * self.variables:
+            self.heap = [(-self.activity[variable], variable) for variable in range(1, self.variables + 1)
+                         if self.values[variable] == 0]
+            heapq.heapify(self.heap)
+
+    # the unassigned variable of the highest activity, None if all are assigned
+    def pick(self):
+        heap = self.heap
+        while heap:
+            (_, variable) = heapq.heappop(heap)
+            if self.values[variable] == 0:
+                return variable
+        return None
+
+    # the true literal of every variable, None if the clauses are unsatisfiable,
+    # deadline - time.time() checked on restarts, Timeout after it
+    def solve(self, deadline=None):
+        if self.unsat or self.propagate() != None:
+            return None
+        restart = 1
+        limit = 64 * luby(restart)
+        while True:
+            conflict = self.propagate()
+            if conflict != None:
+                if not self.limits:
+                    return None
+                self.conflicts += 1
+                limit -= 1
+                (learnt, level) = self.analyze(conflict)
+                self.backtrack(level)
+                if len(learnt) == 1:
+                    self.assign(learnt[0], None)
+                else:
+                    self.watches[learnt[0]].append(learnt)
+                    self.watches[learnt[1]].append(learnt)
+                    self.assign(learnt[0], learnt)
+                self.increment /= 0.95
+                continue
+
+            if limit <= 0:
+                if deadline != None and time.time() >= deadline:
+                    raise Timeout(restart)
+                restart += 1
+                limit = 64 * luby(restart)
+                self.backtrack(0)
+                continue
+            variable = self.pick()
+            if variable == None:
+                return [variable if self.values[variable] == 1 else -variable for variable in range(1, self.variables + 1)]
+            self.decisions += 1
+            self.limits.append(len(self.trail))
+            self.assign(variable if self.phases[variable] == 1 else -variable, None)
+
+
+# 1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8, ...
+def luby(index):
+    size = 1
+    while size < index + 1:
+        size = 2 * size + 1
+    while True:
+        if size == index:
+            return (size + 1) // 2
+        size //= 2
+        if index > size:
+            index -= size
+
+
+# the true literal of every variable, None if the clauses are unsatisfiable,
+# deadline - Timeout after it, pycosat is not stopped
+def solve_cnf(variables, clauses, deadline=None):
+    if pycosat != None:
+        model = pycosat.solve(clauses, vars=variables)
+        return None if isinstance(model, str) else model
+    return CDCL(variables, clauses).solve(deadline)
+
+
+class SatBackend:
+    def __init__(self, solver):
+        self.solver = solver
+
+    # the solve is one pass, budget - SolveBudget checked before it, its deadline on the restarts of CDCL.
+    # decides the Same relations of every solution, the rest is left to the search
+    def solve(self, budget=None):
+        solver = self.solver
+        if budget != None and budget.exceeded():
+            return
+        solver.passes += 1
+        cnf = CNF(solver)
+        deadline = None if budget == None else budget.deadline
+        try:
+            model = solve_cnf(cnf.variables, cnf.clauses, deadline)
+            if model == None:
+                raise Contradiction(self.culprit(), self)
+            backbone = self.backbone(cnf, model, deadline)
+        except Timeout:
+            budget.reason = 'deadline'
+            return
+        for relation in backbone:
+            solver.decide(relation, True, self)
+        # the decided relations hold in every solution, which satisfies every rule
+        solver.pending = {}
+
+    # the undecided Same relations of the model which are Same in every model: all of them if no model
+    # differs in them, else those without which there is no model, the models found drop the others
+    def backbone(self, cnf, model, deadline):
+        solver = self.solver
+        candidates = set(relation.id + 1 for relation in cnf.same(model) if relation not in solver)
+        if not candidates:
+            return []
+        other = solve_cnf(cnf.variables, cnf.clauses + [[-variable for variable in candidates]], deadline)
+        if other == None:
+            return [solver.relation_list[variable - 1] for variable in sorted(candidates)]
+        candidates.intersection_update(other)
+        found = []
+        for variable in sorted(candidates):
+            if variable not in candidates:
+                continue
+            other = solve_cnf(cnf.variables, cnf.clauses + [[known] for known in found] + [[-variable]], deadline)
+            if other == None:
+                found.append(variable)
+            else:
+                candidates.intersection_update(other)
+        return [solver.relation_list[variable - 1] for variable in found]
+
+    # the relation decided last, whose decision left no solution, the first relation if none is decided
+    def culprit(self):
+        for entry in reversed(self.solver.trail):
+            if isinstance(entry, tuple):
+                return entry[0]
+        return self.solver.relation_list[0]
+
+    def __str__(self):
+        return "SAT"
@@ -0,0 +1,150 @@
+import asyncio
+import collections
+import concurrent.futures
+import time
+
+import einstein_batch
+
+# Solves puzzles in the einstein.txt format for asyncio servers, in a process pool.
+#
+# async with SolveService(workers=4) as service:
+#     result = await service.solve(text, timeout=2.0)   - the result of einstein_batch.solve_text
+#
+# Requests for a puzzle text which is being solved wait for the same computation. A timeout becomes the deadline
+# of the solve, which the worker checks between the passes of the solver and stops with {'timeout': True}.
+#
+# with Client(workers=2) as client:                      - the service from blocking code, e.g. tests
+#     client.solve(text)
+
+
+class ServiceMetrics:
+    def __init__(self, window=1000):
+        self.requests = 0
+        self.coalesced = 0
+        self.computations = 0
+        self.timeouts = 0
+        self.errors = 0
+        # computations sent to the pool and not finished, requests waiting for them
+        self.in_flight = 0
+        self.waiting = 0
+        # seconds of the last requests
+        self.latencies = collections.deque(maxlen=window)
+
+    def as_dict(self):
+        latencies = sorted(self.latencies)
+        latency = {'count': len(latencies)}
+        if latencies:
+            latency.update({
+                'mean': sum(latencies) / len(latencies),
+                'p50': latencies[len(latencies) // 2],
+                'p95': latencies[min(len(latencies) - 1, len(latencies) * 95 // 100)],
+                'max': latencies[-1],
+            })
+        return {
+            'requests': self.requests,
+            'coalesced': self.coalesced,
+            'computations': self.computations,
+            'timeouts': self.timeouts,
+            'errors': self.errors,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'latency': latency,
+        }
+
+
+class SolveService:
+    # workers - processes of the pool, executor - any concurrent.futures executor instead of the pool
+    def __init__(self, workers=None, executor=None):
+        self.executor = executor or concurrent.futures.ProcessPoolExecutor(workers)
+        self.metrics = ServiceMetrics()
+        # puzzle text -> (deadline, future of the computation)
+        self.computations = {}
+
+    # the result of einstein_batch.solve_text, {'solved': False, 'timeout': True, ...} if the timeout passes first
+    async def solve(self, text, timeout=None):
+        metrics = self.metrics
+        metrics.requests += 1
+        start = time.time()
+        deadline = None if timeout == None else start + timeout
+
+        computation = self.computations.get(text)
+        # a computation stopping before this deadline can not answer the request
+        if computation != None and (computation[0] == None or (deadline != None and computation[0] >= deadline)):
+            metrics.coalesced += 1
+            future = computation[1]
+        else:
+            future = self.submit(text, deadline)
+
+        metrics.waiting += 1
+        try:
+            if timeout == None:
+                result = await asyncio.shield(future)
+            else:
+                # the worker stops at the deadline, this is for a pass which takes longer
+                result = await asyncio.wait_for(asyncio.shield(future), max(0, deadline - time.time()) + 1)
+        except asyncio.TimeoutError:
+            result = {'solved': False, 'error': "deadline passed", 'timeout': True}
+        except Exception as error:
+            # e.g. a worker of the pool died, every request waiting for the computation gets the error
+            result = {'solved': False, 'error': type(error).__name__ + ": " + str(error)}
+        finally:
+            metrics.waiting -= 1
+
+        if result.get('timeout'):
+            metrics.timeouts += 1
+        elif 'error' in result:
+            metrics.errors += 1
+        metrics.latencies.append(time.time() - start)
+        return result
+
+    def submit(self, text, deadline):
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, einstein_batch.solve_text, text, deadline)
+        self.computations[text] = (deadline, future)
+        self.metrics.computations += 1
+        self.metrics.in_flight += 1
+
+        def done(future):
+            self.metrics.in_flight -= 1
+            if self.computations.get(text, (None, None))[1] is future:
+                del self.computations[text]
+        future.add_done_callback(done)
+        return future
+
+    def close(self):
+        self.executor.shutdown()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+
+# SolveService on an event loop of its own, for blocking code
+class Client:
+    def __init__(self, workers=None, executor=None):
+        self.loop = asyncio.new_event_loop()
+        self.service = SolveService(workers, executor)
+
+    def solve(self, text, timeout=None):
+        return self.loop.run_until_complete(self.service.solve(text, timeout))
+
+    # results of the puzzles solved concurrently, in their order
+    def solve_all(self, texts, timeout=None):
+        async def solve_all():
+            return await asyncio.gather(*(self.service.solve(text, timeout) for text in texts))
+        return self.loop.run_until_complete(solve_all())
+
+    def metrics(self):
+        return self.service.metrics.as_dict()
+
+    def close(self):
+        self.service.close()
+        self.loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,181 @@
+import mmap
+import struct
+
+from einstein import *
+from einstein_cache import clue
+
+# Solver state in a compact binary format, to checkpoint long solves, send partly solved puzzles to other
+# processes, or to start from a solved prefix of the clues and add the rest.
+#
+# data = dumps(solver)       solver = loads(data)
+# save(solver, path)         solver = load(path)      - load reads the file through mmap
+#
+# Little endian:
+# header      b'EINS', version H, attributes H, rules I, relations I
+# attribute   kind B (0 values, 1 ordinal), order H, name, then the first and the last value ii for ordinal,
+#             or the count of values H and every value as type B (0 text, 1 integer) and text or i
+# rule        kind B, number i, attribute H (NONE for none), values H and (attribute H, index H) for each
+# relations   decided and same bits by Relation.id, (relations + 7) // 8 bytes each
+# text is its UTF-8 length H and the bytes
+#
+# The decided relations are restored as decisions of the Snapshot, the rules derive the rest again on solve.
+# Version 1 had no orders, the attributes were ordered by their position.
+
+MAGIC = b'EINS'
+VERSION = 2
+HEADER = struct.Struct('<4sHHII')
+RULE = struct.Struct('<BiHH')
+NONE = 0xFFFF
+
+KINDS = ('exclusive', 'subsets', 'same', 'different', 'offset', 'distance', 'before', 'apart', 'either')
+
+
+class Snapshot:
+    def __str__(self):
+        return "Snapshot"
+
+
+# the source of the restored decisions
+SNAPSHOT = Snapshot()
+
+
+def pack_text(text):
+    data = text.encode('utf-8')
+    return struct.pack('<H', len(data)) + data
+
+
+def dumps(solver):
+    parts = [HEADER.pack(MAGIC, VERSION, len(solver.attrs), len(solver.list), len(solver.relation_list))]
+    for attr in solver.attrs:
+        values = [atval.value for atval in attr.ordered_values]
+        if isinstance(attr, Ordinal):
+            parts.append(struct.pack('<BH', 1, attr.order) + pack_text(attr.name) +
+                         struct.pack('<ii', values[0], values[-1]))
+            continue
+        parts.append(struct.pack('<BH', 0, attr.order) + pack_text(attr.name) + struct.pack('<H', len(values)))
+        for value in values:
+            if isinstance(value, int):
+                parts.append(b'\x01' + struct.pack('<i', value))
+            else:
+                parts.append(b'\x00' + pack_text(str(value)))
+
+    positions = {attr: position for (position, attr) in enumerate(solver.attrs)}
+    for rule in solver.list:
+        item = clue(rule)
+        if item == None:
+            raise ValueError("no snapshot format for " + str(rule))
+        (kind, number, attr, atvals, _) = item
+        parts.append(RULE.pack(KINDS.index(kind), number, NONE if attr == None else positions[attr], len(atvals)))
+        parts.extend(struct.pack('<HH', positions[atval.attr], atval.index) for atval in atvals)
+
+    decided = 0
+    same = 0
+    for relation in solver.relation_list:
+        if relation in solver:
+            decided |= 1 << relation.id
+            if solver.is_same(relation):
+                same |= 1 << relation.id
+    size = (len(solver.relation_list) + 7) // 8
+    parts.append(decided.to_bytes(size, 'little'))
+    parts.append(same.to_bytes(size, 'little'))
+    return b''.join(parts)
+
+
+class Reader:
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def unpack(self, layout):
+        if isinstance(layout, str):
+            layout = struct.Struct(layout)
+        values = layout.unpack_from(self.data, self.offset)
+        self.offset += layout.size
+        return values
+
+    def text(self):
+        (length,) = self.unpack('<H')
+        self.offset += length
+        return bytes(self.data[self.offset - length:self.offset]).decode('utf-8')
+
+    def integer(self, size):
+        self.offset += size
+        return int.from_bytes(self.data[self.offset - size:self.offset], 'little')
+
+
+# a Solver with the rules and decided relations of the snapshot, any buffer such as bytes or mmap
+def loads(data):
+    reader = Reader(data)
+    (magic, version, attrs_count, rules_count, relations_count) = reader.unpack(HEADER)
+    if magic != MAGIC:
+        raise ValueError("not a solver snapshot")
+    if version not in (1, VERSION):
+        raise ValueError("unsupported snapshot version " + str(version))
+
+    attrs = []
+    for position in range(attrs_count):
+        (kind,) = reader.unpack('<B')
+        (order,) = (position,) if version == 1 else reader.unpack('<H')
+        name = reader.text()
+        if kind == 1:
+            (first, last) = reader.unpack('<ii')
+            attrs.append(Ordinal(name, order, first, last))
+            continue
+        (count,) = reader.unpack('<H')
+        values = []
+        for _ in range(count):
+            (value_type,) = reader.unpack('<B')
+            values.append(reader.unpack('<i')[0] if value_type == 1 else reader.text())
+        attrs.append(Attr(name, order, values))
+
+    solver = Solver(attrs)
+    for _ in range(rules_count):
+        (kind, number, attr_position, atvals_count) = reader.unpack(RULE)
+        attr = None if attr_position == NONE else attrs[attr_position]
+        atvals = []
+        for _ in range(atvals_count):
+            (position, index) = reader.unpack('<HH')
+            atvals.append(attrs[position].ordered_values[index])
+        solver.add(make_rule(KINDS[kind], number, attr, atvals))
+
+    size = (relations_count + 7) // 8
+    decided = reader.integer(size)
+    same = reader.integer(size)
+    relations = solver.relation_list
+    for (bits, is_same) in ((same, True), (decided & ~same, False)):
+        while bits:
+            low = bits & -bits
+            solver.decide(relations[low.bit_length() - 1], is_same, SNAPSHOT)
+            bits ^= low
+    return solver
+
+
+def make_rule(kind, number, attr, atvals):
+    if kind == 'exclusive':
+        return Exclusive()
+    if kind == 'subsets':
+        return Subsets(number)
+    if kind == 'same':
+        return Same.of(*atvals)
+    if kind == 'different':
+        return Different.of(*atvals)
+    if kind == 'offset':
+        return Offset(atvals[0], atvals[1], attr, number)
+    if kind == 'distance':
+        return Distance(atvals[0], atvals[1], attr, number)
+    if kind == 'before':
+        return Before(atvals[0], atvals[1], attr, number)
+    if kind == 'apart':
+        return Apart(atvals[0], atvals[1], attr, number)
+    return Either.of(*atvals, exclusive=bool(number))
+
+
+def save(solver, path):
+    with open(path, 'wb') as f:
+        f.write(dumps(solver))
+
+
+def load(path):
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return loads(data)
@@ -1,6 +1,49 @@
+import asyncio
+import concurrent.futures
+import json
+import os
+import tempfile
+import time
 import unittest
 
 from einstein import *
+import einstein_parser
+import einstein_batch
+import einstein_cache
+import einstein_generator
+import einstein_bench
+import einstein_numpy
+import einstein_sat
+import einstein_service
+import einstein_snapshot
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def einstein_solver():
+    house = Attr('house', 0, [1, 2, 3, 4, 5])
+    color = Attr('color', 1, ['red', 'green', 'white', 'yellow', 'blue'])
+    nation = Attr('nation', 2, ['english', 'spanish', 'ukrainian', 'norwegian', 'japanese'])
+    animal = Attr('animal', 3, ['dog', 'snail', 'fox', 'horse', 'zebra'])
+    drink = Attr('drink', 4, ['coffee', 'tea', 'milk', 'orangejuice', 'water'])
+    smoke = Attr('smoke', 5, ['oldgold', 'kool', 'chesterfield', 'luckystrike', 'parliament'])
+
+    solver = Solver([house, color, nation, animal, drink, smoke])
+    solver.add(Exclusive())
+    solver.add(Same.of(color.red, nation.english))
+    solver.add(Same.of(nation.spanish, animal.dog))
+    solver.add(Same.of(color.green, drink.coffee))
+    solver.add(Same.of(nation.ukrainian, drink.tea))
+    solver.add(Offset(color.green, color.white, house, 1))
+    solver.add(Same.of(smoke.oldgold, animal.snail))
+    solver.add(Same.of(color.yellow, smoke.kool))
+    solver.add(Same.of(house[3], drink.milk))
+    solver.add(Same.of(nation.norwegian, house[1]))
+    solver.add(Distance(smoke.chesterfield, animal.fox, house, 1))
+    solver.add(Distance(animal.horse, smoke.kool, house, 1))
+    solver.add(Same.of(smoke.luckystrike, drink.orangejuice))
+    solver.add(Same.of(nation.japanese, smoke.parliament))
+    solver.add(Distance(nation.norwegian, color.blue, house, 1))
+    return solver
 
 class AttrTests(unittest.TestCase):
     @classmethod
@@ -23,6 +66,21 @@ class AttrTests(unittest.TestCase):
     def test_value_at_index_over_max_returns_none(self):
         self.assertIsNone(self.attr.value_at(5))
 
+    # neighbours
+    def test_neighbours_are_offset_values(self):
+        self.assertEqual([str(atval) for atval in self.attr.neighbours(2)], ['attr:v3', 'attr:v4', 'attr:v5', 'None', 'None'])
+
+    def test_neighbours_are_computed_once(self):
+        self.assertIs(self.attr.neighbours(-1), self.attr.neighbours(-1))
+
+
+class OrdinalTests(unittest.TestCase):
+    def test_values_are_consecutive_integers(self):
+        house = Ordinal('house', 0, 1, 5)
+        self.assertEqual([atval.value for atval in house.ordered_values], [1, 2, 3, 4, 5])
+        self.assertEqual(str(house[3]), 'house:3')
+        self.assertIsInstance(house, Attr)
+
 class AttrValueTests(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -74,6 +132,67 @@ class RelationTests(unittest.TestCase):
     def test_with_atval_c1_diff_attr_returns_false(self):
         self.assertFalse(self.rel.with_atval(self.attr_c.c1))
     
+class RelationMatrixTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.A = Attr('A', 0, ['A1', 'A2', 'A3'])
+        cls.B = Attr('B', 1, ['B1', 'B2', 'B3'])
+
+    def setUp(self):
+        self.solver = Solver([self.A, self.B])
+
+    def test_get_returns_none_when_not_decided(self):
+        self.assertIsNone(self.solver.get(Relation(self.A.A1, self.B.B2)))
+        self.assertNotIn(Relation(self.A.A1, self.B.B2), self.solver)
+
+    def test_get_returns_same_in_any_order(self):
+        self.solver.add(Same.of(self.A.A1, self.B.B2))
+        self.assertIsInstance(self.solver.get(Relation(self.B.B2, self.A.A1)), Same)
+        self.assertIn(Relation(self.A.A1, self.B.B2), self.solver)
+
+    def test_get_returns_different(self):
+        self.solver.add(Different.of(self.B.B3, self.A.A2))
+        self.assertIsInstance(self.solver.get(Relation(self.A.A2, self.B.B3)), Different)
+        self.assertFalse(self.solver.is_same(Relation(self.A.A2, self.B.B3)))
+
+    def test_different_mask_is_symmetric(self):
+        self.solver.add(Different.of(self.A.A2, self.B.B1)) \
+            .add(Different.of(self.A.A2, self.B.B3)) \
+            .add(Different.of(self.A.A3, self.B.B3))
+        self.assertEqual(self.solver.different_mask(self.A.A2, self.B), 0b101)
+        self.assertEqual(self.solver.different_mask(self.B.B3, self.A), 0b110)
+
+class InternedRelationTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.A = Attr('A', 0, ['A1', 'A2', 'A3'])
+        cls.B = Attr('B', 1, ['B1', 'B2'])
+        cls.C = Attr('C', 2, ['C1', 'C2'])
+
+    def setUp(self):
+        self.solver = Solver([self.A, self.B, self.C])
+
+    def test_relation_is_the_same_object_in_any_order(self):
+        relation = self.solver.relation(self.A.A2, self.C.C1)
+        self.assertIs(self.solver.relation(self.C.C1, self.A.A2), relation)
+        self.assertEqual(relation, Relation(self.A.A2, self.C.C1))
+
+    def test_relation_ids_index_relation_list(self):
+        relations = self.solver.relations()
+        self.assertEqual(len(relations), 3 * 2 + 3 * 2 + 2 * 2)
+        self.assertEqual([relation.id for relation in relations], list(range(len(relations))))
+
+    def test_are_same_and_are_different_match_relation(self):
+        self.solver.add(Same.of(self.B.B2, self.A.A3)).add(Different.of(self.C.C1, self.B.B1))
+        self.assertTrue(self.solver.are_same(self.A.A3, self.B.B2))
+        self.assertTrue(self.solver.are_same(self.B.B2, self.A.A3))
+        self.assertTrue(self.solver.are_different(self.B.B1, self.C.C1))
+        self.assertFalse(self.solver.are_different(self.B.B2, self.C.C1))
+
+    def test_objects_have_no_dict(self):
+        for value in (self.A, self.A.A1, self.solver.relation(self.A.A1, self.B.B1)):
+            self.assertFalse(hasattr(value, '__dict__'))
+
 class ExclusiveTests(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -87,18 +206,123 @@ class ExclusiveTests(unittest.TestCase):
         solver = self.solver.add(Different.of(self.A.A2, self.B.B1)) \
             .add(Different.of(self.A.A2, self.B.B3))
         rule = Exclusive()
-        rule.solver = solver
-        result = rule.evaluate(Relation(self.A.A2, self.B.B2))
+        result = rule.evaluate(solver, Relation(self.A.A2, self.B.B2))
         self.assertIsInstance(result, Same)
         self.assertEqual(result.relation, Relation(self.A.A2, self.B.B2))
 
     def test_exclusive_returns_none_when_not_all_other_options_are_excluded(self):
         solver = self.solver.add(Different.of(self.A.A2, self.B.B1))
         rule = Exclusive()
-        rule.solver = solver
-        result = rule.evaluate(Relation(self.A.A2, self.B.B2))
+        result = rule.evaluate(solver, Relation(self.A.A2, self.B.B2))
         self.assertIsNone(result)
 
+class SubsetsTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.attr_a = Attr('attrA', 0, ['a1', 'a2', 'a3', 'a4'])
+        cls.attr_b = Attr('attrB', 1, ['b1', 'b2', 'b3', 'b4'])
+        cls.attr_c = Attr('attrC', 2, ['c1', 'c2', 'c3', 'c4'])
+
+    def setUp(self):
+        self.solver = Solver([self.attr_a, self.attr_b, self.attr_c])
+        self.rule = Subsets()
+
+    def only(self, atval, attr, names):
+        for value in attr.ordered_values:
+            if value.value not in names:
+                self.solver.add(Different.of(atval, value))
+
+    # a1 и a2 могут быть только b1 или b2 - a3 не b1 и не b2
+    def test_naked_pair_returns_different(self):
+        self.only(self.attr_a.a1, self.attr_b, ('b1', 'b2'))
+        self.only(self.attr_a.a2, self.attr_b, ('b1', 'b2'))
+        self.assertIsInstance(self.rule.evaluate(self.solver, Relation(self.attr_a.a3, self.attr_b.b1)), Different)
+        self.assertIsInstance(self.rule.evaluate(self.solver, Relation(self.attr_a.a4, self.attr_b.b2)), Different)
+        self.assertIsNone(self.rule.evaluate(self.solver, Relation(self.attr_a.a3, self.attr_b.b3)))
+        self.assertIsNone(self.rule.evaluate(self.solver, Relation(self.attr_a.a1, self.attr_b.b1)))
+
+    # b1 и b2 могут быть только a1 или a2 - a1 не b3 и не b4
+    def test_hidden_pair_returns_different(self):
+        self.only(self.attr_b.b1, self.attr_a, ('a1', 'a2'))
+        self.only(self.attr_b.b2, self.attr_a, ('a1', 'a2'))
+        self.assertIsInstance(self.rule.evaluate(self.solver, Relation(self.attr_a.a1, self.attr_b.b3)), Different)
+        self.assertIsInstance(self.rule.evaluate(self.solver, Relation(self.attr_a.a2, self.attr_b.b4)), Different)
+        self.assertIsNone(self.rule.evaluate(self.solver, Relation(self.attr_a.a3, self.attr_b.b3)))
+
+    # a1: b1 b2, a2: b2 b3, a3: b1 b3 - a4 только b4
+    def test_naked_triple_returns_different(self):
+        self.only(self.attr_a.a1, self.attr_b, ('b1', 'b2'))
+        self.only(self.attr_a.a2, self.attr_b, ('b2', 'b3'))
+        self.only(self.attr_a.a3, self.attr_b, ('b1', 'b3'))
+        for name in ('b1', 'b2', 'b3'):
+            self.assertIsInstance(self.rule.evaluate(self.solver, Relation(self.attr_a.a4, self.attr_b[name])), Different)
+        self.assertIsNone(self.rule.evaluate(self.solver, Relation(self.attr_a.a4, self.attr_b.b4)))
+
+    # the rest of a triple of 6 values is a hidden triple, Subsets(2) finds neither
+    def test_pair_size_misses_triple(self):
+        attr_a = Attr('attrA', 0, ['a1', 'a2', 'a3', 'a4', 'a5', 'a6'])
+        attr_b = Attr('attrB', 1, ['b1', 'b2', 'b3', 'b4', 'b5', 'b6'])
+        self.solver = Solver([attr_a, attr_b])
+        self.only(attr_a.a1, attr_b, ('b1', 'b2'))
+        self.only(attr_a.a2, attr_b, ('b2', 'b3'))
+        self.only(attr_a.a3, attr_b, ('b1', 'b3'))
+
+        pairs = Subsets(2)
+        triples = Subsets(3)
+        self.assertIsNone(pairs.evaluate(self.solver, Relation(attr_a.a4, attr_b.b1)))
+        self.assertIsInstance(triples.evaluate(self.solver, Relation(attr_a.a4, attr_b.b1)), Different)
+
+    # a1 может быть только c1 или c2, b1 только c3 или c4 - a1 не b1
+    def test_disjoint_values_return_different(self):
+        self.only(self.attr_a.a1, self.attr_c, ('c1', 'c2'))
+        self.only(self.attr_b.b1, self.attr_c, ('c3', 'c4'))
+        self.assertIsInstance(self.rule.evaluate(self.solver, Relation(self.attr_a.a1, self.attr_b.b1)), Different)
+        self.assertIsNone(self.rule.evaluate(self.solver, Relation(self.attr_a.a1, self.attr_b.b2)))
+
+    def test_stalled_yields_undecided_relations(self):
+        self.only(self.attr_a.a1, self.attr_b, ('b1', 'b2'))
+        self.only(self.attr_a.a2, self.attr_b, ('b1', 'b2'))
+        results = [str(result.relation) for result in self.rule.stalled(self.solver)]
+        self.assertEqual(sorted(results), ['attrA:a3<->attrB:b1', 'attrA:a3<->attrB:b2',
+                                           'attrA:a4<->attrB:b1', 'attrA:a4<->attrB:b2'])
+
+    # без изменений ничего не проверяется снова, после изменения проверяются изменившиеся значения
+    def test_stalled_checks_again_after_rows_change(self):
+        self.only(self.attr_a.a1, self.attr_b, ('b1', 'b2'))
+        self.only(self.attr_a.a2, self.attr_b, ('b1', 'b2'))
+        for result in self.rule.stalled(self.solver):
+            self.solver.decide(result.relation, False, self.rule)
+        self.assertEqual(list(self.rule.stalled(self.solver)), [])
+
+        checked = []
+        masks = self.rule.masks
+        self.rule.masks = lambda solver, atval: checked.append(atval) or masks(solver, atval)
+        self.assertEqual(list(self.rule.stalled(self.solver)), [])
+        self.assertEqual(checked, [])
+
+        self.only(self.attr_a.a3, self.attr_c, ('c1', 'c2'))
+        self.only(self.attr_b.b3, self.attr_c, ('c3', 'c4'))
+        results = [str(result.relation) for result in self.rule.stalled(self.solver)]
+        self.assertIn('attrA:a3<->attrB:b3', results)
+
+    def test_search_finds_the_solutions_of_search_without_subsets(self):
+        (attrs, rules) = einstein_generator.generate(5, 5, seed=2)
+        expected = einstein_generator.build(attrs, rules[:len(rules) // 3]).count_solutions(50)
+        solver = einstein_generator.build(attrs, rules[:len(rules) // 3], subsets=3)
+        self.assertEqual(sorted(map(str, solver.count_solutions(50))), sorted(map(str, expected)))
+
+    def test_solves_einstein_without_search(self):
+        solver = einstein_solver()
+        (house, color, nation, animal, drink, smoke) = solver.attrs
+        solver.add(Subsets())
+
+        solver.solve()
+
+        self.assertEqual(solver.decided_count(), solver.relation_count())
+        self.assertTrue(solver.is_same(Relation(nation.japanese, animal.zebra)))
+        self.assertTrue(solver.verify())
+
+
 class OffsetTests(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -116,70 +340,60 @@ class OffsetTests(unittest.TestCase):
     def test_left_not_white_returns_this_not_green(self):
         solver = self.solver.add(Different.of(self.house[2], self.color.white))
         rule = Offset(self.color.green, self.color.white, self.house, 1)
-        rule.solver = solver
-        result = rule.evaluate(Relation(self.house[3], self.color.green))
+        result = rule.evaluate(solver, Relation(self.house[3], self.color.green))
         self.assertIsInstance(result, Different)
 
     # - если дом X-1 - белый, то дом X - зеленый| (X, зеленый): if (X-1, белый) -> Same
     def test_left_white_returns_this_green(self):
         solver = self.solver.add(Same.of(self.house[2], self.color.white))
         rule = Offset(self.color.green, self.color.white, self.house, 1)
-        rule.solver = solver
-        result = rule.evaluate(Relation(self.house[3], self.color.green))
+        result = rule.evaluate(solver, Relation(self.house[3], self.color.green))
         self.assertIsInstance(result, Same)
 
     # - если дом X+1 - не зеленый, то дом X - не белый
     def test_right_not_green_returns_this_not_white(self):
         solver = self.solver.add(Different.of(self.house[4], self.color.green))
         rule = Offset(self.color.green, self.color.white, self.house, 1)
-        rule.solver = solver
-        result = rule.evaluate(Relation(self.house[3], self.color.white))
+        result = rule.evaluate(solver, Relation(self.house[3], self.color.white))
         self.assertIsInstance(result, Different)
 
     # - если дом X+1 - зеленый, то дом X - белый
     def test_right_green_returns_this_white(self):
         solver = self.solver.add(Same.of(self.house[4], self.color.green))
         rule = Offset(self.color.green, self.color.white, self.house, 1)
-        rule.solver = solver
-        result = rule.evaluate(Relation(self.house[3], self.color.white))
+        result = rule.evaluate(solver, Relation(self.house[3], self.color.white))
         self.assertIsInstance(result, Same)
 
     def test_not_offset_attr_returns_none(self):
         solver = self.solver.add(Different.of(self.house[4], self.color.green))
         rule = Offset(self.color.green, self.color.white, self.house, 1)
-        rule.solver = solver
-        result = rule.evaluate(Relation(self.smoke.kool, self.color.white))
+        result = rule.evaluate(solver, Relation(self.smoke.kool, self.color.white))
         self.assertIsNone(result)
 
     def test_not_atval_returns_none(self):
         solver = self.solver.add(Different.of(self.house[4], self.color.green))
         rule = Offset(self.color.green, self.color.white, self.house, 1)
-        rule.solver = solver
-        result = rule.evaluate(Relation(self.house[3], self.color.yellow))
+        result = rule.evaluate(solver, Relation(self.house[3], self.color.yellow))
         self.assertIsNone(result)
 
     def test_no_left_returns_this_not_green(self):
         rule = Offset(self.color.green, self.color.white, self.house, 1)
-        rule.solver = self.solver
-        result = rule.evaluate(Relation(self.house[1], self.color.green))
+        result = rule.evaluate(self.solver, Relation(self.house[1], self.color.green))
         self.assertIsInstance(result, Different)
 
     def test_no_right_returns_this_not_white(self):
         rule = Offset(self.color.green, self.color.white, self.house, 1)
-        rule.solver = self.solver
-        result = rule.evaluate(Relation(self.house[5], self.color.white))
+        result = rule.evaluate(self.solver, Relation(self.house[5], self.color.white))
         self.assertIsInstance(result, Different)
 
     def test_atval1_left_can_be_white_returns_none(self):
         rule = Offset(self.color.green, self.color.white, self.house, 1)
-        rule.solver = self.solver
-        result = rule.evaluate(Relation(self.house[3], self.color.green))
+        result = rule.evaluate(self.solver, Relation(self.house[3], self.color.green))
         self.assertIsNone(result)
 
     def test_atval2_right_can_be_green_returns_none(self):
         rule = Offset(self.color.green, self.color.white, self.house, 1)
-        rule.solver = self.solver
-        result = rule.evaluate(Relation(self.house[3], self.color.white))
+        result = rule.evaluate(self.solver, Relation(self.house[3], self.color.white))
         self.assertIsNone(result)
 
 class DistanceTests(unittest.TestCase):
@@ -203,130 +417,303 @@ class DistanceTests(unittest.TestCase):
         solver = self.solver.add(Different.of(self.house[2], self.smoke.chesterfield)) \
             .add(Different.of(self.house[4], self.smoke.chesterfield))
         rule = Distance(self.smoke.chesterfield, self.animal.fox, self.house, 1)
-        rule.solver = solver
-        result = rule.evaluate(Relation(self.house[3], self.animal.fox))
+        result = rule.evaluate(solver, Relation(self.house[3], self.animal.fox))
         self.assertIsInstance(result, Different)
 
     def test_left_not_chesterfield_right_not_exist_returns_this_not_fox(self):
         solver = self.solver.add(Different.of(self.house[4], self.smoke.chesterfield))
         rule = Distance(self.smoke.chesterfield, self.animal.fox, self.house, 1)
-        rule.solver = solver
-        result = rule.evaluate(Relation(self.house[5], self.animal.fox))
+        result = rule.evaluate(solver, Relation(self.house[5], self.animal.fox))
         self.assertIsInstance(result, Different)
 
     def test_left_not_exist_right_not_chesterfield_returns_this_not_fox(self):
         solver = self.solver.add(Different.of(self.house[2], self.smoke.chesterfield))
         rule = Distance(self.smoke.chesterfield, self.animal.fox, self.house, 1)
-        rule.solver = solver
-        result = rule.evaluate(Relation(self.house[1], self.animal.fox))
+        result = rule.evaluate(solver, Relation(self.house[1], self.animal.fox))
         self.assertIsInstance(result, Different)
 
     def test_left_right_not_fox_returns_this_not_chesterfield(self):
         solver = self.solver.add(Different.of(self.house[2], self.animal.fox)) \
             .add(Different.of(self.house[4], self.animal.fox))
         rule = Distance(self.smoke.chesterfield, self.animal.fox, self.house, 1)
-        rule.solver = solver
-        result = rule.evaluate(Relation(self.house[3], self.smoke.chesterfield))
+        result = rule.evaluate(solver, Relation(self.house[3], self.smoke.chesterfield))
         self.assertIsInstance(result, Different)
 
     def test_left_not_fox_right_not_exist_returns_this_not_chesterfield(self):
         solver = self.solver.add(Different.of(self.house[4], self.animal.fox))
         rule = Distance(self.smoke.chesterfield, self.animal.fox, self.house, 1)
-        rule.solver = solver
-        result = rule.evaluate(Relation(self.house[5], self.smoke.chesterfield))
+        result = rule.evaluate(solver, Relation(self.house[5], self.smoke.chesterfield))
         self.assertIsInstance(result, Different)
 
     def test_left_not_exist_right_not_fox_returns_this_not_chesterfield(self):
         solver = self.solver.add(Different.of(self.house[2], self.animal.fox))
         rule = Distance(self.smoke.chesterfield, self.animal.fox, self.house, 1)
-        rule.solver = solver
-        result = rule.evaluate(Relation(self.house[1], self.smoke.chesterfield))
+        result = rule.evaluate(solver, Relation(self.house[1], self.smoke.chesterfield))
         self.assertIsInstance(result, Different)
 
     def test_not_with_distance_attr_returns_none(self):
         solver = self.solver.add(Different.of(self.house[2], self.smoke.chesterfield)) \
             .add(Different.of(self.house[4], self.smoke.chesterfield))
         rule = Distance(self.smoke.chesterfield, self.animal.fox, self.house, 1)
-        rule.solver = solver
-        result = rule.evaluate(Relation(self.drink.tea, self.animal.fox))
+        result = rule.evaluate(solver, Relation(self.drink.tea, self.animal.fox))
         self.assertIsNone(result)
 
     def test_not_with_chesterfield_returns_none(self):
         solver = self.solver.add(Different.of(self.house[2], self.animal.fox)) \
             .add(Different.of(self.house[4], self.animal.fox))
         rule = Distance(self.smoke.chesterfield, self.animal.fox, self.house, 1)
-        rule.solver = solver
-        result = rule.evaluate(Relation(self.house[3], self.smoke.kool))
+        result = rule.evaluate(solver, Relation(self.house[3], self.smoke.kool))
         self.assertIsNone(result)
 
     def test_chesterfield_left_not_different_returns_none(self):
         solver = self.solver.add(Different.of(self.house[4], self.animal.fox))
         rule = Distance(self.smoke.chesterfield, self.animal.fox, self.house, 1)
-        rule.solver = solver
-        result = rule.evaluate(Relation(self.house[3], self.smoke.chesterfield))
+        result = rule.evaluate(solver, Relation(self.house[3], self.smoke.chesterfield))
         self.assertIsNone(result)
 
     def test_chesterfield_right_not_different_returns_none(self):
         solver = self.solver.add(Different.of(self.house[2], self.animal.fox))
         rule = Distance(self.smoke.chesterfield, self.animal.fox, self.house, 1)
-        rule.solver = solver
-        result = rule.evaluate(Relation(self.house[3], self.smoke.chesterfield))
+        result = rule.evaluate(solver, Relation(self.house[3], self.smoke.chesterfield))
         self.assertIsNone(result)
 
     def test_not_with_fox_returns_none(self):
         solver = self.solver.add(Different.of(self.house[2], self.smoke.chesterfield)) \
             .add(Different.of(self.house[4], self.smoke.chesterfield))
         rule = Distance(self.smoke.chesterfield, self.animal.fox, self.house, 1)
-        rule.solver = solver
-        result = rule.evaluate(Relation(self.house[3], self.animal.zebra))
+        result = rule.evaluate(solver, Relation(self.house[3], self.animal.zebra))
         self.assertIsNone(result)
 
     def test_fox_left_not_different_returns_none(self):
         solver = self.solver.add(Different.of(self.house[4], self.smoke.chesterfield))
         rule = Distance(self.smoke.chesterfield, self.animal.fox, self.house, 1)
-        rule.solver = solver
-        result = rule.evaluate(Relation(self.house[3], self.animal.fox))
+        result = rule.evaluate(solver, Relation(self.house[3], self.animal.fox))
         self.assertIsNone(result)
 
     def test_fox_right_not_different_returns_none(self):
         solver = self.solver.add(Different.of(self.house[2], self.smoke.chesterfield))
         rule = Distance(self.smoke.chesterfield, self.animal.fox, self.house, 1)
-        rule.solver = solver
-        result = rule.evaluate(Relation(self.house[3], self.animal.fox))
+        result = rule.evaluate(solver, Relation(self.house[3], self.animal.fox))
         self.assertIsNone(result)
 
     def test_left_chesterfield_next_not_fox_returns_this_fox(self):
         solver = self.solver.add(Same.of(self.house[2], self.smoke.chesterfield)) \
             .add(Different.of(self.house[1], self.animal.fox))
         rule = Distance(self.smoke.chesterfield, self.animal.fox, self.house, 1)
-        rule.solver = solver
-        result = rule.evaluate(Relation(self.house[3], self.animal.fox))
+        result = rule.evaluate(solver, Relation(self.house[3], self.animal.fox))
         self.assertIsInstance(result, Same)
 
     def test_left_chesterfield_next_not_exist_returns_this_fox(self):
         solver = self.solver.add(Same.of(self.house[1], self.smoke.chesterfield))
         rule = Distance(self.smoke.chesterfield, self.animal.fox, self.house, 1)
-        rule.solver = solver
-        result = rule.evaluate(Relation(self.house[2], self.animal.fox))
+        result = rule.evaluate(solver, Relation(self.house[2], self.animal.fox))
         self.assertIsInstance(result, Same)
 
     def test_right_chesterfield_next_not_fox_returns_this_fox(self):
         solver = self.solver.add(Same.of(self.house[4], self.smoke.chesterfield)) \
             .add(Different.of(self.house[5], self.animal.fox))
         rule = Distance(self.smoke.chesterfield, self.animal.fox, self.house, 1)
-        rule.solver = solver
-        result = rule.evaluate(Relation(self.house[3], self.animal.fox))
+        result = rule.evaluate(solver, Relation(self.house[3], self.animal.fox))
         self.assertIsInstance(result, Same)
 
     def test_right_chesterfield_next_not_exist_returns_this_fox(self):
         solver = self.solver.add(Same.of(self.house[5], self.smoke.chesterfield))
         rule = Distance(self.smoke.chesterfield, self.animal.fox, self.house, 1)
-        rule.solver = solver
-        result = rule.evaluate(Relation(self.house[4], self.animal.fox))
+        result = rule.evaluate(solver, Relation(self.house[4], self.animal.fox))
         self.assertIsInstance(result, Same)
 
  
 
+class BeforeTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.color = Attr('color', 0, ['red', 'green', 'white', 'yellow', 'blue'])
+        cls.house = Ordinal('house', 1, 1, 5)
+        cls.smoke = Attr('smoke', 2, ['oldgold', 'kool', 'chesterfield', 'luckystrike', 'parliament'])
+
+    def setUp(self):
+        self.solver = Solver([self.color, self.house, self.smoke])
+
+    # Белый дом где-то левее зелёного.
+    # - белый дом не последний
+    def test_last_house_returns_not_before(self):
+        rule = Before(self.color.white, self.color.green, self.house)
+        result = rule.evaluate(self.solver, Relation(self.house[5], self.color.white))
+        self.assertIsInstance(result, Different)
+
+    # - зелёный дом не первый
+    def test_first_house_returns_not_after(self):
+        rule = Before(self.color.white, self.color.green, self.house)
+        result = rule.evaluate(self.solver, Relation(self.house[1], self.color.green))
+        self.assertIsInstance(result, Different)
+
+    # - если зелёный дом не правее дома 3, то белый дом не в доме 3
+    def test_after_bound_returns_not_before(self):
+        solver = self.solver.add(Different.of(self.house[4], self.color.green)) \
+            .add(Different.of(self.house[5], self.color.green))
+        rule = Before(self.color.white, self.color.green, self.house)
+        self.assertIsInstance(rule.evaluate(solver, Relation(self.house[3], self.color.white)), Different)
+        self.assertIsNone(rule.evaluate(solver, Relation(self.house[2], self.color.white)))
+
+    # - если белый дом не левее дома 3, то зелёный дом не в доме 3
+    def test_before_bound_returns_not_after(self):
+        solver = self.solver.add(Same.of(self.house[3], self.color.white))
+        rule = Before(self.color.white, self.color.green, self.house)
+        self.assertIsInstance(rule.evaluate(solver, Relation(self.house[3], self.color.green)), Different)
+        self.assertIsNone(rule.evaluate(solver, Relation(self.house[4], self.color.green)))
+
+    def test_distance_keeps_values_apart(self):
+        rule = Before(self.color.white, self.smoke.kool, self.house, 2)
+        self.assertIsInstance(rule.evaluate(self.solver, Relation(self.house[4], self.color.white)), Different)
+        self.assertIsNone(rule.evaluate(self.solver, Relation(self.house[3], self.color.white)))
+        self.assertIsInstance(rule.evaluate(self.solver, Relation(self.house[2], self.smoke.kool)), Different)
+        self.assertIsNone(rule.evaluate(self.solver, Relation(self.house[3], self.smoke.kool)))
+
+    def test_other_relations_return_none(self):
+        rule = Before(self.color.white, self.color.green, self.house)
+        self.assertIsNone(rule.evaluate(self.solver, Relation(self.color.white, self.smoke.kool)))
+        self.assertIsNone(rule.evaluate(self.solver, Relation(self.house[1], self.color.red)))
+
+    def test_solver_propagates_bounds(self):
+        solver = self.solver.add(Exclusive()).add(Before(self.color.white, self.color.green, self.house)) \
+            .add(Before(self.color.green, self.color.blue, self.house)).add(Same.of(self.house[3], self.color.blue))
+        solver.solve()
+        self.assertTrue(solver.is_same(Relation(self.house[1], self.color.white)))
+        self.assertTrue(solver.is_same(Relation(self.house[2], self.color.green)))
+
+
+class ApartTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.color = Attr('color', 0, ['red', 'green', 'white', 'yellow', 'blue'])
+        cls.house = Ordinal('house', 1, 1, 5)
+
+    def setUp(self):
+        self.solver = Solver([self.color, self.house])
+
+    # Красный и синий дома стоят не ближе чем через два дома.
+    # - если синий дом в доме 2, то красный дом не в домах 1, 2, 3
+    def test_close_houses_return_different(self):
+        solver = self.solver.add(Same.of(self.house[2], self.color.blue))
+        rule = Apart(self.color.red, self.color.blue, self.house, 2)
+        for house in (1, 3):
+            self.assertIsInstance(rule.evaluate(solver, Relation(self.house[house], self.color.red)), Different)
+        for house in (4, 5):
+            self.assertIsNone(rule.evaluate(solver, Relation(self.house[house], self.color.red)))
+
+    # - средний из трёх домов не может быть ни красным, ни синим
+    def test_middle_house_returns_different(self):
+        attr = Ordinal('house', 1, 1, 3)
+        solver = Solver([self.color, attr])
+        rule = Apart(self.color.red, self.color.blue, attr, 2)
+        self.assertIsInstance(rule.evaluate(solver, Relation(attr[2], self.color.red)), Different)
+        self.assertIsInstance(rule.evaluate(solver, Relation(attr[2], self.color.blue)), Different)
+        self.assertIsNone(rule.evaluate(solver, Relation(attr[1], self.color.blue)))
+
+
+class LeftOfTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.color = Attr('color', 0, ['red', 'green', 'white', 'yellow', 'blue'])
+        cls.house = Ordinal('house', 1, 1, 5)
+
+    def setUp(self):
+        self.solver = Solver([self.color, self.house])
+
+    # Красный дом где-то левее синего.
+    # - если синий дом не правее дома 2, то красный дом не в доме 2
+    def test_last_blue_bounds_red(self):
+        solver = self.solver
+        for house in (3, 4, 5):
+            solver.add(Different.of(self.house[house], self.color.blue))
+        rule = LeftOf(self.color.red, self.color.blue, self.house)
+        self.assertIsInstance(rule.evaluate(solver, Relation(self.house[2], self.color.red)), Different)
+        self.assertIsNone(rule.evaluate(solver, Relation(self.house[1], self.color.red)))
+
+    # - если красный дом не левее дома 4, то синий дом не в доме 4
+    def test_first_red_bounds_blue(self):
+        solver = self.solver.add(Same.of(self.house[4], self.color.red))
+        rule = LeftOf(self.color.red, self.color.blue, self.house)
+        self.assertIsInstance(rule.evaluate(solver, Relation(self.house[4], self.color.blue)), Different)
+        self.assertIsNone(rule.evaluate(solver, Relation(self.house[5], self.color.blue)))
+
+    # Красный дом где-то правее синего - то же, что синий дом где-то левее красного.
+    def test_right_of_is_left_of_swapped(self):
+        rule = RightOf(self.color.red, self.color.blue, self.house)
+        self.assertIsInstance(rule.evaluate(self.solver, Relation(self.house[1], self.color.red)), Different)
+        self.assertIsInstance(rule.evaluate(self.solver, Relation(self.house[5], self.color.blue)), Different)
+        self.assertIsNone(rule.evaluate(self.solver, Relation(self.house[1], self.color.blue)))
+
+    def test_solver_orders_chain(self):
+        solver = self.solver.add(Exclusive())
+        for (left, right) in (('red', 'green'), ('green', 'white'), ('white', 'yellow'), ('yellow', 'blue')):
+            solver.add(LeftOf(self.color[left], self.color[right], self.house))
+        solver.solve()
+        for (house, color) in zip(range(1, 6), ('red', 'green', 'white', 'yellow', 'blue')):
+            self.assertTrue(solver.is_same(Relation(self.house[house], self.color[color])))
+
+
+class NotSameTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.color = Attr('color', 0, ['red', 'green', 'blue'])
+        cls.nation = Attr('nation', 1, ['english', 'spanish', 'norwegian'])
+
+    # Испанец живёт не в красном доме.
+    def test_add_decides_different(self):
+        solver = Solver([self.color, self.nation]).add(NotSame.of(self.color.red, self.nation.spanish))
+        self.assertTrue(solver.is_different(Relation(self.color.red, self.nation.spanish)))
+
+    def test_contradicts_same(self):
+        solver = Solver([self.color, self.nation]).add(Same.of(self.color.red, self.nation.spanish))
+        self.assertRaises(Contradiction, solver.add, NotSame.of(self.color.red, self.nation.spanish))
+
+
+class EitherTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.color = Attr('color', 0, ['red', 'green', 'white', 'blue'])
+        cls.nation = Attr('nation', 1, ['english', 'spanish', 'norwegian', 'japanese'])
+        cls.animal = Attr('animal', 2, ['dog', 'fox', 'horse', 'zebra'])
+
+    def setUp(self):
+        self.solver = Solver([self.color, self.nation, self.animal])
+
+    # Англичанин живёт в красном или синем доме.
+    # - англичанин живёт не в зелёном доме
+    def test_value_out_of_domain_returns_different(self):
+        rule = Either.of(self.nation.english, self.color.red, self.color.blue)
+        self.assertIsInstance(rule.evaluate(self.solver, Relation(self.color.green, self.nation.english)), Different)
+        self.assertIsNone(rule.evaluate(self.solver, Relation(self.color.red, self.nation.english)))
+        self.assertIsNone(rule.evaluate(self.solver, Relation(self.color.green, self.nation.spanish)))
+
+    # - если англичанин живёт не в синем доме, то он живёт в красном
+    def test_other_different_returns_same(self):
+        solver = self.solver.add(Different.of(self.color.blue, self.nation.english))
+        rule = Either.of(self.nation.english, self.color.red, self.color.blue)
+        self.assertIsInstance(rule.evaluate(solver, Relation(self.color.red, self.nation.english)), Same)
+
+    # Англичанин живёт в красном доме, или держит собаку.
+    # - если у англичанина не собака, то он живёт в красном доме
+    def test_relations_of_other_attributes(self):
+        solver = self.solver.add(Different.of(self.nation.english, self.animal.dog))
+        rule = Either.of(self.nation.english, self.color.red, self.animal.dog)
+        self.assertIsInstance(rule.evaluate(solver, Relation(self.color.red, self.nation.english)), Same)
+        self.assertIsNone(rule.evaluate(solver, Relation(self.color.green, self.nation.english)))
+
+    # - если исключающее, и англичанин живёт в красном доме, то у него не собака
+    def test_exclusive_same_returns_different(self):
+        solver = self.solver.add(Same.of(self.color.red, self.nation.english))
+        rule = Either.of(self.nation.english, self.color.red, self.animal.dog, exclusive=True)
+        self.assertIsInstance(rule.evaluate(solver, Relation(self.nation.english, self.animal.dog)), Different)
+
+    def test_solver_raises_contradiction_when_none_holds(self):
+        solver = self.solver.add(Exclusive()).add(Either.of(self.nation.english, self.color.red, self.animal.dog))
+        solver.add(Different.of(self.color.red, self.nation.english))
+        solver.add(Different.of(self.nation.english, self.animal.dog))
+        self.assertRaises(Contradiction, solver.solve)
+
+
 class SameTests(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -335,17 +722,17 @@ class SameTests(unittest.TestCase):
 
     def test_returns_different_when_same_row(self):
         rule_under_test = Same.of(self.A[2], self.B[2])
-        result = rule_under_test.evaluate(Relation(self.A[2], self.B[1]))
+        result = rule_under_test.evaluate(None, Relation(self.A[2], self.B[1]))
         self.assertIsInstance(result, Different)
    
     def test_returns_different_when_same_column(self):
         rule_under_test = Same.of(self.A[2], self.B[2])
-        result = rule_under_test.evaluate(Relation(self.A[3], self.B[2]))
+        result = rule_under_test.evaluate(None, Relation(self.A[3], self.B[2]))
         self.assertIsInstance(result, Different)
    
     def test_returns_none_when_not_same_row_or_column(self):
         rule_under_test = Same.of(self.A[2], self.B[2])
-        result = rule_under_test.evaluate(Relation(self.A[1], self.B[3]))
+        result = rule_under_test.evaluate(None, Relation(self.A[1], self.B[3]))
         self.assertIsNone(result)
 
     def test_different_for_one_attr_transitioned_to_the_other(self):
@@ -357,7 +744,7 @@ class SameTests(unittest.TestCase):
         rule = Same(Relation(nation.spanish, animal.dog))
         solver.add(rule)
 
-        result = rule.evaluate(Relation(animal.dog, color.red))
+        result = rule.evaluate(solver, Relation(animal.dog, color.red))
         self.assertIsInstance(result, Different)
 
     def test_same_for_one_attr_transitioned_to_the_other(self):
@@ -369,10 +756,54 @@ class SameTests(unittest.TestCase):
         rule = Same(Relation(nation.spanish, animal.dog))
         solver.add(rule)
 
-        result = rule.evaluate(Relation(animal.dog, color.red))
+        result = rule.evaluate(solver, Relation(animal.dog, color.red))
         self.assertIsInstance(result, Same)
 
 
+class EntitiesTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.A = Attr('A', 0, ['A1', 'A2'])
+        cls.B = Attr('B', 1, ['B1', 'B2'])
+        cls.C = Attr('C', 2, ['C1', 'C2'])
+
+    def setUp(self):
+        self.entities = Entities()
+
+    def test_merge_returns_same_for_members_of_both_classes(self):
+        self.entities.merge(self.A.A1, self.B.B1)
+        facts = self.entities.merge(self.B.B1, self.C.C2)
+
+        self.assertIn((self.A.A1, self.C.C2, True), [(a1, a2, same) for (a1, a2, same) in facts]
+                      + [(a2, a1, same) for (a1, a2, same) in facts])
+        self.assertIs(self.entities.find(self.C.C2), self.entities.find(self.A.A1))
+
+    def test_merge_returns_different_for_excluded_classes(self):
+        self.entities.separate(self.A.A1, self.C.C1)
+        facts = self.entities.merge(self.A.A1, self.B.B2)
+
+        self.assertIn((self.B.B2, self.C.C1, False), facts)
+
+    def test_separate_returns_different_for_members(self):
+        self.entities.merge(self.A.A1, self.B.B1)
+        facts = self.entities.separate(self.C.C1, self.B.B1)
+
+        self.assertEqual(sorted(str(a1) + str(a2) for (a1, a2, same) in facts), ['C:C1A:A1', 'C:C1B:B1'])
+        self.assertEqual(self.entities.separate(self.C.C1, self.A.A1), [])
+
+    def test_rollback_restores_classes(self):
+        self.entities.separate(self.A.A1, self.C.C1)
+        length = len(self.entities.log)
+        self.entities.merge(self.C.C1, self.B.B1)
+        self.entities.merge(self.A.A2, self.B.B1)
+
+        self.entities.rollback(length)
+
+        self.assertIs(self.entities.find(self.B.B1), self.B.B1)
+        self.assertEqual(self.entities.class_of(self.C.C1), [self.C.C1])
+        self.assertEqual(self.entities.excluded[self.A.A1], {self.C.C1})
+        self.assertEqual(self.entities.excluded[self.C.C1], {self.A.A1})
+
 class SolverTests(unittest.TestCase):
     def test_iter_same_causes_different_with_exclusive(self):
         house = Attr('house', 0, [1, 2, 3])
@@ -423,6 +854,115 @@ class SolverTests(unittest.TestCase):
 
         self.assertTrue(solver.is_different(Relation(color.green, house[2])))
 
+    def test_iter_returns_false_when_nothing_pending(self):
+        house = Attr('house', 0, [1, 2, 3])
+        color = Attr('color', 1, ['red', 'green', 'blue'])
+        solver = Solver([house, color])
+        solver.add(Exclusive())
+        solver.add(Same(Relation(house[2], color.green)))
+
+        solver.solve()
+
+        self.assertFalse(solver.pending)
+        self.assertFalse(solver.iter())
+
+    def test_add_after_solve_enqueues_only_affected_relations(self):
+        house = Attr('house', 0, [1, 2, 3])
+        color = Attr('color', 1, ['red', 'green', 'blue'])
+        solver = Solver([house, color])
+        solver.add(Offset(color.green, color.red, house, 1))
+        solver.solve()
+
+        solver.add(Different(Relation(color.red, house[2])))
+
+        self.assertEqual(list(solver.pending), [Relation(house[2], color.red), Relation(house[3], color.green)])
+        solver.iter()
+        self.assertTrue(solver.is_different(Relation(color.green, house[3])))
+
+    def test_rules_for_returns_global_and_watching_rules(self):
+        house = Attr('house', 0, [1, 2, 3])
+        color = Attr('color', 1, ['red', 'green', 'blue'])
+        nation = Attr('nation', 2, ['english', 'spanish', 'german'])
+        solver = Solver([house, color, nation])
+        exclusive = Exclusive()
+        offset = Offset(color.green, color.red, house, 1)
+        same = Same.of(color.blue, nation.german)
+        solver.add(exclusive).add(offset).add(same)
+        solver.add(Different.of(color.red, nation.english))
+
+        self.assertEqual(solver.rules_for(Relation(house[1], color.green)), [exclusive, offset])
+        self.assertEqual(solver.rules_for(Relation(house[1], nation.german)), [exclusive])
+        self.assertEqual(solver.rules_for(Relation(house[1], nation.spanish)), [exclusive])
+
+    def test_add_different_to_same_raises_contradiction(self):
+        house = Attr('house', 0, [1, 2, 3])
+        color = Attr('color', 1, ['red', 'green', 'blue'])
+        solver = Solver([house, color])
+        fact = Different.of(house[1], color.red)
+        solver.add(Same.of(house[1], color.red))
+
+        with self.assertRaises(Contradiction) as context:
+            solver.add(fact)
+
+        self.assertEqual(context.exception.relation, Relation(house[1], color.red))
+        self.assertIs(context.exception.rule, fact)
+
+    def test_add_second_same_in_row_raises_contradiction(self):
+        house = Attr('house', 0, [1, 2, 3])
+        color = Attr('color', 1, ['red', 'green', 'blue'])
+        solver = Solver([house, color])
+        solver.add(Same.of(house[1], color.red))
+
+        self.assertRaises(Contradiction, solver.add, Same.of(house[1], color.green))
+        self.assertRaises(Contradiction, solver.add, Same.of(house[2], color.red))
+
+    def test_add_all_different_in_row_raises_contradiction(self):
+        house = Attr('house', 0, [1, 2, 3])
+        color = Attr('color', 1, ['red', 'green', 'blue'])
+        solver = Solver([house, color])
+        solver.add(Different.of(house[1], color.red))
+        solver.add(Different.of(house[1], color.green))
+
+        self.assertRaises(Contradiction, solver.add, Different.of(house[1], color.blue))
+
+    def test_solve_raises_contradiction_with_rule(self):
+        house = Attr('house', 0, [1, 2, 3])
+        color = Attr('color', 1, ['red', 'green', 'blue'])
+        solver = Solver([house, color])
+        solver.add(Exclusive())
+        offset = Offset(color.green, color.red, house, 1)
+        solver.add(offset)
+        solver.add(Same.of(house[3], color.red))
+
+        with self.assertRaises(Contradiction) as context:
+            solver.solve()
+
+        self.assertIn(context.exception.rule, solver.list)
+
+    def test_solve_raises_contradiction_when_decided_relation_is_checked(self):
+        house = Attr('house', 0, [1, 2, 3])
+        color = Attr('color', 1, ['red', 'green', 'blue'])
+        solver = Solver([house, color])
+        solver.add(Exclusive())
+        solver.add(Offset(color.green, color.red, house, 2))
+        solver.add(Offset(color.blue, color.red, house, 2))
+
+        self.assertRaises(Contradiction, solver.solve)
+
+    def test_add_same_propagates_through_entities(self):
+        color = Attr('color', 0, ['red', 'green', 'blue'])
+        nation = Attr('nation', 1, ['spanish', 'english', 'german'])
+        animal = Attr('animal', 2, ['dog', 'cat', 'snake'])
+        solver = Solver([color, nation, animal])
+        solver.add(Different.of(color.red, animal.cat))
+        solver.add(Same.of(color.red, nation.spanish))
+        solver.add(Same.of(nation.spanish, animal.dog))
+
+        self.assertTrue(solver.is_same(Relation(color.red, animal.dog)))
+        self.assertTrue(solver.is_different(Relation(nation.spanish, animal.cat)))
+        self.assertTrue(solver.is_different(Relation(nation.english, animal.dog)))
+        self.assertEqual(len(solver.list), 3)
+
 class SolverAcceptanceTests(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -482,6 +1022,1264 @@ class SolverAcceptanceTests(unittest.TestCase):
         #
         self.assertTrue(self.solver.is_same(Relation(self.house[3], self.drink.milk)))
 
+class SolverIncrementalTests(unittest.TestCase):
+    def clues(self, solver):
+        (house, color, nation, animal, drink, smoke) = solver.attrs
+        return [Same.of(color.green, house[5]), Same.of(animal.fox, house[1])]
+
+    def test_add_after_solve_reaches_the_same_state_as_solving_from_scratch(self):
+        incremental = einstein_solver()
+        incremental.solve()
+        for clue in self.clues(incremental):
+            incremental.add(clue)
+            incremental.solve()
+
+        scratch = einstein_solver()
+        for clue in self.clues(scratch):
+            scratch.add(clue)
+        scratch.solve()
+
+        self.assertEqual([(matrix.same, matrix.different) for matrix in incremental.matrices.values()],
+                         [(matrix.same, matrix.different) for matrix in scratch.matrices.values()])
+
+    def test_add_after_solve_evaluates_only_new_candidates(self):
+        solver = einstein_solver()
+        solver.solve()
+        (house, color, nation, animal, drink, smoke) = solver.attrs
+
+        solver.add(Offset(animal.zebra, animal.dog, house, 1))
+
+        self.assertEqual(set(solver.pending), set(solver.list[-1].candidates(solver)))
+
+    def test_pop_retracts_clue_and_its_consequences(self):
+        solver = einstein_solver()
+        solver.solve()
+        (house, color, nation, animal, drink, smoke) = solver.attrs
+        before = [(matrix.same, matrix.different) for matrix in solver.matrices.values()]
+        rules = list(solver.list)
+
+        solver.push()
+        solver.add(Same.of(color.green, house[5]))
+        solver.solve()
+        self.assertTrue(solver.is_same(Relation(drink.coffee, house[5])))
+        solver.pop()
+
+        self.assertEqual([(matrix.same, matrix.different) for matrix in solver.matrices.values()], before)
+        self.assertEqual(solver.list, rules)
+        self.assertFalse(solver.pending)
+
+    def test_nested_push_pop(self):
+        solver = einstein_solver()
+        solver.solve()
+        (house, color, nation, animal, drink, smoke) = solver.attrs
+
+        solver.push().add(Same.of(color.green, house[5]))
+        solver.solve()
+        decided = solver.decided_count()
+        solver.push().add(Same.of(animal.zebra, house[5]))
+        solver.solve()
+        self.assertEqual(solver.decided_count(), solver.relation_count())
+        solver.pop()
+
+        self.assertEqual(solver.decided_count(), decided)
+        self.assertTrue(solver.is_same(Relation(drink.coffee, house[5])))
+        solver.pop()
+        self.assertFalse(solver.is_same(Relation(drink.coffee, house[5])))
+
+    def test_pop_after_contradiction_restores_state(self):
+        solver = einstein_solver()
+        solver.solve()
+        (house, color, nation, animal, drink, smoke) = solver.attrs
+        decided = solver.decided_count()
+
+        solver.push()
+        with self.assertRaises(Contradiction):
+            solver.add(Same.of(nation.norwegian, house[2]))
+            solver.solve()
+        solver.pop()
+
+        self.assertEqual(solver.decided_count(), decided)
+        self.assertTrue(solver.search())
+
+class SolverSearchTests(unittest.TestCase):
+    def test_search_decides_all_relations(self):
+        solver = einstein_solver()
+
+        self.assertTrue(solver.search())
+
+        self.assertTrue(all(relation in solver for relation in solver.relations()))
+        self.assertTrue(solver.consistent())
+
+    def test_search_finds_answers(self):
+        solver = einstein_solver()
+        (house, color, nation, animal, drink, smoke) = solver.attrs
+
+        solver.search()
+
+        self.assertTrue(solver.is_same(Relation(drink.water, nation.norwegian)))
+        self.assertTrue(solver.is_same(Relation(animal.zebra, nation.japanese)))
+        self.assertTrue(solver.is_same(Relation(house[2], animal.horse)))
+
+    def test_search_returns_false_and_restores_state_without_solution(self):
+        house = Attr('house', 0, [1, 2, 3])
+        color = Attr('color', 1, ['red', 'green', 'blue'])
+        solver = Solver([house, color])
+        solver.add(Exclusive())
+        solver.add(Offset(color.green, color.red, house, 2))
+        solver.add(Offset(color.blue, color.red, house, 2))
+
+        self.assertFalse(solver.search())
+
+        self.assertFalse(any(relation in solver for relation in solver.relations()))
+
+    def test_rollback_restores_relations_and_rules(self):
+        house = Attr('house', 0, [1, 2, 3])
+        color = Attr('color', 1, ['red', 'green', 'blue'])
+        solver = Solver([house, color])
+        solver.add(Exclusive())
+        checkpoint = solver.checkpoint()
+
+        solver.add(Same.of(house[1], color.red))
+        solver.solve()
+        solver.rollback(checkpoint)
+
+        self.assertNotIn(Relation(house[1], color.red), solver)
+        self.assertNotIn(Relation(house[2], color.red), solver)
+        self.assertEqual(len(solver.list), 1)
+        self.assertEqual(solver.rules_for(Relation(house[1], color.red)), solver.list)
+
+class SolverCountSolutionsTests(unittest.TestCase):
+    def test_unique_puzzle(self):
+        solver = einstein_solver()
+        solver.solve()
+        decided = solver.decided_count()
+        (house, color, nation, animal, drink, smoke) = solver.attrs
+
+        solutions = solver.count_solutions()
+
+        self.assertEqual(len(solutions), 1)
+        self.assertEqual(solutions[0][0], (house[1], color.yellow, nation.norwegian, animal.fox, drink.water, smoke.kool))
+        self.assertEqual(solutions[0][4][3], animal.zebra)
+        self.assertEqual(solver.decided_count(), decided)
+
+    def test_stops_at_limit(self):
+        solver = Solver([Attr('a', 0, [1, 2, 3]), Attr('b', 1, ['x', 'y', 'z'])])
+        solver.add(Exclusive())
+
+        self.assertEqual(len(solver.count_solutions()), 2)
+        self.assertEqual(len(solver.count_solutions(limit=10)), 6)
+        self.assertEqual(solver.decided_count(), 0)
+
+    def test_solutions_are_distinct(self):
+        solver = Solver([Attr('a', 0, [1, 2, 3]), Attr('b', 1, ['x', 'y', 'z']), Attr('c', 2, ['p', 'q', 'r'])])
+        solver.add(Exclusive())
+        solver.add(Same.of(solver.attrs[1].x, solver.attrs[2].p))
+
+        solutions = solver.count_solutions(limit=100)
+
+        self.assertEqual(len(solutions), 12)
+        self.assertEqual(len(set(tuple(solution) for solution in solutions)), 12)
+
+    def test_no_solution(self):
+        solver = einstein_solver()
+        (house, color, nation, animal, drink, smoke) = solver.attrs
+        solver.add(Offset(color.green, color.red, house, 2))
+        solver.add(Offset(color.blue, color.red, house, 2))
+
+        self.assertEqual(solver.count_solutions(), [])
+
+    def test_search_still_leaves_the_solution(self):
+        solver = einstein_solver()
+
+        self.assertTrue(solver.search())
+        self.assertEqual(solver.decided_count(), solver.relation_count())
+
+
+class SolverProvenanceTests(unittest.TestCase):
+    def test_clue_has_no_premises(self):
+        solver = einstein_solver()
+        (house, color, nation, animal, drink, smoke) = solver.attrs
+        relation = solver.relation(color.red, nation.english)
+
+        (decided, same, source, premises) = solver.justification(relation)
+
+        self.assertIs(decided, relation)
+        self.assertTrue(same)
+        self.assertIsInstance(source, Same)
+        self.assertIn(source, solver.list)
+        self.assertEqual(premises, [])
+
+    def test_undecided_relation_has_no_justification(self):
+        solver = einstein_solver()
+        (house, color, nation, animal, drink, smoke) = solver.attrs
+
+        self.assertIsNone(solver.justification(Relation(nation.japanese, animal.zebra)))
+        self.assertEqual(solver.explain(Relation(nation.japanese, animal.zebra)), [])
+
+    def test_explain_orders_premises_before_facts(self):
+        solver = einstein_solver()
+        solver.search()
+        (house, color, nation, animal, drink, smoke) = solver.attrs
+
+        chain = solver.explain(Relation(nation.japanese, animal.zebra))
+
+        self.assertIs(chain[-1][0], solver.relation(nation.japanese, animal.zebra))
+        explained = set()
+        for (relation, same, source, premises) in chain:
+            self.assertEqual(solver.is_same(relation), same)
+            self.assertTrue(all(premise in explained for premise in premises))
+            explained.add(relation)
+        self.assertTrue(any(source in solver.list for (_, _, source, _) in chain))
+
+    def test_every_derived_fact_is_justified(self):
+        (attrs, rules) = einstein_generator.generate(5, 5, seed=4)
+        solver = einstein_generator.build(attrs, rules)
+        solver.solve()
+
+        for relation in solver.relations():
+            (_, same, source, premises) = solver.justification(relation)
+            for premise in premises:
+                self.assertTrue(solver.decided_before(premise, solver.is_same(premise), solver.positions[relation.id]))
+            if source is solver.entities or isinstance(source, Exclusive):
+                self.assertNotEqual(premises, [])
+
+    def test_rollback_forgets_provenance(self):
+        solver = einstein_solver()
+        solver.solve()
+        (house, color, nation, animal, drink, smoke) = solver.attrs
+
+        solver.push()
+        solver.add(Same.of(color.green, house[5]))
+        solver.solve()
+        self.assertIsNotNone(solver.justification(Relation(drink.coffee, house[5])))
+        solver.pop()
+
+        self.assertIsNone(solver.justification(Relation(drink.coffee, house[5])))
+
+
+class SolverStatsTests(unittest.TestCase):
+    def test_stats_are_off_by_default(self):
+        self.assertIsNone(einstein_solver().stats)
+
+    def test_stats_count_evaluations_and_hits_per_class(self):
+        solver = einstein_solver()
+        solver.stats = SolverStats()
+        solver.solve()
+
+        stats = solver.stats.as_dict()
+
+        self.assertEqual(stats['passes'], solver.passes)
+        self.assertEqual(set(stats['classes']), {'Exclusive', 'Offset', 'Distance'})
+        self.assertEqual(stats['evaluations'], sum(rule['evaluations'] for rule in stats['rules']))
+        self.assertLessEqual(stats['hits'], stats['evaluations'])
+        self.assertGreater(stats['classes']['Distance']['hits'], 0)
+
+    def test_facts_per_pass_add_up_to_derived_facts(self):
+        solver = einstein_solver()
+        given = solver.decided_count()
+        solver.stats = SolverStats()
+        solver.solve()
+
+        self.assertEqual(sum(solver.stats.facts_per_pass), solver.decided_count() - given)
+        self.assertEqual(solver.stats.facts_per_pass[-1], 0)
+
+    def test_as_dict_is_json_serializable(self):
+        solver = einstein_solver()
+        solver.stats = SolverStats()
+        solver.solve()
+        self.assertEqual(json.loads(json.dumps(solver.stats.as_dict())), solver.stats.as_dict())
+
+@unittest.skipIf(einstein_numpy.numpy is None, "numpy is not installed")
+class NumpyBackendTests(unittest.TestCase):
+    def numpy_solver(self, attrs, rules):
+        numpy_solver = Solver(attrs, backend=einstein_numpy.NumpyBackend)
+        for rule in rules:
+            numpy_solver.add(rule)
+        return numpy_solver
+
+    def assertSameState(self, solver1, solver2):
+        self.assertEqual([(matrix.same, matrix.different) for matrix in solver1.matrices.values()],
+                         [(matrix.same, matrix.different) for matrix in solver2.matrices.values()])
+
+    def test_solve_derives_the_same_facts_as_rules(self):
+        solver = einstein_solver()
+        solver.solve()
+        source = einstein_solver()
+        numpy_solver = self.numpy_solver(source.attrs, source.list)
+
+        numpy_solver.solve()
+
+        self.assertSameState(solver, numpy_solver)
+        self.assertFalse(numpy_solver.pending)
+
+    def test_solve_generated_puzzle_with_partial_clues(self):
+        (attrs, rules) = einstein_generator.generate(5, 6, seed=2)
+        solver = einstein_generator.build(attrs, rules[::2])
+        solver.solve()
+        numpy_solver = self.numpy_solver(attrs, [Exclusive()] + rules[::2])
+
+        numpy_solver.solve()
+
+        self.assertSameState(solver, numpy_solver)
+
+    def test_search_with_numpy_backend(self):
+        source = einstein_solver()
+        numpy_solver = self.numpy_solver(source.attrs, source.list)
+        (house, color, nation, animal, drink, smoke) = numpy_solver.attrs
+
+        self.assertTrue(numpy_solver.search())
+
+        self.assertTrue(numpy_solver.is_same(Relation(animal.zebra, nation.japanese)))
+
+    def test_solve_raises_contradiction(self):
+        house = Attr('house', 0, [1, 2, 3])
+        color = Attr('color', 1, ['red', 'green', 'blue'])
+        solver = Solver([house, color], backend=einstein_numpy.NumpyBackend)
+        solver.add(Exclusive())
+        solver.add(Offset(color.green, color.red, house, 2))
+        solver.add(Offset(color.blue, color.red, house, 2))
+
+        self.assertRaises(Contradiction, solver.solve)
+
+    def test_solve_stops_after_max_passes(self):
+        source = einstein_solver()
+        numpy_solver = self.numpy_solver(source.attrs, source.list)
+
+        result = numpy_solver.solve(max_passes=1)
+
+        self.assertEqual(result.reason, 'passes')
+        self.assertEqual(numpy_solver.passes, 1)
+        self.assertTrue(numpy_solver.pending)
+        self.assertEqual(numpy_solver.solve().reason, 'fixpoint')
+
+    def test_solve_stops_at_deadline(self):
+        source = einstein_solver()
+        numpy_solver = self.numpy_solver(source.attrs, source.list)
+        numpy_solver.deadline = time.time()
+
+        result = numpy_solver.solve()
+
+        self.assertEqual(result.reason, 'deadline')
+        self.assertEqual(result.decisions, [])
+
+    def test_max_evaluations_are_not_supported(self):
+        source = einstein_solver()
+        numpy_solver = self.numpy_solver(source.attrs, source.list)
+        self.assertRaises(ValueError, numpy_solver.solve, max_evaluations=10)
+
+    def test_shift_fills_out_of_range(self):
+        vector = einstein_numpy.numpy.array([True, False, True])
+        self.assertEqual(list(einstein_numpy.shift(vector, 1, False)), [False, True, False])
+        self.assertEqual(list(einstein_numpy.shift(vector, -2, False)), [True, False, False])
+        self.assertEqual(list(einstein_numpy.shift(vector, 3, True)), [True, True, True])
+
+class ParserTests(unittest.TestCase):
+    TEXT = [
+        "description is skipped",
+        "attributes",
+        "house:ordinal:1 3",
+        "color:attr:red green blue",
+        "pet:dog cat fish",
+        "",
+        "knowledge",
+        "same color:red pet:dog",
+        "different color:red house:3",
+        "offset:house:1 color:blue color:green",
+        "dist:house:2 pet:dog pet:fish",
+        "",
+        "queries:",
+        "pet:fish house",
+    ]
+
+    def test_parse_attributes(self):
+        (solver, queries) = einstein_parser.parse(self.TEXT)
+        (house, color, pet) = solver.attrs
+
+        self.assertEqual([v.value for v in house.ordered_values], [1, 2, 3])
+        self.assertEqual([v.value for v in color.ordered_values], ['red', 'green', 'blue'])
+        self.assertEqual([v.value for v in pet.ordered_values], ['dog', 'cat', 'fish'])
+        self.assertEqual([attr.order for attr in solver.attrs], [0, 1, 2])
+
+    def test_parse_knowledge(self):
+        (solver, queries) = einstein_parser.parse(self.TEXT)
+        (house, color, pet) = solver.attrs
+        (exclusive, same, different, offset, distance) = solver.list
+
+        self.assertIsInstance(exclusive, Exclusive)
+        self.assertEqual(same.relation, Relation(color.red, pet.dog))
+        self.assertIsInstance(different, Different)
+        self.assertEqual((offset.atval1, offset.atval2, offset.offset_attr, offset.offset), (color.green, color.blue, house, 1))
+        self.assertEqual((distance.atval1, distance.atval2, distance.distance), (pet.dog, pet.fish, 2))
+
+    def test_parse_with_subsets(self):
+        (solver, queries) = einstein_parser.parse(self.TEXT, subsets=2)
+        (exclusive, subsets) = solver.list[:2]
+        self.assertIsInstance(subsets, Subsets)
+        self.assertEqual(subsets.size, 2)
+        self.assertFalse(any(isinstance(rule, Subsets) for rule in einstein_parser.parse(self.TEXT)[0].list))
+        self.assertEqual(einstein_parser.format_puzzle(solver.attrs, solver.list),
+                         einstein_parser.format_puzzle(solver.attrs, solver.list[2:]))
+
+    def test_queries_answered_after_search(self):
+        (solver, queries) = einstein_parser.parse(self.TEXT)
+        (house, color, pet) = solver.attrs
+
+        self.assertIsNone(queries[0].answer(solver))
+        solver.search()
+
+        self.assertEqual(einstein_parser.answer(solver, queries), [(queries[0], house[3])])
+
+    def test_unknown_attribute_value_raises_parse_error_with_line(self):
+        text = ["attributes", "color:red green", "knowledge", "same color:red color:black"]
+        with self.assertRaises(einstein_parser.ParseError) as context:
+            einstein_parser.parse(text)
+        self.assertEqual(context.exception.line_number, 4)
+
+    def test_unknown_clue_raises_parse_error(self):
+        text = ["attributes", "color:red green", "pet:dog cat", "knowledge", "near color:red pet:dog"]
+        self.assertRaises(einstein_parser.ParseError, einstein_parser.parse, text)
+
+    def assertParseError(self, text, line_number):
+        with self.assertRaises(einstein_parser.ParseError) as context:
+            einstein_parser.parse(text)
+        self.assertEqual(context.exception.line_number, line_number)
+
+    def test_values_of_one_attribute_raise_parse_error(self):
+        for clue in ("same", "different", "not"):
+            self.assertParseError(["attributes", "color:red green", "pet:dog cat", "knowledge",
+                                   clue + " color:red color:green"], 5)
+
+    def test_ordinal_bounds_must_be_numbers(self):
+        self.assertParseError(["attributes", "color:red green", "house:ordinal:a b"], 3)
+
+    def test_offset_values_of_offset_attribute_raise_parse_error(self):
+        self.assertParseError(["attributes", "house:ordinal:1 2", "color:red green", "knowledge",
+                               "offset:house:1 house:1 house:2"], 5)
+        self.assertParseError(["attributes", "house:ordinal:1 2", "color:red green", "knowledge",
+                               "dist:house:1 color:red house:2"], 5)
+
+    # все атрибуты должны иметь одинаковое число значений
+    def test_duplicate_value_raises_parse_error(self):
+        self.assertParseError(["attributes", "color:red green", "pet:attr:dog dog"], 3)
+
+    def test_text_without_attributes_raises_parse_error(self):
+        self.assertParseError(["garbage"], 1)
+        self.assertParseError(["attributes", "knowledge"], 2)
+        self.assertRaises(einstein_parser.ParseError, einstein_parser.PuzzleParser().puzzle)
+
+    def test_attributes_with_different_value_counts_raise_parse_error(self):
+        self.assertParseError(["attributes", "color:red green blue", "pet:dog cat"], 3)
+
+    def test_load_einstein_txt(self):
+        (solver, queries) = einstein_parser.load(os.path.join(HERE, 'einstein.txt'))
+        self.assertTrue(solver.search())
+        answers = [str(atval) for (query, atval) in einstein_parser.answer(solver, queries)]
+        self.assertEqual(answers, ['nation:norwegian', 'nation:japanese'])
+
+    def test_format_puzzle_parses_back(self):
+        (solver, queries) = einstein_parser.parse(self.TEXT)
+        lines = einstein_parser.format_puzzle(solver.attrs, solver.list, queries)
+
+        (parsed, parsed_queries) = einstein_parser.parse(lines)
+
+        self.assertEqual(lines[:4], ["attributes", "house:ordinal:1 3", "color:attr:red green blue", "pet:attr:dog cat fish"])
+        self.assertEqual([str(rule) for rule in parsed.list], [str(rule) for rule in solver.list])
+        self.assertEqual([str(query) for query in parsed_queries], [str(query) for query in queries])
+
+    def test_parse_ordinal_comparisons(self):
+        text = ["attributes", "house:ordinal:1 4", "color:red green blue yellow", "knowledge",
+                "before:house:1 color:red color:blue", "apart:house:2 color:green color:yellow", "same house:1 color:green"]
+        (solver, queries) = einstein_parser.parse(text)
+        (house, color) = solver.attrs
+
+        self.assertIsInstance(house, Ordinal)
+        self.assertIsInstance(solver.list[1], Before)
+        self.assertIsInstance(solver.list[2], Apart)
+        self.assertEqual([einstein_parser.format_rule(rule) for rule in solver.list[1:3]], text[4:6])
+        self.assertEqual(len(solver.count_solutions(limit=10)), 2)
+
+    def test_parse_left_not_either(self):
+        text = ["attributes", "house:ordinal:1 3", "color:red green blue", "nation:english spanish norwegian", "knowledge",
+                "left:house color:red color:blue", "right:house color:green color:blue", "not color:red nation:english",
+                "either nation:english color:green color:blue", "same house:2 nation:norwegian"]
+        (solver, queries) = einstein_parser.parse(text)
+
+        self.assertEqual([type(rule) for rule in solver.list[1:5]], [LeftOf, RightOf, NotSame, Either])
+        self.assertEqual([einstein_parser.format_rule(rule) for rule in solver.list[1:5]], text[5:9])
+        solutions = solver.count_solutions()
+        self.assertEqual(len(solutions), 1)
+        self.assertEqual([str(atval) for atval in solutions[0][2]], ['house:3', 'color:green', 'nation:english'])
+
+    def test_comparison_values_of_ordinal_attribute_raise_parse_error(self):
+        for clue in ("before:house:1 house:1 color:red", "apart:house:1 color:red house:2",
+                     "left:house house:1 color:red", "right:house color:red house:2"):
+            self.assertParseError(["attributes", "house:ordinal:1 2", "color:red blue", "knowledge", clue], 5)
+
+    def test_format_rule(self):
+        (solver, queries) = einstein_parser.parse(self.TEXT)
+        self.assertEqual([einstein_parser.format_rule(rule) for rule in solver.list], [
+            None,
+            "same color:red pet:dog",
+            "different house:3 color:red",
+            "offset:house:1 color:blue color:green",
+            "dist:house:2 pet:dog pet:fish",
+        ])
+
+class BatchTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(os.path.join(HERE, 'einstein.txt'), encoding='utf-8') as f:
+            cls.text = f.read()
+
+    def test_solve_puzzle_returns_answers(self):
+        result = einstein_batch.solve_puzzle(('einstein', self.text))
+        self.assertEqual(result, {
+            'id': 'einstein',
+            'solved': True,
+            'answers': {'drink:water nation': 'nation:norwegian', 'animal:zebra nation': 'nation:japanese'}})
+
+    def test_solve_puzzle_returns_error_for_invalid_puzzle(self):
+        result = einstein_batch.solve_puzzle((1, "attributes\ncolor:red\nknowledge\nsame color:red"))
+        self.assertFalse(result['solved'])
+        self.assertIn('error', result)
+
+    def test_solve_puzzle_returns_error_for_text_without_attributes(self):
+        result = einstein_batch.solve_puzzle((1, "garbage"))
+        self.assertFalse(result['solved'])
+        self.assertEqual(result['error'], "line 1: no attributes")
+
+    def test_read_jsonl_uses_line_number_without_id(self):
+        lines = ['{"id": "a", "puzzle": "x"}', '', '{"puzzle": "y"}']
+        self.assertEqual(list(einstein_batch.read_jsonl(lines)), [('a', 'x'), (2, 'y')])
+
+    def test_read_jsonl_without_puzzle(self):
+        lines = ['{"id": "a"}', 'not json', '[1]']
+        self.assertEqual(list(einstein_batch.read_jsonl(lines)), [('a', None), (1, None), (2, None)])
+
+    # ошибка в одной задаче не должна ломать остальные
+    def test_solve_all_reports_malformed_puzzles_with_pool(self):
+        lines = [json.dumps({'id': 0, 'puzzle': self.text}),
+                 json.dumps({'id': 1, 'puzzle': "attributes\nc:a b\nn:x y\nknowledge\nsame c:a c:b"}),
+                 json.dumps({'id': 2}),
+                 json.dumps({'id': 3, 'puzzle': self.text})]
+        results = list(einstein_batch.solve_all(einstein_batch.read_jsonl(lines), workers=2, chunksize=1))
+
+        self.assertEqual([result['id'] for result in results], [0, 1, 2, 3])
+        self.assertEqual([result['solved'] for result in results], [True, False, False, True])
+        self.assertIn('error', results[1])
+        self.assertIn('error', results[2])
+
+    def test_solve_all_with_subsets(self):
+        results = list(einstein_batch.solve_all([('einstein', self.text)], workers=1, subsets=3))
+        self.assertEqual(results, [einstein_batch.solve_puzzle(('einstein', self.text))])
+        self.assertEqual(einstein_batch.worker_subsets, None)
+
+    def test_solve_all_keeps_order_with_pool(self):
+        puzzles = [(i, self.text) for i in range(6)]
+        results = list(einstein_batch.solve_all(puzzles, workers=2, chunksize=2))
+        self.assertEqual([result['id'] for result in results], list(range(6)))
+        self.assertTrue(all(result['solved'] for result in results))
+
+class CacheTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(os.path.join(HERE, 'einstein.txt'), encoding='utf-8') as f:
+            cls.lines = f.read().splitlines()
+
+    # the same puzzle with the clues in another order and renamed values and attributes
+    def renamed(self):
+        start = self.lines.index('knowledge') + 1
+        end = self.lines.index('queries:')
+        knowledge = [line for line in self.lines[start:end] if line.strip()]
+        knowledge.reverse()
+        text = "\n".join(self.lines[:start] + knowledge + self.lines[end:])
+        for (old, new) in (('red', 'crimson'), ('english', 'british'), ('zebra', 'okapi'), ('drink', 'beverage')):
+            text = text.replace(old, new)
+        return text.splitlines()
+
+    def key(self, lines):
+        (solver, queries) = einstein_parser.parse(lines)
+        return einstein_cache.Canonical(solver.attrs, solver.list).hash
+
+    def test_hash_ignores_clue_order_and_names(self):
+        self.assertEqual(self.key(self.lines), self.key(self.renamed()))
+
+    def test_hash_ignores_attribute_order(self):
+        start = self.lines.index('attributes') + 1
+        end = self.lines.index('knowledge')
+        attributes = [line for line in self.lines[start:end] if line.strip()]
+        attributes.reverse()
+        lines = self.lines[:start] + attributes + self.lines[end:]
+        self.assertEqual(self.key(self.lines), self.key(lines))
+
+    def test_hash_ignores_value_order(self):
+        lines = []
+        for line in self.lines:
+            (name, _, values) = line.partition(':attr:')
+            if name in ('color', 'animal', 'drink'):
+                line = name + ':attr:' + " ".join(reversed(values.split()))
+            lines.append(line)
+        self.assertNotEqual(lines, self.lines)
+        self.assertEqual(self.key(self.lines), self.key(lines))
+
+    # симметричные задачи: ничья в раскраске разбивается перебором
+    def test_hash_of_symmetric_clues_ignores_value_order(self):
+        def puzzle(values):
+            return (["attributes"] + ["a" + str(i) + ":" + " ".join(values) for i in range(3)] + ["knowledge"] +
+                    ["different a0:" + value + " a1:" + value for value in "abcdef"])
+
+        self.assertEqual(self.key(puzzle("abcdef")), self.key(puzzle("fdbeca")))
+
+    def test_sparse_puzzle_is_labelled_fast(self):
+        (attrs, rules) = einstein_generator.generate(8, 8, seed=3)
+        solver = einstein_generator.build(attrs, rules[:3])
+        start = time.time()
+        canonical = einstein_cache.Canonical(solver.attrs, solver.list)
+        self.assertLess(time.time() - start, 1.0)
+        # значения без подсказок не перебираются
+        self.assertLess(canonical.nodes, 10)
+
+    def test_search_without_canonical_form_in_max_nodes(self):
+        lines = (["attributes"] + ["a" + str(i) + ":" + " ".join("abcdef") for i in range(3)] + ["knowledge"] +
+                 ["different a0:" + value + " a1:" + value for value in "abcdef"])
+        (solver, queries) = einstein_parser.parse(lines)
+        self.assertRaises(ValueError, einstein_cache.Canonical, solver.attrs, solver.list, 2)
+
+        cache = einstein_cache.SolutionCache()
+        self.assertTrue(einstein_cache.search(solver, cache, max_nodes=2))
+        self.assertEqual(len(cache), 0)
+        self.assertTrue(solver.verify())
+
+    def test_hash_differs_for_other_clues(self):
+        lines = [line.replace('same color:green drink:coffee', 'same color:green drink:tea') for line in self.lines]
+        self.assertNotEqual(self.key(self.lines), self.key(lines))
+
+    def test_encode_decode(self):
+        (solver, queries) = einstein_parser.parse(self.lines)
+        solver.search()
+        canonical = einstein_cache.Canonical(solver.attrs, solver.list)
+
+        rows = canonical.encode(solver.assignment())
+
+        self.assertEqual(set(frozenset(entity) for entity in canonical.decode(rows)),
+                         set(frozenset(entity) for entity in solver.assignment()))
+
+    def test_search_uses_cached_solution_of_renamed_puzzle(self):
+        cache = einstein_cache.SolutionCache()
+        (solver, queries) = einstein_parser.parse(self.lines)
+        self.assertTrue(einstein_cache.search(solver, cache))
+        self.assertEqual(len(cache), 1)
+
+        (solver, queries) = einstein_parser.parse(self.renamed())
+        self.assertTrue(einstein_cache.search(solver, cache))
+
+        # решение из кэша, правила не вычислялись
+        self.assertEqual(solver.passes, 0)
+        self.assertEqual(solver.decided_count(), solver.relation_count())
+        self.assertEqual([str(atval) for (query, atval) in einstein_parser.answer(solver, queries)],
+                         ['nation:norwegian', 'nation:japanese'])
+        solver.solve()
+        self.assertTrue(solver.verify())
+
+    def test_search_caches_puzzle_without_solution(self):
+        text = ["attributes", "house:ordinal:1 3", "color:red green blue", "knowledge",
+                "offset:house:2 color:red color:green", "offset:house:2 color:blue color:green"]
+        cache = einstein_cache.SolutionCache()
+        (solver, queries) = einstein_parser.parse(text)
+        self.assertFalse(einstein_cache.search(solver, cache))
+
+        (solver, queries) = einstein_parser.parse(text)
+        self.assertFalse(einstein_cache.search(solver, cache))
+        self.assertEqual(solver.passes, 0)
+
+    def test_cache_evicts_least_recently_used(self):
+        cache = einstein_cache.SolutionCache(max_entries=2)
+        cache.put('a', [[0]])
+        cache.put('b', [[1]])
+        self.assertEqual(cache.get('a'), [[0]])
+
+        cache.put('c', [[2]])
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), [[0]])
+        self.assertEqual(cache.get('c'), [[2]])
+
+    def test_cache_file_persists(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'solutions.db')
+            cache = einstein_cache.SolutionCache(path)
+            cache.put('a', [[0, 1]])
+            cache.close()
+
+            cache = einstein_cache.SolutionCache(path)
+            self.assertEqual(cache.get('a'), [[0, 1]])
+            cache.close()
+
+    def test_batch_with_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'solutions.db')
+            puzzles = [(0, "\n".join(self.lines)), (1, "\n".join(self.renamed()))]
+            results = list(einstein_batch.solve_all(puzzles, workers=1, cache_path=path))
+
+            self.assertEqual(results[1]['answers'], {'beverage:water nation': 'nation:norwegian',
+                                                     'animal:okapi nation': 'nation:japanese'})
+            cache = einstein_cache.SolutionCache(path)
+            self.assertEqual(len(cache), 1)
+            cache.close()
+
+class SolveBudgetTests(unittest.TestCase):
+    def setUp(self):
+        (self.solver, queries) = einstein_parser.load(os.path.join(HERE, 'einstein.txt'))
+        self.solver.add(Subsets())
+
+    def test_fixpoint_without_limits(self):
+        decided = self.solver.decided_count()
+        result = self.solver.solve()
+
+        self.assertTrue(result.complete)
+        self.assertEqual(result.reason, 'fixpoint')
+        self.assertEqual(result.percent_decided(), 100.0)
+        self.assertEqual(len(result.facts), result.decided - decided)
+
+    def test_max_passes(self):
+        result = self.solver.solve(max_passes=2)
+
+        self.assertEqual(result.reason, 'passes')
+        self.assertEqual(self.solver.passes, 2)
+        self.assertLess(result.percent_decided(), 100.0)
+
+    def test_max_evaluations_stops_inside_pass(self):
+        result = self.solver.solve(max_evaluations=50)
+
+        self.assertEqual(result.reason, 'evaluations')
+        self.assertEqual(self.solver.passes, 1)
+        self.assertTrue(all(isinstance(fact, (Same, Different)) for fact in result.facts))
+
+    def test_deadline(self):
+        result = self.solver.solve(deadline=time.time())
+        self.assertEqual(result.reason, 'deadline')
+        self.assertEqual(result.decisions, [])
+
+    def test_partial_solves_continue_to_same_fixpoint(self):
+        decided = self.solver.decided_count()
+        # по 30 вычислений правил за раз
+        results = []
+        while not results or not results[-1].complete:
+            results.append(self.solver.solve(max_evaluations=30))
+
+        self.assertGreater(len(results), 10)
+        self.assertEqual(results[-1].percent_decided(), 100.0)
+        self.assertEqual(sum(len(result.decisions) for result in results), self.solver.relation_count() - decided)
+
+    def test_str(self):
+        result = self.solver.solve(max_passes=1)
+        self.assertRegex(str(result), r"^passes: \d+ facts, \d+\.\d% of relations decided$")
+
+class ServiceTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(os.path.join(HERE, 'einstein.txt'), encoding='utf-8') as f:
+            cls.text = f.read()
+        cls.client = einstein_service.Client(workers=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.client.close()
+
+    def test_solve(self):
+        result = self.client.solve(self.text)
+        self.assertEqual(result, {
+            'solved': True,
+            'answers': {'drink:water nation': 'nation:norwegian', 'animal:zebra nation': 'nation:japanese'}})
+
+    def test_identical_puzzles_are_coalesced(self):
+        before = self.client.metrics()
+
+        results = self.client.solve_all([self.text] * 3)
+
+        metrics = self.client.metrics()
+        self.assertTrue(all(result['solved'] for result in results))
+        self.assertEqual(metrics['computations'] - before['computations'], 1)
+        self.assertEqual(metrics['coalesced'] - before['coalesced'], 2)
+        self.assertEqual(metrics['in_flight'], 0)
+        self.assertEqual(metrics['waiting'], 0)
+        self.assertGreaterEqual(metrics['latency']['count'], 3)
+
+    def test_timeout(self):
+        before = self.client.metrics()
+        result = self.client.solve(self.text, timeout=0)
+        self.assertFalse(result['solved'])
+        self.assertTrue(result['timeout'])
+        self.assertEqual(self.client.metrics()['timeouts'] - before['timeouts'], 1)
+
+    def test_request_with_later_deadline_is_not_coalesced(self):
+        before = self.client.metrics()
+
+        results = self.client.loop.run_until_complete(self.solve_with_timeouts([0, None]))
+
+        self.assertTrue(results[0]['timeout'])
+        self.assertTrue(results[1]['solved'])
+        self.assertEqual(self.client.metrics()['computations'] - before['computations'], 2)
+
+    async def solve_with_timeouts(self, timeouts):
+        service = self.client.service
+        return await asyncio.gather(*(service.solve(self.text, timeout) for timeout in timeouts))
+
+    def test_parse_error(self):
+        result = self.client.solve("attributes\ncolor:red\nknowledge\nsame color:red")
+        self.assertFalse(result['solved'])
+        self.assertIn('error', result)
+
+    def test_failed_computation_is_an_error_of_every_request(self):
+        class BrokenExecutor(concurrent.futures.ThreadPoolExecutor):
+            def submit(self, fn, *args):
+                future = concurrent.futures.Future()
+                future.set_exception(RuntimeError("worker died"))
+                return future
+
+        with einstein_service.Client(executor=BrokenExecutor(1)) as client:
+            results = client.solve_all([self.text] * 2)
+            metrics = client.metrics()
+
+        self.assertEqual([result['solved'] for result in results], [False, False])
+        self.assertTrue(all('worker died' in result['error'] for result in results))
+        self.assertEqual(metrics['errors'], 2)
+        self.assertEqual(metrics['in_flight'], 0)
+
+    def test_search_raises_timeout_after_deadline(self):
+        (solver, queries) = einstein_parser.load(os.path.join(HERE, 'einstein.txt'))
+        solver.deadline = time.time()
+        self.assertRaises(Timeout, solver.search)
+
+        solver.deadline = None
+        self.assertTrue(solver.search())
+
+class SnapshotTests(unittest.TestCase):
+    def setUp(self):
+        (self.solver, self.queries) = einstein_parser.load(os.path.join(HERE, 'einstein.txt'))
+        self.solver.add(Subsets())
+
+    def assert_same_state(self, solver, other):
+        self.assertEqual([str(attr) for attr in other.attrs], [str(attr) for attr in solver.attrs])
+        self.assertEqual([str(rule) for rule in other.list], [str(rule) for rule in solver.list])
+        self.assertEqual([(relation in other, other.is_same(relation)) for relation in other.relations()],
+                         [(relation in solver, solver.is_same(relation)) for relation in solver.relations()])
+
+    def test_restored_solve_continues_to_the_solution(self):
+        self.solver.solve(max_passes=2)
+
+        restored = einstein_snapshot.loads(einstein_snapshot.dumps(self.solver))
+
+        self.assert_same_state(self.solver, restored)
+        restored.solve()
+        self.solver.solve()
+        self.assert_same_state(self.solver, restored)
+        self.assertEqual(restored.decided_count(), restored.relation_count())
+
+    def test_decided_relations_are_bit_packed(self):
+        size = len(einstein_snapshot.dumps(self.solver))
+        self.solver.solve()
+        data = einstein_snapshot.dumps(self.solver)
+
+        self.assertEqual(len(data), size)
+        # 375 отношений - по 47 байт на решённые и на Same
+        self.assertEqual(bin(int.from_bytes(data[-94:-47], 'little')).count('1'), 375)
+        self.assertEqual(bin(int.from_bytes(data[-47:], 'little')).count('1'), 75)
+        self.assertLess(len(data), 1000)
+
+    def test_all_rule_kinds(self):
+        text = ["attributes", "house:ordinal:1 3", "color:red green blue", "nation:english spanish norwegian", "knowledge",
+                "left:house color:red color:blue", "right:house color:green color:blue", "not color:red nation:english",
+                "either nation:english color:green color:blue", "same house:2 nation:norwegian",
+                "offset:house:1 color:red nation:norwegian", "dist:house:1 color:green nation:norwegian",
+                "apart:house:2 color:red color:green", "before:house:1 nation:spanish color:blue"]
+        (solver, queries) = einstein_parser.parse(text)
+
+        restored = einstein_snapshot.loads(einstein_snapshot.dumps(solver))
+
+        self.assertEqual(einstein_cache.Canonical(restored.attrs, restored.list).text,
+                         einstein_cache.Canonical(solver.attrs, solver.list).text)
+        self.assertEqual([[str(atval) for atval in entity] for entity in restored.count_solutions(limit=3)[0]],
+                         [[str(atval) for atval in entity] for entity in solver.count_solutions(limit=3)[0]])
+
+    # атрибуты не по порядку: биты идут по Relation.id, порядок атрибутов сохраняется
+    def test_attributes_out_of_order(self):
+        color = Attr('color', 2, ['red', 'green', 'blue'])
+        house = Ordinal('house', 0, 1, 3)
+        nation = Attr('nation', 1, ['english', 'spanish', 'norwegian'])
+        solver = Solver([color, house, nation])
+        solver.add(Exclusive())
+        solver.add(Same.of(color.red, house[1]))
+        solver.add(Same.of(nation.spanish, house[2]))
+        solver.solve()
+
+        restored = einstein_snapshot.loads(einstein_snapshot.dumps(solver))
+
+        self.assertEqual([attr.order for attr in restored.attrs], [2, 0, 1])
+        self.assert_same_state(solver, restored)
+
+    def test_save_and_load_file(self):
+        self.solver.solve()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'einstein.snapshot')
+            einstein_snapshot.save(self.solver, path)
+
+            restored = einstein_snapshot.load(path)
+
+        self.assert_same_state(self.solver, restored)
+
+    def test_rejects_other_data(self):
+        data = einstein_snapshot.dumps(self.solver)
+        self.assertRaises(ValueError, einstein_snapshot.loads, b'XXXX' + data[4:])
+        self.assertRaises(ValueError, einstein_snapshot.loads,
+                          data[:4] + (einstein_snapshot.VERSION + 1).to_bytes(2, 'little') + data[6:])
+
+    def test_rule_without_format(self):
+        relation = self.solver.relation(self.solver.attrs[1].red, self.solver.attrs[2].english)
+        self.solver.add(Either([relation]))
+        self.assertRaises(ValueError, einstein_snapshot.dumps, self.solver)
+
+class GeneratorTests(unittest.TestCase):
+    def test_generate_is_reproducible_with_seed(self):
+        (attrs1, rules1) = einstein_generator.generate(4, 4, seed=7)
+        (attrs2, rules2) = einstein_generator.generate(4, 4, seed=7)
+        self.assertEqual([str(rule) for rule in rules1], [str(rule) for rule in rules2])
+
+    def test_generated_puzzle_is_solved_by_propagation(self):
+        (attrs, rules) = einstein_generator.generate(4, 5, seed=3)
+        solver = einstein_generator.build(attrs, rules)
+
+        solver.solve()
+
+        self.assertEqual(solver.decided_count(), solver.relation_count())
+        self.assertTrue(solver.verify())
+
+    def test_generate_uses_only_weighted_clues(self):
+        (attrs, rules) = einstein_generator.generate(3, 4, seed=1, weights=(1, 0, 0))
+        self.assertTrue(all(isinstance(rule, Same) for rule in rules))
+
+    def assert_minimal(self, attrs, rules):
+        solver = einstein_generator.build(attrs, rules)
+        solver.solve()
+        self.assertEqual(solver.decided_count(), solver.relation_count())
+        for rule in rules:
+            solver = einstein_generator.build(attrs, [other for other in rules if other is not rule])
+            solver.solve()
+            self.assertLess(solver.decided_count(), solver.relation_count())
+
+    def test_minimize_keeps_only_necessary_clues(self):
+        (attrs, rules) = einstein_generator.generate(4, 4, seed=2)
+
+        minimal = einstein_generator.minimize(attrs, rules)
+
+        self.assertLess(len(minimal), len(rules))
+        self.assertTrue(all(rule in rules for rule in minimal))
+        self.assert_minimal(attrs, minimal)
+
+    def test_minimize_in_batches_with_workers(self):
+        (attrs, rules) = einstein_generator.generate(4, 4, seed=5)
+
+        minimal = einstein_generator.minimize(attrs, rules, workers=2, batch=3)
+
+        self.assert_minimal(attrs, minimal)
+
+    def test_minimize_does_not_test_necessary_clues_again(self):
+        tested = []
+        test = einstein_generator.Minimizer.test
+
+        def record(minimizer, necessary, others, removed=None):
+            tested.append((necessary, removed))
+            return test(minimizer, necessary, others, removed)
+
+        (attrs, rules) = einstein_generator.generate(4, 4, seed=5)
+        einstein_generator.Minimizer.test = record
+        try:
+            minimal = einstein_generator.minimize(attrs, rules, batch=4)
+        finally:
+            einstein_generator.Minimizer.test = test
+
+        self.assertFalse([(necessary, removed) for (necessary, removed) in tested if removed in necessary])
+        self.assert_minimal(attrs, minimal)
+
+    def test_minimize_rejects_unsolved_puzzle(self):
+        (attrs, rules) = einstein_generator.generate(4, 4, seed=2)
+        self.assertRaises(ValueError, einstein_generator.minimize, attrs, rules[:1])
+
+    def test_used_rules_are_enough(self):
+        (attrs, rules) = einstein_generator.generate(4, 4, seed=2)
+        solver = einstein_generator.build(attrs, rules)
+        solver.solve()
+
+        used = [rule for rule in rules if rule in solver.used_rules()]
+        solver = einstein_generator.build(attrs, used)
+        solver.solve()
+
+        self.assertEqual(solver.decided_count(), solver.relation_count())
+
+class PuzzleTests(unittest.TestCase):
+    def setUp(self):
+        parser = einstein_parser.PuzzleParser()
+        with open(os.path.join(HERE, 'einstein.txt'), encoding='utf-8') as lines:
+            for line in lines:
+                parser.feed(line)
+        self.parser = parser
+        self.puzzle = Puzzle(parser.attrs, [Exclusive(), Subsets()] + parser.rules)
+
+    def answers(self, solver):
+        return [str(atval) for (query, atval) in einstein_parser.answer(solver, self.parser.queries)]
+
+    def test_solvers_share_relations_and_rules(self):
+        solver1 = self.puzzle.solver()
+        solver2 = self.puzzle.solver()
+
+        self.assertIs(solver1.relation_list, solver2.relation_list)
+        self.assertIs(solver1.list, solver2.list)
+        self.assertEqual(solver1.decided_count(), solver2.decided_count())
+        self.assertGreater(solver1.decided_count(), 0)
+
+    def test_interleaved_solves(self):
+        solver1 = self.puzzle.solver()
+        solver2 = self.puzzle.solver()
+
+        solver1.solve(max_passes=1)
+        decided = solver1.decided_count()
+        solver2.solve()
+        self.assertEqual(solver1.decided_count(), decided)
+        solver1.solve()
+
+        self.assertEqual(self.answers(solver1), ['nation:norwegian', 'nation:japanese'])
+        self.assertEqual(self.answers(solver2), ['nation:norwegian', 'nation:japanese'])
+        self.assertTrue(solver1.verify())
+
+    def test_added_rule_stays_in_its_solver(self):
+        solver1 = self.puzzle.solver()
+        solver2 = self.puzzle.solver()
+        (house, color) = self.parser.attrs[:2]
+        rules = len(self.puzzle.rules)
+
+        solver1.add(Same.of(house[1], color.yellow))
+
+        self.assertTrue(solver1.is_same(solver1.relation(house[1], color.yellow)))
+        self.assertFalse(solver2.is_same(solver2.relation(house[1], color.yellow)))
+        self.assertEqual(len(solver1.list), rules + 1)
+        self.assertEqual(len(self.puzzle.rules), rules)
+        self.assertEqual(len(solver2.list), rules)
+        solver2.solve()
+        self.assertEqual(solver2.decided_count(), solver2.relation_count())
+
+    def test_copy_is_independent(self):
+        solver = self.puzzle.solver()
+        solver.solve(max_passes=2)
+        decided = solver.decided_count()
+
+        branch = solver.copy()
+        branch.solve()
+
+        self.assertEqual(solver.decided_count(), decided)
+        self.assertEqual(branch.decided_count(), branch.relation_count())
+        (relation, same, source, premises) = branch.explain(branch.relation_list[-1])[-1]
+        self.assertIs(relation, branch.relation_list[-1])
+
+    # варианты задачи, отличающиеся одной подсказкой
+    def test_copy_with_rules_of_its_own(self):
+        (house, color) = self.parser.attrs[:2]
+        solver = self.puzzle.solver()
+        solver.add(Subsets(2))
+        rules = len(solver.list)
+
+        variant = solver.copy()
+        variant.add(Same.of(house[1], color.yellow))
+
+        self.assertEqual(len(solver.list), rules)
+        self.assertEqual(len(variant.list), rules + 1)
+        self.assertFalse(solver.is_same(solver.relation(house[1], color.yellow)))
+        variant.solve()
+        self.assertTrue(variant.verify())
+        solver.solve()
+        self.assertTrue(solver.verify())
+
+    def test_solvers_of_one_puzzle_in_threads(self):
+        (attrs, rules) = einstein_generator.generate(8, 8, seed=4)
+        puzzle = Puzzle(attrs, [Exclusive()] + rules[8:])
+
+        def solve(rule):
+            solver = puzzle.solver()
+            try:
+                solver.add(rule)
+                solver.solve()
+            except Contradiction:
+                return None
+            return [(matrix.same, matrix.different) for matrix in solver.matrices.values()]
+
+        expected = [solve(rule) for rule in rules[:8]]
+        with concurrent.futures.ThreadPoolExecutor(8) as executor:
+            for _ in range(2):
+                self.assertEqual(list(executor.map(solve, rules[:8])), expected)
+
+    def test_entity_sources_follow_the_copy(self):
+        solver = self.puzzle.solver()
+        entities = [entry for entry in solver.trail if entry[2] is solver.entities]
+        self.assertGreater(len(entities), 0)
+        self.assertTrue(all(entry[2] is not self.puzzle.root.entities for entry in solver.trail))
+
+    def test_parser_puzzle(self):
+        solver = self.parser.puzzle().solver()
+        self.assertTrue(solver.search())
+        self.assertEqual(self.answers(solver), ['nation:norwegian', 'nation:japanese'])
+
+    def test_solver_keeps_its_own_puzzle(self):
+        solver = Solver(self.parser.attrs)
+        solver.add(Exclusive())
+        self.assertEqual(solver.puzzle.rules, [])
+        self.assertEqual(len(solver.list), 1)
+
+class SatTests(unittest.TestCase):
+    def test_cdcl_finds_model(self):
+        clauses = [[1, 2], [-1, 3], [-2, 3], [-3, 4], [-4, -1]]
+        model = einstein_sat.CDCL(4, clauses).solve()
+        self.assertTrue(all(any(literal in model for literal in clause) for clause in clauses))
+
+    def test_cdcl_proves_pigeonhole_unsatisfiable(self):
+        # 4 голубя в 3 клетках, переменная 3*p + h + 1 - голубь p в клетке h
+        clauses = [[3*pigeon + hole + 1 for hole in range(3)] for pigeon in range(4)]
+        for hole in range(3):
+            for pigeon1 in range(4):
+                for pigeon2 in range(pigeon1 + 1, 4):
+                    clauses.append([-(3*pigeon1 + hole + 1), -(3*pigeon2 + hole + 1)])
+        self.assertEqual(einstein_sat.CDCL(12, clauses).solve(), None)
+
+    def test_cdcl_raises_timeout_on_restart_after_deadline(self):
+        # 7 голубей в 6 клетках
+        clauses = [[6*pigeon + hole + 1 for hole in range(6)] for pigeon in range(7)]
+        for hole in range(6):
+            for pigeon1 in range(7):
+                for pigeon2 in range(pigeon1 + 1, 7):
+                    clauses.append([-(6*pigeon1 + hole + 1), -(6*pigeon2 + hole + 1)])
+        self.assertRaises(Timeout, einstein_sat.CDCL(42, clauses).solve, time.time())
+
+    def test_backend_stops_at_deadline(self):
+        parser = einstein_parser.PuzzleParser()
+        with open(os.path.join(HERE, 'einstein.txt'), encoding='utf-8') as lines:
+            for line in lines:
+                parser.feed(line)
+        sat_solver = parser.puzzle().solver(einstein_sat.SatBackend)
+
+        result = sat_solver.solve(deadline=time.time())
+
+        self.assertEqual(result.reason, 'deadline')
+        self.assertEqual(sat_solver.passes, 0)
+        self.assertEqual(sat_solver.solve(max_passes=1).reason, 'fixpoint')
+        self.assertTrue(sat_solver.verify())
+
+    def test_solution_satisfies_cnf(self):
+        (solver, queries) = einstein_parser.load(os.path.join(HERE, 'einstein.txt'))
+        cnf = einstein_sat.CNF(solver)
+        solver.search()
+        model = [relation.id + 1 if solver.is_same(relation) else -(relation.id + 1) for relation in solver.relations()]
+        self.assertTrue(all(any(literal in model for literal in clause) for clause in cnf.clauses))
+
+    def test_dimacs(self):
+        (solver, queries) = einstein_parser.load(os.path.join(HERE, 'einstein.txt'))
+        lines = einstein_sat.CNF(solver).dimacs()
+        self.assertEqual(lines[0], "p cnf 375 " + str(len(lines) - 1))
+        self.assertTrue(all(line.endswith(" 0") for line in lines[1:]))
+
+    def test_backend_solves_einstein(self):
+        parser = einstein_parser.PuzzleParser()
+        with open(os.path.join(HERE, 'einstein.txt'), encoding='utf-8') as lines:
+            for line in lines:
+                parser.feed(line)
+        solver = Solver(parser.attrs, backend=einstein_sat.SatBackend)
+        for rule in [Exclusive()] + parser.rules:
+            solver.add(rule)
+
+        solver.solve()
+
+        self.assertEqual(solver.decided_count(), solver.relation_count())
+        self.assertEqual([str(atval) for (query, atval) in einstein_parser.answer(solver, parser.queries)],
+                         ['nation:norwegian', 'nation:japanese'])
+
+    def test_backend_matches_propagation_on_generated_puzzles(self):
+        for seed in range(3):
+            (attrs, rules) = einstein_generator.generate(4, 5, seed=seed)
+            solver = einstein_generator.build(attrs, rules)
+            solver.solve()
+            sat_solver = einstein_generator.build(attrs, rules, einstein_sat.SatBackend)
+            sat_solver.solve()
+            self.assertEqual(sat_solver.assignment(), solver.assignment())
+
+    def test_backend_encodes_comparisons_and_either(self):
+        text = ["attributes", "house:ordinal:1 3", "color:red green blue", "nation:english spanish norwegian", "knowledge",
+                "left:house color:red color:blue", "right:house color:green color:blue", "not color:red nation:english",
+                "either nation:english color:green color:blue", "same house:2 nation:norwegian"]
+        (solver, queries) = einstein_parser.parse(text)
+        (expected,) = solver.count_solutions()
+        solver.backend = einstein_sat.SatBackend(solver)
+
+        solver.solve()
+
+        self.assertEqual(solver.assignment(), expected)
+
+    def test_backend_raises_contradiction_without_solution(self):
+        (attrs, rules) = einstein_generator.generate(3, 3, seed=1)
+        (position, attr1, attr2) = attrs
+        solver = einstein_generator.build(attrs, [Offset(attr1.v1, attr1.v2, position, 2),
+                                                  Offset(attr1.v3, attr1.v2, position, 2)], einstein_sat.SatBackend)
+        with self.assertRaises(Contradiction) as raised:
+            solver.solve()
+        self.assertIsInstance(raised.exception.relation, Relation)
+        self.assertIs(raised.exception.rule, solver.backend)
+
+    def test_backend_counts_every_solution(self):
+        solver = Solver([Attr('a', 0, [1, 2, 3]), Attr('b', 1, ['x', 'y', 'z'])], einstein_sat.SatBackend)
+        solver.add(Exclusive())
+
+        solver.solve()
+
+        # перестановки различаются в каждом отношении, ни одно не решено
+        self.assertEqual(solver.decided_count(), 0)
+        self.assertEqual(len(solver.count_solutions(10)), 6)
+
+    def test_backend_counts_solutions_of_underclued_puzzles(self):
+        for seed in range(3):
+            (attrs, rules) = einstein_generator.generate(4, 4, seed=seed)
+            half = rules[:len(rules) // 2]
+            expected = einstein_generator.build(attrs, half).count_solutions(1000)
+            sat_solver = einstein_generator.build(attrs, half, einstein_sat.SatBackend)
+            self.assertEqual(sorted(map(str, sat_solver.count_solutions(1000))), sorted(map(str, expected)))
+
+    def test_literal_of_one_attribute_raises(self):
+        (solver, queries) = einstein_parser.load(os.path.join(HERE, 'einstein.txt'))
+        cnf = einstein_sat.CNF(solver)
+        color = solver.attrs[1]
+        self.assertRaises(ValueError, cnf.literal, color.ordered_values[0], color.ordered_values[1])
+
+    def test_rule_without_encoding(self):
+        class Unknown:
+            def watches(self):
+                return ()
+
+            def candidates(self, solver):
+                return ()
+
+        (attrs, rules) = einstein_generator.generate(3, 3, seed=1)
+        solver = einstein_generator.build(attrs, [Unknown()], einstein_sat.SatBackend)
+        self.assertRaises(ValueError, solver.solve)
+
+class BenchTests(unittest.TestCase):
+    def test_bench_reports_counters(self):
+        (result,) = einstein_bench.bench([(3, 3)], puzzles=1, seed=5)
+        self.assertEqual(result['size'], '3x3')
+        self.assertEqual(result['decided'], result['relations'])
+        self.assertGreater(result['evaluations'], 0)
+        self.assertGreater(result['passes'], 0)
+        self.assertGreater(result['peak_bytes'], 0)
+
+    def test_bench_with_sat_backend(self):
+        (result,) = einstein_bench.bench([(3, 3)], puzzles=1, seed=5, backend=einstein_sat.SatBackend)
+        self.assertEqual(result['decided'], result['relations'])
+
 if __name__ == '__main__':
     unittest.main()
 